@@ -9,6 +9,7 @@ class NonWikipediaLink(ThisAppException):
     def __init__(self, man_name: str, link: str) -> None:
         message = "link is not wikipedia : " + link + " [" + man_name + "]"
         super().__init__(message)
+        self.man_name = man_name
 
 
 class ElementNotFound(ThisAppException):
@@ -17,6 +18,7 @@ class ElementNotFound(ThisAppException):
     def __init__(self, man_name: str) -> None:
         message = f"railroad section not found : {man_name}"
         super().__init__(message)
+        self.man_name = man_name
 
 
 class CannotOpenURL(ThisAppException):
@@ -32,3 +34,4 @@ class NoDateInfo(ThisAppException):
     def __init__(self, man_name: str) -> None:
         message = f"no date information : {man_name}"
         super().__init__(message)
+        self.man_name = man_name
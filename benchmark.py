@@ -0,0 +1,726 @@
+"""ベンチマーク
+
+保存済みのhtmlを使って処理時間を測る. ネットワークにはアクセスしない.
+
+    python benchmark.py extract [--limit N]
+    python benchmark.py links [--limit N]
+    python benchmark.py record [--corpus DIR] [--limit N] [--api-responses DIR]
+    python benchmark.py crawl [--corpus DIR] [--limit N] [--results PATH] [--label L]
+
+recordは保存済みの自治体ページと駅ページキャッシュから再生用のページの集まり（replay.py）を作る.
+--api-responsesを付けると, そのディレクトリにあるAPIの応答（*.json）のウィキテキストも加える.
+crawlはそれをローカルの再生サーバーから返し, 空の作業ディレクトリで駅リンクの取得・駅ページの取得と解析・
+収集パイプライン全体をそれぞれ別のプロセスで実行して, 速度とピークのメモリ使用量を結果ファイルに追記する.
+その前にcollectorの読み込みとCollectorの作成にかかる時間（起動時間）も新しいプロセスで測る.
+
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import logging
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from statistics import median
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logzero
+from bs4 import BeautifulSoup
+from bs4.element import Tag
+from appexcp.my_exception import ElementNotFound, ThisAppException
+from collector import Collector
+from crawl import WIKI_ORIGIN, Crawler
+from filemanager import file_manager
+from infobox import available_engines
+from page_cache import station_page_cache
+from replay import ReplayCorpus, ReplayServer
+from resolver import title_to_url
+from revision import url_to_title
+from settings import (
+    EXTRACTOR_ENGINE,
+    PIPELINE_FETCH_WORKERS,
+    STATION_CACHE_DIR,
+    STATION_FETCH_BACKEND,
+    STREAM_STATION_PAGES,
+    WIKI_STORAGE_DIR,
+)
+
+try:
+    import resource
+except ImportError:  # Windowsではメモリ使用量を測らない.
+    resource = None
+
+# crawlで実行する段階. それぞれ空の作業ディレクトリを使う別のプロセスで実行する.
+CRAWL_PHASES = ("links", "stations", "run")
+# 起動時間を測る回数（中央値をとる）と, 起動時に読み込まれたかを調べる重いモジュール.
+STARTUP_RUNS = 3
+HEAVY_MODULES = ("selenium", "chromedriver_binary", "bs4", "soupsieve", "lxml")
+# 起動時間を測るプロセスで実行するスクリプト. このモジュールはcollectorなどを読み込むので使わない.
+STARTUP_SCRIPT = """
+import sys, json
+from time import perf_counter
+start = perf_counter()
+from collector import Collector
+imported = perf_counter()
+Collector()
+print(json.dumps({
+    "import_sec": imported - start,
+    "init_sec": perf_counter() - imported,
+    "modules": [name for name in sys.modules if "." not in name],
+}))
+"""
+
+
+def iter_corpus(
+    limit: int = 0, dirs: Tuple[str, ...] = (WIKI_STORAGE_DIR, STATION_CACHE_DIR)
+) -> Iterator[Tuple[str, bytes]]:
+    """保存済みのhtmlを(ファイルパス, htmlソース)で順に返す.
+
+    自治体ページ（WIKI_STORAGE_DIRの.htmlとパック）と駅ページキャッシュ（STATION_CACHE_DIRの.html.gz）を対象にする.
+    パックの自治体ページのパスは「パックのパス/自治体名.html」とする.
+
+    Args:
+        limit (int, optional): 返す最大数. 0なら全て.
+        dirs (Tuple[str, ...], optional): 対象のディレクトリ.
+    """
+    count = 0
+    packed_names = set()
+    if file_manager.wiki_pack is not None and WIKI_STORAGE_DIR in dirs:
+        for man_name, html in file_manager.wiki_pack.items():
+            packed_names.add(man_name + ".html")
+            path = os.path.join(file_manager.wiki_pack.path, man_name + ".html")
+            yield path, html.encode("utf-8")
+            count += 1
+            if limit and count >= limit:
+                return
+    for root_dir in dirs:
+        if not root_dir or not os.path.isdir(root_dir):
+            continue
+        for dir_path, _, file_names in os.walk(root_dir):
+            for file_name in sorted(file_names):
+                path = os.path.join(dir_path, file_name)
+                if file_name.endswith(".html.gz"):
+                    with gzip.open(path, "rb") as f:
+                        yield path, f.read()
+                elif file_name.endswith(".html") and file_name not in packed_names:
+                    with open(path, "rb") as f:
+                        yield path, f.read()
+                else:
+                    continue
+                count += 1
+                if limit and count >= limit:
+                    return
+
+
+def time_call(func: Callable, *args) -> Tuple[float, object]:
+    """関数を一度呼んで(経過秒数, 返り値)を返す."""
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+def bench_extract(limit: int = 0) -> Dict[str, Dict[str, float]]:
+    """駅ページ解析のベンチマーク
+
+    BeautifulSoupによる解析と高速な抽出エンジンそれぞれで所在地リストと開業年を取得し,
+    時間と結果の一致を調べる.
+
+    Args:
+        limit (int, optional): 対象にするファイルの最大数. 0なら全て.
+
+    Returns:
+        Dict[str, Dict[str, float]]: エンジン名がキー, 合計秒数・速度比・不一致数が値の辞書.
+    """
+    engines: List[str] = ["soup"] + available_engines()
+    crawlers = {engine: Crawler(extractor_engine=engine) for engine in engines}
+    totals = {engine: 0.0 for engine in engines}
+    mismatches = {engine: 0 for engine in engines}
+    pages = 0
+    for path, html in iter_corpus(limit):
+        pages += 1
+        expected = None
+        for engine in engines:
+            elapsed, result = time_call(crawlers[engine].parse_station_page, html)
+            totals[engine] += elapsed
+            if expected is None:
+                expected = result
+            elif result != expected:
+                mismatches[engine] += 1
+                print(f"mismatch ({engine}) : {path}")
+    report: Dict[str, Dict[str, float]] = {}
+    for engine in engines:
+        report[engine] = {
+            "total_sec": totals[engine],
+            "ms_per_page": totals[engine] / pages * 1000 if pages else 0.0,
+            "speedup": totals["soup"] / totals[engine] if totals[engine] else 0.0,
+            "mismatches": mismatches[engine],
+        }
+    print(f"{pages} pages")
+    for engine, row in report.items():
+        print(
+            f"{engine:>10} : {row['ms_per_page']:8.2f} ms/page, "
+            f"x{row['speedup']:.1f}, mismatches {row['mismatches']}"
+        )
+    return report
+
+
+def legacy_extract_station_links(
+    man_name: str, html: str
+) -> Tuple[Dict[str, str], str]:
+    """抽出プランを導入する前の駅リンク抽出. 比較のためだけに残している."""
+    soup = BeautifulSoup(html, "html.parser")
+    base_tags: List[Tag] = []
+    for base_tag_name in ("h3", "h4", "h2"):
+        base_tags = soup.select(
+            ",".join(
+                [
+                    f"{base_tag_name}:has( > span#{text})"
+                    for text in Collector.RAILWAY_TAG_ID
+                ]
+            )
+        )
+        if base_tags:
+            break
+    if not base_tags:
+        raise ElementNotFound(man_name)
+    railroad_blocks: List[Tag] = []
+    for base_tag in base_tags:
+        next_tag = base_tag.find_next_sibling()
+        while type(next_tag) is Tag and next_tag.name != base_tag_name:
+            if (
+                "class" not in next_tag.attrs
+                or "gallery" not in next_tag.attrs["class"]
+            ):
+                railroad_blocks.append(next_tag)
+            next_tag = next_tag.find_next_sibling()
+    warning_text = ""
+    if abandoned_line := soup.select_one(
+        ",".join([f"#{text}" for text in Collector.ABANDONED_LINE_TEXT])
+    ):
+        warning_text = (
+            f"abandoned line may exist : {abandoned_line.attrs['id']} : {man_name}"
+        )
+    else:
+        for block in railroad_blocks:
+            for text in Collector.ABANDONED_LINE_TEXT:
+                if block.select_one(f"*:-soup-contains('{text}')"):
+                    warning_text = f"abandoned line may exist : {text} : {man_name}"
+                    break
+            if warning_text:
+                break
+            if block.select_one("p:-soup-contains('かつては')"):
+                warning_text = f"abandoned line may exist : かつては... : {man_name}"
+                break
+    result_dict: Dict[str, str] = {}
+    for block in railroad_blocks:
+        for link in block.select("a:-soup-contains('駅'),a:-soup-contains('停留場')"):
+            sta_name = link.get_text()
+            if all(
+                (
+                    sta_name.endswith(("駅", "停留場"))
+                    and (non_proper_text not in re.sub("駅|停留場", "", sta_name))
+                    and sta_name != "駅"
+                    and sta_name != "停留場"
+                )
+                for non_proper_text in Collector.NON_PROPER_NAME
+            ):
+                result_dict[sta_name] = link.attrs["href"]
+    return result_dict, warning_text
+
+
+def bench_links(limit: int = 0) -> Dict[str, Dict[str, float]]:
+    """自治体ページからの駅リンク抽出のベンチマーク
+
+    抽出プランを使う現在の方法と, 以前のセレクタを毎回組み立てる方法を比べる.
+
+    Args:
+        limit (int, optional): 対象にするファイルの最大数. 0なら全て.
+
+    Returns:
+        Dict[str, Dict[str, float]]: 方法の名前がキー, 自治体あたりのミリ秒などが値の辞書.
+    """
+    plan = Collector.default_extraction_plan()
+    methods: Dict[str, Callable] = {
+        "legacy": legacy_extract_station_links,
+        "plan": plan.extract,
+    }
+    totals = {name: 0.0 for name in methods}
+    mismatches = 0
+    pages = 0
+    for path, html in iter_corpus(limit, (WIKI_STORAGE_DIR,)):
+        man_name = os.path.splitext(os.path.basename(path))[0]
+        text = html.decode("utf-8")
+        pages += 1
+        results = {}
+        for name, method in methods.items():
+            start = perf_counter()
+            try:
+                results[name] = method(man_name, text)
+            except ElementNotFound as e:
+                results[name] = str(e)
+            totals[name] += perf_counter() - start
+        if results["legacy"] != results["plan"]:
+            mismatches += 1
+            print(f"mismatch : {path}")
+    report = {
+        name: {
+            "ms_per_municipality": totals[name] / pages * 1000 if pages else 0.0,
+            "speedup": totals["legacy"] / totals[name] if totals[name] else 0.0,
+        }
+        for name in methods
+    }
+    print(f"{pages} municipalities, mismatches {mismatches}")
+    for name, row in report.items():
+        print(
+            f"{name:>10} : {row['ms_per_municipality']:8.2f} ms/municipality, "
+            f"x{row['speedup']:.1f}"
+        )
+    return report
+
+
+def record_corpus(
+    corpus_dir: str, limit: int = 0, api_responses_dir: str = ""
+) -> ReplayCorpus:
+    """保存済みのページから再生用のページの集まりを作る.
+
+    自治体リストの順に, 保存済みのhtmlがあり記事名が分かる自治体のページと,
+    そこから取り出した駅リンクのうち駅ページキャッシュにあるものを加える.
+
+    Args:
+        corpus_dir (str): 保存するディレクトリ.
+        limit (int, optional): 自治体の最大数. 0なら全て.
+        api_responses_dir (str, optional): 記録したAPIの応答（*.json）のディレクトリ. 空なら加えない.
+
+    Returns:
+        ReplayCorpus: 作ったページの集まり.
+    """
+    collector = Collector()
+    corpus = ReplayCorpus(corpus_dir)
+    for man_name in collector.target_man_names():
+        if limit and len(corpus.municipalities) >= limit:
+            break
+        html = file_manager.load_local_html(man_name)
+        url = collector.saved_municipality_url(man_name)
+        if html is None or url is None or (title := url_to_title(url)) is None:
+            continue
+        try:
+            links, _ = collector.extraction_plan.extract(man_name, html)
+        except ThisAppException:
+            links = {}
+        corpus.add_municipality(man_name, title, html.encode("utf-8"))
+        for sta_link in links.values():
+            sta_title = url_to_title(sta_link)
+            if sta_title is None or sta_title in corpus:
+                continue
+            if cache_entry := station_page_cache.get(WIKI_ORIGIN + sta_link):
+                corpus.add_page(sta_title, cache_entry.html, station=True)
+    wikitexts = 0
+    if api_responses_dir:
+        for file_name in sorted(os.listdir(api_responses_dir)):
+            if file_name.endswith(".json"):
+                path = os.path.join(api_responses_dir, file_name)
+                with open(path, encoding="utf-8") as f:
+                    wikitexts += corpus.add_api_response(json.load(f))
+    corpus.save()
+    print(
+        f"recorded {len(corpus.municipalities)} municipalities, "
+        f"{len(corpus.stations)} stations, {wikitexts} wikitexts : {corpus_dir}"
+    )
+    return corpus
+
+
+def peak_rss_mb() -> Optional[float]:
+    """このプロセスのピークのメモリ使用量（MB）. 測れなければNone."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linuxではキロバイト, macOSではバイト.
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def summarize_ms(seconds: List[float]) -> Dict[str, float]:
+    """秒数のリストから平均・中央値・最大のミリ秒を作る."""
+    if not seconds:
+        return {"mean_ms": 0.0, "median_ms": 0.0, "max_ms": 0.0}
+    return {
+        "mean_ms": sum(seconds) / len(seconds) * 1000,
+        "median_ms": median(seconds) * 1000,
+        "max_ms": max(seconds) * 1000,
+    }
+
+
+def crawl_phase(phase: str, corpus: ReplayCorpus, limit: int) -> Dict[str, Any]:
+    """再生サーバーに向けた設定で一つの段階を実行して測る. crawlから別のプロセスとして呼ばれる.
+
+    Args:
+        phase (str): "links"ならCollector.get_station_links,
+            "stations"なら駅ページの取得とCrawler.get_address_list/get_opening_date
+            （とextractor_engineでの解析）, "run"ならCollector.run.
+        corpus (ReplayCorpus): 再生しているページの集まり.
+        limit (int): 自治体の最大数. 0なら全て.
+
+    Returns:
+        Dict[str, Any]: 段階の計測結果.
+    """
+    man_names = list(corpus.municipalities)[: limit or None]
+    start = perf_counter()
+    result: Dict[str, Any] = {}
+    if phase == "links":
+        collector = Collector()
+        times: List[float] = []
+        failed = 0
+        for man_name in man_names:
+            item_start = perf_counter()
+            try:
+                collector.get_station_links(man_name)
+            except ThisAppException:
+                failed += 1
+            times.append(perf_counter() - item_start)
+        result = {
+            "municipalities": len(man_names),
+            "failed": failed,
+            "per_municipality": summarize_ms(times),
+        }
+    elif phase == "stations":
+        crawler = Crawler()
+        fetch_times: List[float] = []
+        soup_times: List[float] = []
+        engine_times: List[float] = []
+        failed = 0
+        for title in corpus.stations:
+            item_start = perf_counter()
+            try:
+                html = crawler.get_station_html(title, title_to_url(title))
+            except ThisAppException:
+                failed += 1
+                continue
+            fetch_times.append(perf_counter() - item_start)
+            parse_start = perf_counter()
+            soup = BeautifulSoup(html, "html.parser")
+            crawler.get_address_list(title, {}, soup)
+            crawler.get_opening_date(soup)
+            soup_times.append(perf_counter() - parse_start)
+            if crawler.extractor_engine != "soup":
+                elapsed, _ = time_call(crawler.parse_station_page, html)
+                engine_times.append(elapsed)
+        result = {
+            "stations": len(corpus.stations),
+            "failed": failed,
+            "fetch": summarize_ms(fetch_times),
+            "parse_soup": summarize_ms(soup_times),
+        }
+        if engine_times:
+            result["parse_engine"] = summarize_ms(engine_times)
+    elif phase == "run":
+        collector = Collector({"GET_NUM": len(man_names)})
+        collector.run()
+        collector.save()
+        result = {"municipalities": len(man_names), "collected": len(collector.data)}
+        if man_names:
+            result["sec_per_municipality"] = (perf_counter() - start) / len(man_names)
+    result["seconds"] = perf_counter() - start
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def parse_importtime(stderr: str, parent: str = "collector") -> Dict[str, float]:
+    """-X importtimeの出力からparentが直接読み込んだモジュールの累積ミリ秒を返す.
+
+    Args:
+        stderr (str): importtimeの出力.
+        parent (str, optional): 親のモジュール名.
+
+    Returns:
+        Dict[str, float]: モジュール名がキー, 累積ミリ秒が値の辞書（遅い順）.
+    """
+    children: Dict[str, float] = {}
+    pending: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = line.split("|")
+            microseconds = int(cumulative)
+        except ValueError:
+            continue
+        # 子のモジュールが親より先に出力され, 字下げが一段深い.
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        module = name.strip()
+        if depth == 1:
+            pending[module] = microseconds / 1000
+        elif depth == 0:
+            if module == parent:
+                children = pending
+            pending = {}
+    return dict(sorted(children.items(), key=lambda item: -item[1]))
+
+
+def bench_startup(env: Dict[str, str], runs: int = STARTUP_RUNS) -> Dict[str, Any]:
+    """新しいプロセスでcollectorを読み込み, Collectorを作るまでの時間を測る.
+
+    Args:
+        env (Dict[str, str]): プロセスの環境変数.
+        runs (int, optional): 測る回数. 時間はその中央値にする.
+
+    Returns:
+        Dict[str, Any]: 読み込み・作成・プロセス全体のミリ秒, 読み込みの遅いモジュール,
+            読み込まれた重いモジュールの名前.
+    """
+    totals: List[float] = []
+    imports: List[float] = []
+    inits: List[float] = []
+    result: Dict[str, Any] = {}
+    slowest: Dict[str, float] = {}
+    for _ in range(runs):
+        start = perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+            env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        totals.append(perf_counter() - start)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        imports.append(result["import_sec"])
+        inits.append(result["init_sec"])
+        slowest = parse_importtime(completed.stderr)
+    return {
+        "process_ms": median(totals) * 1000,
+        "import_ms": median(imports) * 1000,
+        "init_ms": median(inits) * 1000,
+        "slowest_imports_ms": dict(list(slowest.items())[:5]),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in result["modules"]],
+    }
+
+
+def crawl_environment(workspace: str, base_url: str, man_names: List[str]) -> Dict:
+    """再生サーバーと空の作業ディレクトリを使うための環境変数を作る."""
+    input_path = os.path.join(workspace, "municipalities.csv")
+    with open(input_path, "w", encoding="utf-8") as f:
+        # 自治体名リストのcsvは8行目から読まれる.
+        f.write("\n" * 7 + "".join(f"{man_name}\n" for man_name in man_names))
+    os.makedirs(os.path.join(workspace, "wiki"), exist_ok=True)
+    env = dict(os.environ)
+    env.update(
+        {
+            "WIKI_BASE_URL": base_url,
+            "INPUT_PATH": input_path,
+            "RAW_PATH": os.path.join(workspace, "raw.json"),
+            "RESULT_PATH": os.path.join(workspace, "result.csv"),
+            "WIKI_STORAGE_DIR": os.path.join(workspace, "wiki") + os.sep,
+            "WIKI_PACK_PATH": "",
+            "STATION_LINKS_PATH": os.path.join(workspace, "station_links.json"),
+            "ERRORS_PATH": os.path.join(workspace, "errors.json"),
+            "ERRORS_LOG_PATH": os.path.join(workspace, "errors.jsonl"),
+            "METRICS_PATH": os.path.join(workspace, "metrics.json"),
+            "ADDRESS_CACHE_PATH": os.path.join(workspace, "address_data.pickle"),
+            "SQLITE_PATH": os.path.join(workspace, "station_data.sqlite3"),
+            "STATION_CACHE_DIR": os.path.join(workspace, "cache") + os.sep,
+            "STATION_RECORD_PATH": os.path.join(workspace, "station_records.jsonl"),
+            "RAILWAY_FRAGMENT_PATH": os.path.join(workspace, "fragments.jsonl"),
+            "REVISIONS_PATH": os.path.join(workspace, "page_revisions.json"),
+            "TITLE_INDEX_PATH": "",
+            # ローカルなのでアクセス頻度は制限しない.
+            "FETCH_RATE": "100000",
+            "FETCH_BURST": "100000",
+        }
+    )
+    return env
+
+
+def git_commit() -> str:
+    """作業ツリーのコミットの短いハッシュ. 分からなければ空文字列."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def bench_crawl(
+    corpus_dir: str, limit: int = 0, results_path: str = "", label: str = ""
+) -> Dict[str, Any]:
+    """再生サーバーに対して収集を実行するベンチマーク
+
+    段階ごとに空の作業ディレクトリを作り, 別のプロセスで実行する（ピークのメモリ使用量も段階ごとになる）.
+    秒あたりのページ数は再生サーバーが返したページ（APIの応答を含む）の数から求める.
+    結果はresults_pathにjsonlで追記し, 同じ自治体数の前回の結果と比べる.
+
+    Args:
+        corpus_dir (str): recordで作ったディレクトリ.
+        limit (int, optional): 自治体の最大数. 0なら全て.
+        results_path (str, optional): 結果を追記するファイル. 空なら保存しない.
+        label (str, optional): 結果に付ける名前.
+
+    Returns:
+        Dict[str, Any]: 結果.
+    """
+    corpus = ReplayCorpus(corpus_dir)
+    if not corpus.municipalities:
+        raise ValueError(f"no recorded pages : {corpus_dir} (run record first)")
+    man_names = list(corpus.municipalities)[: limit or None]
+    report: Dict[str, Any] = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "label": label,
+        "commit": git_commit(),
+        "corpus": {"municipalities": len(man_names), "stations": len(corpus.stations)},
+        "settings": {
+            "extractor_engine": EXTRACTOR_ENGINE,
+            "station_backend": STATION_FETCH_BACKEND,
+            "stream_station_pages": STREAM_STATION_PAGES,
+            "pipeline_fetch_workers": PIPELINE_FETCH_WORKERS,
+        },
+        "phases": {},
+    }
+    with ReplayServer(corpus) as server:
+        with tempfile.TemporaryDirectory() as workspace:
+            startup = bench_startup(
+                crawl_environment(workspace, server.base_url, man_names)
+            )
+        report["startup"] = startup
+        print(
+            f"{'startup':>10} : {startup['process_ms']:8.1f} ms "
+            f"(import {startup['import_ms']:.1f} ms, "
+            f"init {startup['init_ms']:.1f} ms), "
+            f"heavy modules {startup['heavy_modules'] or 'none'}"
+        )
+        for phase in CRAWL_PHASES:
+            server.reset_stats()
+            with tempfile.TemporaryDirectory() as workspace:
+                output_path = os.path.join(workspace, "result.json")
+                subprocess.run(
+                    [
+                        sys.executable,
+                        os.path.abspath(__file__),
+                        "crawl-phase",
+                        phase,
+                        "--corpus",
+                        corpus_dir,
+                        "--limit",
+                        str(limit),
+                        "--output",
+                        output_path,
+                    ],
+                    env=crawl_environment(workspace, server.base_url, man_names),
+                    check=True,
+                )
+                with open(output_path, encoding="utf-8") as f:
+                    result = json.load(f)
+            result["pages_served"] = server.requests - server.not_found
+            result["not_found"] = server.not_found
+            result["bytes_served"] = server.bytes_sent
+            result["pages_per_sec"] = (
+                result["pages_served"] / result["seconds"] if result["seconds"] else 0.0
+            )
+            report["phases"][phase] = result
+            print(
+                f"{phase:>10} : {result['seconds']:8.2f} sec, "
+                f"{result['pages_per_sec']:8.1f} pages/sec, "
+                f"peak {result['peak_rss_mb'] or 0:.0f} MB"
+            )
+    if results_path:
+        previous = last_result(results_path, report["corpus"])
+        with open(results_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report, ensure_ascii=False) + "\n")
+        if previous is not None:
+            compare_results(previous, report)
+    return report
+
+
+def last_result(results_path: str, corpus: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    """結果ファイルにある同じ規模の最後の結果を返す. なければNone."""
+    if not os.path.isfile(results_path):
+        return None
+    previous = None
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if row.get("corpus") == corpus:
+                previous = row
+    return previous
+
+
+def compare_results(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+    """前回の結果との差を表示する."""
+    print(f"compared with {previous['time']} {previous['label']} {previous['commit']}")
+    if (before := previous.get("startup")) and (after := current.get("startup")):
+        for key in ("process_ms", "import_ms", "init_ms"):
+            if before.get(key):
+                change = (after[key] / before[key] - 1) * 100
+                print(
+                    f"{'startup':>10} {key:>14} : {before[key]:10.2f} -> "
+                    f"{after[key]:10.2f} ({change:+.1f}%)"
+                )
+    for phase, result in current["phases"].items():
+        if (before := previous["phases"].get(phase)) is None:
+            continue
+        for key in ("seconds", "pages_per_sec", "peak_rss_mb"):
+            if before.get(key) and result.get(key) is not None:
+                change = (result[key] / before[key] - 1) * 100
+                print(
+                    f"{phase:>10} {key:>14} : {before[key]:10.2f} -> "
+                    f"{result[key]:10.2f} ({change:+.1f}%)"
+                )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark with saved html pages.")
+    sub_parsers = parser.add_subparsers(dest="command", required=True)
+    extract_parser = sub_parsers.add_parser(
+        "extract", help="compare station page extraction engines."
+    )
+    extract_parser.add_argument("--limit", type=int, default=0)
+    links_parser = sub_parsers.add_parser(
+        "links", help="compare municipality page link extraction."
+    )
+    links_parser.add_argument("--limit", type=int, default=0)
+    record_parser = sub_parsers.add_parser(
+        "record", help="record saved pages for the replay server."
+    )
+    record_parser.add_argument("--corpus", default="benchmark_corpus")
+    record_parser.add_argument("--limit", type=int, default=0)
+    record_parser.add_argument("--api-responses", default="")
+    crawl_parser = sub_parsers.add_parser(
+        "crawl", help="crawl recorded pages served by a local replay server."
+    )
+    crawl_parser.add_argument("--corpus", default="benchmark_corpus")
+    crawl_parser.add_argument("--limit", type=int, default=0)
+    crawl_parser.add_argument("--results", default="benchmark_results.jsonl")
+    crawl_parser.add_argument("--label", default="")
+    # crawlが段階ごとに別のプロセスで呼ぶ.
+    phase_parser = sub_parsers.add_parser("crawl-phase")
+    phase_parser.add_argument("phase", choices=CRAWL_PHASES)
+    phase_parser.add_argument("--corpus", required=True)
+    phase_parser.add_argument("--limit", type=int, default=0)
+    phase_parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    if args.command == "extract":
+        bench_extract(args.limit)
+    elif args.command == "links":
+        bench_links(args.limit)
+    elif args.command == "record":
+        record_corpus(args.corpus, args.limit, args.api_responses)
+    elif args.command == "crawl":
+        bench_crawl(args.corpus, args.limit, args.results, args.label)
+    elif args.command == "crawl-phase":
+        logzero.loglevel(logging.WARNING)
+        result = crawl_phase(args.phase, ReplayCorpus(args.corpus), args.limit)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,58 @@
 """
 
 from filemanager import StationData
-import traceback
 import re
-from typing import List, Dict, Final
-from bs4.element import Tag
-from bs4 import BeautifulSoup
+import json
+import threading
+from html import unescape
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    List,
+    Dict,
+    Final,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 from crawl import Crawler
+from pipeline import Pipeline, Stage
+from shard import Shard, stable_hash
+from fragment import RailwayFragment, railway_fragment_store
+from station_record import StationRecord, station_record_store
+from gazetteer import Gazetteer, station_key
+from page_cache import station_page_cache
+from metrics import metrics
+from revision import extract_revision_id, revision_store, url_to_title
+from resolver import split_man_name, title_to_url
 from filemanager import file_manager
-from error_storage import error_storage
+from error_storage import (
+    UNEXPECTED_CATEGORY,
+    ErrorStorage,
+    error_category,
+    error_storage,
+)
 from logzero import logger
-from appexcp.my_exception import ElementNotFound, NoDateInfo, ThisAppException
+from settings import collector_config
+from appexcp.my_exception import (
+    CannotOpenURL,
+    ElementNotFound,
+    NoDateInfo,
+    ThisAppException,
+)
+
+# bs4とsoupsieveは読み込みに時間がかかるので, 自治体ページから初めて抽出するときに読み込む.
+# 保存済みの断片だけで済む実行では読み込まない.
+if TYPE_CHECKING:
+    from bs4.element import Tag
+
+# 保存済みの自治体ページのhtmlに残る記事名の見出し.
+FIRST_HEADING_PATTERN: Final = re.compile(
+    r'<h1[^>]*id="firstHeading"[^>]*>(.*?)</h1>', re.DOTALL
+)
 
 
 def validate_man_name_and_address(man_name: str, address_list: List[str]) -> bool:
@@ -32,15 +74,276 @@ def validate_man_name_and_address(man_name: str, address_list: List[str]) -> boo
     Raises:
         ThisAppException: 入力された自治体名が形式に沿っていない場合発生.
     """
-    # これで（都道府県または政令市）（市区町村または政令市区）に分けることができる.
-    pattern = re.compile(r"(さいたま市|堺市|...??[都道府県市])(.+?[市区町村])")
-    # （市区町村または政令市区）を取得
-    partial_name = match.groups()[1] if (match := pattern.search(man_name)) else None
+    # （都道府県または政令市）（市区町村または政令市区）に分け, （市区町村または政令市区）を取得
+    partial_name = names[1] if (names := split_man_name(man_name)) else None
     if not partial_name:
         raise ThisAppException(f"cannot find pattern from man_name({man_name}).")
     return any([partial_name in address for address in address_list])
 
 
+def _reextract_station_links(
+    man_name: str,
+) -> Tuple[str, Union[RailwayFragment, None], str, str]:
+    # プロセスプールから呼ばれる. 保存済みのhtmlがなければ何もしない.
+    # (自治体名, 断片またはNone, 警告またはエラーの文, その種類) を返す.
+    html = file_manager.load_local_html(man_name)
+    if html is None:
+        return man_name, None, "", ""
+    try:
+        fragment = Collector.default_extraction_plan().extract_fragment(man_name, html)
+        if not fragment.links:
+            raise ElementNotFound(man_name)
+    except ThisAppException as e:
+        return man_name, None, str(e), error_category(e)
+    return man_name, fragment, fragment.warning, "abandoned_line"
+
+
+def _format_and_extract(
+    man_name: str, html: Optional[str], raw_html: Optional[str]
+) -> Tuple[str, RailwayFragment]:
+    # プロセスプールからも呼ばれる. 取得したままのhtmlなら整形してから鉄道の節の断片を取り出す.
+    # (整形済みのhtml, 断片) を返す.
+    if raw_html is not None:
+        html = Crawler.source_formatting(raw_html)
+    fragment = Collector.default_extraction_plan().extract_fragment(
+        man_name, html or ""
+    )
+    return html or "", fragment
+
+
+class _CollectJob:
+    # 収集パイプラインを流れる一つの自治体の途中の状態.
+    __slots__ = (
+        "man_name",
+        "link",
+        "html",
+        "raw_html",
+        "sta_url_data",
+        "address_error_stations",
+        "sta_record_data",
+        "offline_first",
+        "result",
+    )
+
+    def __init__(self, man_name: str) -> None:
+        self.man_name = man_name
+        self.link: Optional[str] = None
+        self.html: Optional[str] = None
+        self.raw_html: Optional[str] = None
+        self.sta_url_data: Optional[Dict[str, str]] = None
+        self.address_error_stations: List[str] = []
+        self.sta_record_data: Dict[str, Union[StationRecord, CannotOpenURL]] = {}
+        self.offline_first = False
+        self.result: Optional[StationData] = None
+
+
+class ExtractionPlan:
+    """自治体ページから駅リンクを取り出すための抽出プラン
+
+    見出しのidやセレクタ, 正規表現を最初に一度だけ作っておき, 自治体ごとの処理では文書を一度走査するだけで
+    各レベル（h3, h4, h2）の鉄道の見出しと廃線を表すidを同時に見つける.
+
+    セレクタはbs4とsoupsieveを読み込む必要があるので, 初めて抽出するときに作る.
+    版だけを使うとき（保存した断片が使えるかどうかの判定）には読み込まない.
+
+    Attributes:
+        VERSION (int): 抽出方法のバージョン. 結果が変わる変更をしたら上げる.
+        version (str): VERSIONと渡されたリストから作った版. 保存した断片が使えるかどうかの判定に使う.
+
+    Args:
+        railway_tag_id (List[str]): 鉄道のことが記載されている見出しのidのリスト.
+        abandoned_line_text (List[str]): 廃線として記載されている可能性がある言葉のリスト.
+        non_proper_name (List[str]): リンクとして考えられるが駅名ではないもののリスト.
+    """
+
+    VERSION: Final[int] = 1
+    # 鉄道の見出しを探す順番. h3がなければh4, それもなければh2（現状高松市のみ）.
+    HEADING_LEVELS: Final[Tuple[str, ...]] = ("h3", "h4", "h2")
+
+    def __init__(
+        self,
+        railway_tag_id: List[str],
+        abandoned_line_text: List[str],
+        non_proper_name: List[str],
+    ) -> None:
+        self.railway_ids = frozenset(railway_tag_id)
+        self.abandoned_ids = frozenset(abandoned_line_text)
+        self.abandoned_line_text = list(abandoned_line_text)
+        self.non_proper_name = list(non_proper_name)
+        self.formerly_selector: Any = None
+        self.station_link_selector: Any = None
+        # soupsieveの:-soup-containsが対象にしない文字列の型.
+        self.special_strings: tuple = ()
+        self.station_suffix_pattern = re.compile("駅|停留場")
+        # リストを変えたときも版が変わるようにする.
+        lists = [railway_tag_id, abandoned_line_text, non_proper_name]
+        self.version = (
+            f"{self.VERSION}.{stable_hash(json.dumps(lists, ensure_ascii=False))}"
+        )
+
+    def _compile(self) -> None:
+        # 初めて抽出するときにbs4とsoupsieveを読み込んでセレクタを作る.
+        if self.station_link_selector is not None:
+            return
+        import soupsieve
+        from bs4.element import (
+            CData,
+            Comment,
+            Declaration,
+            Doctype,
+            ProcessingInstruction,
+        )
+
+        self.special_strings = (
+            Comment,
+            Declaration,
+            CData,
+            ProcessingInstruction,
+            Doctype,
+        )
+        self.formerly_selector = soupsieve.compile("p:-soup-contains('かつては')")
+        self.station_link_selector = soupsieve.compile(
+            "a:-soup-contains('駅'),a:-soup-contains('停留場')"
+        )
+
+    def _is_railway_heading(self, tag: "Tag") -> bool:
+        from bs4.element import Tag
+
+        # 直下のspanのidが鉄道の見出しのものならTrue.
+        return any(
+            type(child) is Tag
+            and child.name == "span"
+            and child.get("id") in self.railway_ids
+            for child in tag.children
+        )
+
+    def _contents_text(self, tag: "Tag") -> str:
+        from bs4.element import NavigableString
+
+        # soupsieveの:-soup-containsと同じ範囲の文字列（コメントなどを除く）をつなげる.
+        return "".join(
+            str(string)
+            for string in tag.descendants
+            if isinstance(string, NavigableString)
+            and not isinstance(string, self.special_strings)
+        )
+
+    def is_station_name(self, sta_name: str) -> bool:
+        """リンクのテキストが駅名として扱えるものならTrue."""
+        if not sta_name.endswith(("駅", "停留場")) or sta_name in ("駅", "停留場"):
+            return False
+        stripped_name = self.station_suffix_pattern.sub("", sta_name)
+        return all(text not in stripped_name for text in self.non_proper_name)
+
+    def extract(self, man_name: str, html: str) -> Tuple[Dict[str, str], str]:
+        """自治体ページのhtmlから駅リンクの辞書を取り出す.
+
+        ネットワークもエラー記録も使わない純粋な処理なので, 別プロセスからも呼べる.
+
+        Args:
+            man_name (str): 自治体名. 警告文と例外に使う.
+            html (str): 自治体ページのhtmlソース.
+
+        Returns:
+            Tuple[Dict[str, str], str]: 駅名がキー, リンクが値の辞書と, 廃線の警告文（なければ空文字列）.
+                駅が一つも見つからなかった場合は空の辞書になる.
+
+        Raises:
+            ElementNotFound: 鉄道の見出しが見つからなかった場合に発生.
+        """
+        fragment = self.extract_fragment(man_name, html)
+        return fragment.links, fragment.warning
+
+    @metrics.timed("extract_links")
+    def extract_fragment(self, man_name: str, html: str) -> RailwayFragment:
+        """自治体ページのhtmlから鉄道の節の断片を取り出す.
+
+        extractと同じ駅リンクと警告文に, 鉄道の見出しの下のブロックのhtmlを加えたもの.
+
+        Args:
+            man_name (str): 自治体名.
+            html (str): 自治体ページのhtmlソース.
+
+        Returns:
+            RailwayFragment: 断片.
+
+        Raises:
+            ElementNotFound: 鉄道の見出しが見つからなかった場合に発生.
+        """
+        from bs4 import BeautifulSoup
+        from bs4.element import Tag
+
+        self._compile()
+        soup = BeautifulSoup(html, "html.parser")
+
+        # 一度の走査で各レベルの鉄道の見出しと, 廃線を表すidを持つ最初の要素を探す.
+        headings: Dict[str, List["Tag"]] = {level: [] for level in self.HEADING_LEVELS}
+        abandoned_line: Optional["Tag"] = None
+        for tag in soup.find_all(True):
+            if abandoned_line is None and tag.get("id") in self.abandoned_ids:
+                abandoned_line = tag
+            if tag.name in headings and self._is_railway_heading(tag):
+                headings[tag.name].append(tag)
+        base_tag_name = next(
+            (level for level in self.HEADING_LEVELS if headings[level]), None
+        )
+        if base_tag_name is None:
+            raise ElementNotFound(man_name)
+        railroad_blocks: List["Tag"] = []
+        for base_tag in headings[base_tag_name]:
+            next_tag = base_tag.find_next_sibling()
+            # 鉄道が書いてあるh3またはh4から次のものまでの間のタグを保存する.
+            # ただしclassにgalleryを含むものは不要なので取り除きたい.
+            while type(next_tag) is Tag and next_tag.name != base_tag_name:
+                if (
+                    "class" not in next_tag.attrs
+                    or "gallery" not in next_tag.attrs["class"]
+                ):
+                    railroad_blocks.append(next_tag)
+                next_tag = next_tag.find_next_sibling()
+
+        # 「廃線」や「廃止された鉄道」などがあるなら警告として出しておく.
+        warning_text: str = ""
+        if abandoned_line is not None:
+            warning_text = (
+                f"abandoned line may exist : {abandoned_line.attrs['id']} : {man_name}"
+            )
+        else:
+            # なければブロックごとにテキスト検索する.
+            # 子孫要素のテキストに含まれるかどうかは, 子要素それぞれのテキストに含まれるかどうかと同じ.
+            for block in railroad_blocks:
+                child_texts = [
+                    self._contents_text(child)
+                    for child in block.children
+                    if type(child) is Tag
+                ]
+                for text in self.abandoned_line_text:
+                    if any(text in child_text for child_text in child_texts):
+                        warning_text = f"abandoned line may exist : {text} : {man_name}"
+                        break
+                if warning_text:
+                    break
+                # まだなければ「かつては」で検索
+                if self.formerly_selector.select_one(block):
+                    warning_text = f"abandoned line may exist : かつては... : {man_name}"
+                    break
+
+        result_dict: Dict[str, str] = {}
+        # 取ってきたタグの中で駅や停留所を探して順番に検査する.
+        for block in railroad_blocks:
+            # どうせ住所チェックするので, 駅を含むリンクすべて取ってくることにする.
+            # ただし少なくとも敦賀市では失敗する.
+            for link in self.station_link_selector.select(block):
+                sta_name = link.get_text()
+                # 取得したくないテキストを含まないものだけ辞書に追加する.
+                if self.is_station_name(sta_name):
+                    result_dict[sta_name] = link.attrs["href"]
+        blocks_html = "\n".join(str(block) for block in railroad_blocks)
+        return RailwayFragment(
+            man_name, self.version, result_dict, warning_text, blocks_html
+        )
+
+
 class Collector:
     """データ収集クラス
 
@@ -57,9 +360,18 @@ class Collector:
         data (Dict[str, StationData]): 自治体名に対する駅データを保存する. ローデータを最初に読み込む.
         priority_data (Dict[str, Dict[str, Any]]): 優先データ. キーは自治体名.
         address_data (Dict[str, List[str]]): 住所録. 自治体名に対して住所のリストが保存される.
+            初めて参照したときに読み込む.
+        gazetteer (Gazetteer): 住所録の駅を自治体に割り当てた索引. 初めて参照したときに作る.
+        gazetteer_skip_fetch (bool): 索引だけで自治体に属さないと分かる駅のページを取得しないかどうか.
+        SHARD ((constant) Shard | None): 分担して収集するときのシャード. この実行ではその自治体だけを受け持つ.
+        OFFLINE_FIRST ((constant) bool): 所在地データから駅を決めるモード
+            （get_year_data_offline_first）で実行するかどうか.
+        station_links (Dict[str, Dict[str, str]]): 自治体ごとの駅リンク. OFFLINE_FIRSTのときだけ読み込む.
+        parse_executor (ProcessPoolExecutor | None): run中に自治体ページの整形と抽出を任せるプロセスプール.
+        previous_data (Dict[str, StationData]): refreshで取り除いた既存データ. 収集し直せなかったものはsaveで戻す.
 
     Args:
-        config (dict, optional): START_INDEX, GET_NUM属性をもたせた辞書を渡す.
+        config (dict, optional): START_INDEX, GET_NUM, OFFLINE_FIRST, SHARD属性をもたせた辞書を渡す.
     """
 
     RAILWAY_TAG_ID: Final[List[str]] = [
@@ -102,19 +414,60 @@ class Collector:
         "貨物",
         "貨物ターミナル",
     ]
+    _extraction_plan: Optional["ExtractionPlan"] = None
 
     def __init__(self, config: dict = {}) -> None:
-        self.crawler = Crawler()
+        self.priority_data = file_manager.load_priority_data()  # 優先データを辞書で読み込む.
+        # 優先データは一度だけ読み込んでクローラと共有する.
+        self.crawler = Crawler(priority_data=self.priority_data)
+        # セレクタや正規表現は最初に一度だけ作っておく.
+        self.extraction_plan = self.default_extraction_plan()
         # 自治体名リストを取得.
         self.man_list: List[str] = file_manager.load_manicipalities_data()
+        # シャードを指定されたら, 書き込むファイルをシャードのパーティションにする.
+        self.SHARD: Final[Optional[Shard]] = config.get("SHARD", None)
+        if self.SHARD:
+            file_manager.use_shard(self.SHARD)
+            station_record_store.use_shard(self.SHARD)
+            revision_store.use_shard(self.SHARD)
+            railway_fragment_store.use_shard(self.SHARD)
+            metrics.use_shard(self.SHARD)
+            error_storage.use_shard(self.SHARD)
         self.START_INDEX: Final[int] = config.get("START_INDEX", 0)
         self.END_INDEX: Final[int] = min(
             config.get("GET_NUM", len(self.man_list)) + self.START_INDEX,
             len(self.man_list),
         )
         self.data = file_manager.load_raw_data()  # 保存データがあるなら読み込まれ, なければ空の辞書が返される.
-        self.priority_data = file_manager.load_priority_data()  # 優先データを辞書で読み込む.
-        self.address_data: Dict[str, List[str]] = file_manager.load_address_dict()
+        # 住所録と索引は作るのに時間がかかるので, 使うまで作らない（保存済みのデータだけで済む実行では作らない）.
+        self._address_data: Optional[Mapping[str, List[str]]] = None
+        self._gazetteer: Optional[Gazetteer] = None
+        self._lazy_lock = threading.Lock()
+        self.gazetteer_skip_fetch: bool = collector_config["gazetteer_skip_fetch"]
+        self.OFFLINE_FIRST: Final[bool] = config.get("OFFLINE_FIRST", False)
+        self.station_links: Dict[str, Dict[str, str]] = (
+            file_manager.load_station_links() if self.OFFLINE_FIRST else {}
+        )
+        self.parse_executor: Optional[ProcessPoolExecutor] = None
+        self.previous_data: Dict[str, StationData] = {}
+
+    @property
+    def address_data(self) -> Mapping[str, List[str]]:
+        """住所録. 初めて参照したときに読み込む."""
+        with self._lazy_lock:
+            if self._address_data is None:
+                self._address_data = file_manager.load_address_dict()
+            return self._address_data
+
+    @property
+    def gazetteer(self) -> Gazetteer:
+        """住所録の駅を自治体に割り当てた索引. 初めて参照したときに作る."""
+        with self._lazy_lock:
+            if self._gazetteer is None:
+                self._gazetteer = Gazetteer(
+                    file_manager.load_address_rows(), self.man_list
+                )
+            return self._gazetteer
 
     def get_station_links(self, man_name: str) -> Dict[str, str]:
         """駅リンクのリストを取得
@@ -130,98 +483,52 @@ class Collector:
         Raises:
             ElementNotFound: 鉄道駅のリンクを取得できなかった場合に発生.
         """
-        html = self.crawler.get_source(man_name)
-        soup = BeautifulSoup(html, "html.parser")
+        fragment = railway_fragment_store.get(man_name, self.extraction_plan.version)
+        if fragment is None:
+            html = self.crawler.get_source(man_name)
+            fragment = self.extraction_plan.extract_fragment(man_name, html)
+            if fragment.links:
+                railway_fragment_store.put(fragment)
+        return self.check_station_links(man_name, fragment.links, fragment.warning)
 
-        # まずh3タグで検索
-        base_tag_name: str = "h3"
-        base_tags = soup.select(
-            ",".join([f"h3:has( > span#{text})" for text in self.RAILWAY_TAG_ID])
-        )
-        if not base_tags:
-            # だめならh4タグで検索
-            base_tag_name = "h4"
-            base_tags = soup.select(
-                ",".join([f"h4:has( > span#{text})" for text in self.RAILWAY_TAG_ID])
-            )
-        if not base_tags:
-            # 現状高松市のみだがh2でも検索
-            base_tag_name = "h2"
-            base_tags = soup.select(
-                ",".join([f"h2:has( > span#{text})" for text in self.RAILWAY_TAG_ID])
-            )
-        if not base_tags:
-            # それでもだめなら例外
-            raise ElementNotFound(man_name)
-        railroad_blocks: list[Tag] = []
-        for base_tag in base_tags:
-            next_tag = base_tag.find_next_sibling()
-            # 鉄道が書いてあるh3またはh4から次のものまでの間のタグを保存する.
-            # ただしclassにgalleryを含むものは不要なので取り除きたい.
-            while type(next_tag) is Tag and next_tag.name != base_tag_name:
-                if (
-                    "class" not in next_tag.attrs
-                    or "gallery" not in next_tag.attrs["class"]
-                ):
-                    railroad_blocks.append(next_tag)
-                next_tag = next_tag.find_next_sibling()
+    @staticmethod
+    def check_station_links(
+        man_name: str, result_dict: Dict[str, str], warning_text: str
+    ) -> Dict[str, str]:
+        """抽出プランの結果から警告を記録し, 駅リンクがなければ例外を送る.
 
-        # 「廃線」や「廃止された鉄道」などがあるなら警告として出しておく.
-        warning_text: str = ""
-        # まずidから探す. セレクタを作り, 一つでもあればOK.
-        if abandoned_line := soup.select_one(
-            ",".join([f"#{text}" for text in self.ABANDONED_LINE_TEXT])
-        ):
-            warning_text = (
-                f"abandoned line may exist : {abandoned_line.attrs['id']} : {man_name}"
-            )
-        else:
-            # なければ個別にテキスト検索する.
-            for block in railroad_blocks:
-                # まずそれらしいテキストで検索.
-                for text in self.ABANDONED_LINE_TEXT:
-                    if block.select_one(f"*:-soup-contains('{text}')"):
-                        warning_text = f"abandoned line may exist : {text} : {man_name}"
-                        break
-                if warning_text:
-                    break
-                else:
-                    # まだなければ「かつては」で検索
-                    if block.select_one("p:-soup-contains('かつては')"):
-                        warning_text = (
-                            f"abandoned line may exist : かつては... : {man_name}"
-                        )
-                        break
-        if warning_text:
-            error_storage.add(warning_text, "w")
+        Args:
+            man_name (str): 自治体名.
+            result_dict (Dict[str, str]): 駅名がキー, リンクが値の辞書.
+            warning_text (str): 警告の文. なければ空文字列.
 
-        result_dict: Dict[str, str] = {}
-        # 取ってきたタグの中で駅や停留所を探して順番に検査する.
-        for block in railroad_blocks:
-            # どうせ住所チェックするので, 駅を含むリンクすべて取ってくることにする.
-            # ただし少なくとも敦賀市では失敗する.
-            link_list = block.select("a:-soup-contains('駅'),a:-soup-contains('停留場')")
-            for link in link_list:
-                sta_name = link.get_text()
-                # 取得したくないテキストのリストを回して全てに対して問題なければ辞書に追加する.
-                if all(
-                    (
-                        sta_name.endswith(("駅", "停留場"))
-                        and (non_proper_text not in re.sub("駅|停留場", "", sta_name))
-                        and sta_name != "駅"
-                        and sta_name != "停留場"
-                    )
-                    for non_proper_text in self.NON_PROPER_NAME
-                ):
-                    result_dict[sta_name] = link.attrs["href"]
+        Returns:
+            Dict[str, str]: result_dictをそのまま返す.
+
+        Raises:
+            ElementNotFound: 鉄道駅のリンクがない場合に発生.
+        """
+        if warning_text:
+            error_storage.add(
+                warning_text, "w", category="abandoned_line", man_name=man_name
+            )
         if not result_dict:
             raise ElementNotFound(man_name)
         return result_dict
 
+    @classmethod
+    def default_extraction_plan(cls) -> "ExtractionPlan":
+        """クラスの定数リストから作った抽出プランを返す. プロセスごとに一度だけ作る."""
+        if cls._extraction_plan is None:
+            cls._extraction_plan = ExtractionPlan(
+                cls.RAILWAY_TAG_ID, cls.ABANDONED_LINE_TEXT, cls.NON_PROPER_NAME
+            )
+        return cls._extraction_plan
+
     def get_year_data(self, man_name: str, force: bool = False) -> StationData:
         """駅設置年データを取得.
 
-        自治体名に対して駅一覧と, 最近・最古の駅設置年のデータを返す.
+        自治体に対して駅一覧と, 最近・最古の駅設置年のデータを返す.
 
         Args:
             man_name (str): 自治体名.
@@ -233,67 +540,195 @@ class Collector:
         Raises:
             NoDateInfo: 年データが取れなかった場合に発生.
         """
-        if not force:
-            if man_pri_data := self.priority_data.get(man_name, None):
-                if man_pri_data.get("nodata", False):
-                    # nodata属性がTrueなら決められたデータを返す.
-                    return {"sta_data": [], "max": ["なし", 0], "min": ["なし", 0]}
-                elif pri_data := man_pri_data.get("data", None):
-                    # 優先データが指定されているならそれを返す.
-                    # ただし, クロールの段階では全部のデータが揃っていないと不可とする.
-                    if (
-                        pri_data.get("sta_data", None)
-                        and pri_data.get("max", None)
-                        and pri_data.get("min", None)
-                    ):
-                        return pri_data
-                    else:
-                        error_storage.add(
-                            f"{man_name} : priority data exists, "
-                            "but not all attrs are available.",
-                            "w",
-                        )
-        years_data: Dict[str, int] = {}
+        if not force and (pri_data := self.get_priority_year_data(man_name)):
+            return pri_data
         # wikiに載っている駅データをとりあえずすべて取得
         sta_link_data: Dict[str, str] = self.get_station_links(man_name)
-        # 住所チェック失敗した駅を登録しておくためのリスト
+        sta_url_data, address_error_stations = self.select_station_urls(
+            man_name, sta_link_data
+        )
+        # 残りの駅の駅レコードを並列にまとめて取得する.
+        # 一度解析した駅はメモから返されるので取得も解析もされない.
+        sta_record_data = self.crawler.get_station_record_dict(sta_url_data)
+        return self.aggregate_year_data(
+            man_name, sta_record_data, address_error_stations
+        )
+
+    def select_station_urls(
+        self, man_name: str, sta_link_data: Dict[str, str]
+    ) -> Tuple[Dict[str, str], List[str]]:
+        """駅リンクから取得する駅ページのURLを選ぶ.
+
+        wikiへのリンクではないものは飛ばす. gazetteer_skip_fetchなら住所録だけで他の自治体の駅と分かるものも除く.
+
+        Args:
+            man_name (str): 自治体名.
+            sta_link_data (Dict[str, str]): 駅名がキー, リンクが値の辞書.
+
+        Returns:
+            Tuple[Dict[str, str], List[str]]: 駅名がキー, URLが値の辞書と, 住所チェック失敗とした駅名のリスト.
+        """
         address_error_stations: List[str] = []
-        for sta_name, sta_link in sta_link_data.items():
-            # wikiへのリンクではないならもう飛ばす
-            if "/wiki/" not in sta_link:
-                continue
-            # 順番に開業年をチェックしていく. このときに住所チェックも行う.
-            html: str = self.crawler.get_station_html(
-                sta_name, "https://ja.wikipedia.org" + sta_link
-            )
-            soup: BeautifulSoup = BeautifulSoup(html, "html.parser")
-            if not (
-                address_list := self.crawler.get_address_list(
-                    sta_name, self.address_data, soup
+        sta_url_data: Dict[str, str] = {
+            sta_name: "https://ja.wikipedia.org" + sta_link
+            for sta_name, sta_link in sta_link_data.items()
+            if "/wiki/" in sta_link
+        }
+        if self.gazetteer_skip_fetch:
+            # 住所録だけで他の自治体の駅と分かるものは取得せずに住所チェック失敗とする.
+            # 自治体の境にある駅も除かれることがあるので, 除いた駅はログに残す.
+            for sta_name in list(sta_url_data):
+                if self.gazetteer.excludes(man_name, sta_name):
+                    address_error_stations.append(sta_name)
+                    del sta_url_data[sta_name]
+            if address_error_stations:
+                logger.info(
+                    f"{man_name} : skipped by address data : {address_error_stations}"
                 )
-            ):
-                error_message: Final[
-                    str
-                ] = f"{man_name} : cannot find address data : {sta_name}"
-                error_storage.add(error_message)
-                logger.error(error_message)
-                continue
-            # 住所チェックしてだめならこの駅を飛ばす
-            if not validate_man_name_and_address(man_name, address_list):
-                address_error_stations.append(sta_name)
-                continue
-            if sta_year := self.crawler.get_opening_date(soup):
+        return sta_url_data, address_error_stations
+
+    def aggregate_year_data(
+        self,
+        man_name: str,
+        sta_record_data: Mapping[str, Union[StationRecord, CannotOpenURL]],
+        address_error_stations: List[str],
+        offline_first: bool = False,
+    ) -> StationData:
+        """駅レコードを住所チェックして駅設置年データにまとめる.
+
+        Args:
+            man_name (str): 自治体名.
+            sta_record_data (Mapping[str, StationRecord | CannotOpenURL]): 駅名がキー,
+                駅レコードまたは取得時の例外が値.
+            address_error_stations (List[str]): すでに住所チェック失敗とした駅名のリスト. ここに追加していく.
+            offline_first (bool, optional): 所在地データから選んだ駅かどうか.
+                Trueなら, 駅ページに所在地があるときだけ別の同名駅でないかを確かめる.
+
+        Returns:
+            StationData: sta_data, max, minを含む辞書を返す.
+
+        Raises:
+            CannotOpenURL: 取得に失敗した駅があった場合に発生.
+            NoDateInfo: 年データが取れなかった場合に発生.
+        """
+        years_data: Dict[str, int] = {}
+        # 住所チェックを通った駅のURLのリスト
+        member_station_urls: List[str] = []
+        for sta_name, record in sta_record_data.items():
+            # 取得に失敗した駅があればその自治体は失敗とする.
+            if isinstance(record, CannotOpenURL):
+                raise record
+            if offline_first:
+                # 解決した記事が別の同名駅でないかを, ページに所在地があれば確かめる.
+                if (
+                    record.address_list
+                    and not any(
+                        man_name in self.gazetteer.trie.locate(address)
+                        for address in record.address_list
+                    )
+                    and not validate_man_name_and_address(man_name, record.address_list)
+                ):
+                    address_error_stations.append(sta_name)
+                    continue
+            else:
+                # 順番に開業年をチェックしていく. このときに住所チェックも行う.
+                if not (
+                    address_list := self.crawler.merge_address_list(
+                        sta_name, self.address_data, record
+                    )
+                ):
+                    error_message: Final[
+                        str
+                    ] = f"{man_name} : cannot find address data : {sta_name}"
+                    error_storage.add(
+                        error_message,
+                        "e",
+                        category="cannot_find_address_data",
+                        man_name=man_name,
+                        station=sta_name,
+                    )
+                    continue
+                # 住所チェックしてだめならこの駅を飛ばす.
+                # 住所録の索引で属していて, ページの所在地と都道府県が同じならそれでよい.
+                if not self.gazetteer.is_member(
+                    man_name, sta_name, record.address_list
+                ) and not validate_man_name_and_address(man_name, address_list):
+                    address_error_stations.append(sta_name)
+                    continue
+            member_station_urls.append(record.url)
+            if sta_year := record.opening_year:
                 years_data[sta_name] = sta_year
                 print(f"{sta_name} : {years_data[sta_name]}年")
             else:
-                logger.warning(f"no date column ({sta_name})")
-                error_storage.add(f"no date column ({sta_name})")
+                error_storage.add(
+                    f"no date column ({sta_name})",
+                    "w",
+                    category="no_date_column",
+                    man_name=man_name,
+                    station=sta_name,
+                )
 
+        file_manager.add_station_membership(man_name, member_station_urls)
+        # 住所チェックに落ちた駅も, ページが変われば結果が変わりうるので依存ページとして記録する.
+        revision_store.set_station_urls(
+            man_name, [record.url for record in sta_record_data.values()]
+        )
         if address_error_stations:
             error_storage.add(
-                f"{man_name} : address check failed for the following stations.", "w"
+                f"{man_name} : address check failed for the following stations. "
+                f"{address_error_stations}",
+                "w",
+                category="address_check_failed",
+                man_name=man_name,
             )
-            error_storage.add(str(address_error_stations), "w")
+        return self.summarize_years(man_name, years_data)
+
+    def get_priority_year_data(self, man_name: str) -> Optional[StationData]:
+        """優先データから駅設置年データを返す.
+
+        Args:
+            man_name (str): 自治体名.
+
+        Returns:
+            StationData | None: 優先データで決まる駅データ. 使える優先データがなければNone.
+        """
+        if man_pri_data := self.priority_data.get(man_name, None):
+            if man_pri_data.get("nodata", False):
+                # nodata属性がTrueなら決められたデータを返す.
+                return {"sta_data": [], "max": ["なし", 0], "min": ["なし", 0]}
+            elif pri_data := man_pri_data.get("data", None):
+                # 優先データが指定されているならそれを返す.
+                # ただし, クロールの段階では全部のデータが揃っていないと不可とする.
+                if (
+                    pri_data.get("sta_data", None)
+                    and pri_data.get("max", None)
+                    and pri_data.get("min", None)
+                ):
+                    return pri_data
+                else:
+                    error_storage.add(
+                        f"{man_name} : priority data exists, "
+                        "but not all attrs are available.",
+                        "w",
+                        category="priority_data_incomplete",
+                        man_name=man_name,
+                    )
+        return None
+
+    @staticmethod
+    def summarize_years(man_name: str, years_data: Dict[str, int]) -> StationData:
+        """駅ごとの設置年から駅一覧と最近・最古の駅設置年のデータを作る.
+
+        Args:
+            man_name (str): 自治体名.
+            years_data (Dict[str, int]): 駅名がキー, 設置年が値の辞書.
+
+        Returns:
+            StationData: sta_data, max, minを含む辞書を返す.
+
+        Raises:
+            NoDateInfo: 年データが一つもない場合に発生.
+        """
         if not years_data:
             raise NoDateInfo(man_name)
 
@@ -306,54 +741,462 @@ class Collector:
             "min": [min_year_name, years_data[min_year_name]],
         }
 
+    def get_year_data_offline_first(
+        self, man_name: str, force: bool = False
+    ) -> StationData:
+        """所在地データを先に使って駅設置年データを取得.
+
+        自治体に属する駅は所在地データの索引から決め, 自治体ページは取得しない.
+        駅ページは保存済みの駅リンクか記事名の解決で決め, 設置年がメモにない駅だけを取得する.
+        索引に一つも駅がない自治体は通常の方法（get_year_data）で取得する.
+        所在地データにない駅（古い廃駅など）は含まれないことに注意.
+
+        Args:
+            man_name (str): 自治体名.
+            force (bool, optional): get_year_dataと同じ.
+
+        Returns:
+            StationData: sta_data, max, minを含む辞書を返す.
+
+        Raises:
+            NoDateInfo: 年データが取れなかった場合に発生.
+        """
+        if not force and (pri_data := self.get_priority_year_data(man_name)):
+            return pri_data
+        if not self.gazetteer.stations(man_name):
+            return self.get_year_data(man_name, force=True)
+        sta_url_data = self.offline_station_urls(man_name)
+        sta_record_data = self.crawler.get_station_record_dict(sta_url_data)
+        return self.aggregate_year_data(
+            man_name, sta_record_data, [], offline_first=True
+        )
+
+    def offline_station_urls(self, man_name: str) -> Dict[str, str]:
+        """所在地データの索引で自治体に属する駅の駅ページのURLを返す.
+
+        保存済みの駅リンクのうち索引の駅に当たるものはそのまま使い, 残りは記事名をまとめて解決する.
+        解決したものは次回のためにstation_linksに加えておく.
+
+        Args:
+            man_name (str): 自治体名.
+
+        Returns:
+            Dict[str, str]: 駅名がキー, URLが値の辞書. 解決できなかった駅は含まれない.
+        """
+        links = self.station_links.setdefault(man_name, {})
+        known_links = {
+            station_key(sta_name): (sta_name, sta_link)
+            for sta_name, sta_link in links.items()
+            if "/wiki/" in sta_link
+        }
+        sta_url_data: Dict[str, str] = {}
+        unknown_entries = []
+        for key, entry in self.gazetteer.stations(man_name).items():
+            if known := known_links.get(key):
+                sta_url_data[known[0]] = "https://ja.wikipedia.org" + known[1]
+            else:
+                unknown_entries.append(entry)
+        resolved_titles = self.crawler.resolver.resolve_station_titles(
+            [(entry.name, entry.prefecture) for entry in unknown_entries]
+        )
+        for entry in unknown_entries:
+            if not (title := resolved_titles.get((entry.name, entry.prefecture))):
+                error_message = (
+                    f"{man_name} : cannot resolve station page : {entry.name}"
+                )
+                error_storage.add(
+                    error_message,
+                    "e",
+                    category="cannot_resolve_station",
+                    man_name=man_name,
+                    station=entry.name,
+                )
+                continue
+            sta_name = re.sub(r" \(.+\)$", "", title)
+            url = sta_url_data[sta_name] = title_to_url(title)
+            links[sta_name] = url[len("https://ja.wikipedia.org") :]  # noqa: E203
+        return sta_url_data
+
+    def reextract_station_links(
+        self, max_workers: Optional[int] = None
+    ) -> Dict[str, Dict[str, str]]:
+        """保存済みの自治体ページから駅リンクを取り出し直す.
+
+        ウェブにはアクセスせず, 保存済みのhtmlがある自治体をプロセスプールに分けて並列に処理する.
+        セレクタなどのリストを調整したあとに全自治体の結果を素早く確認するためのもの.
+        結果はまとめてfile_managerで保存し, 警告とエラーはerror_storageに加える.
+
+        Args:
+            max_workers (int | None, optional): プロセス数. Noneならコア数.
+
+        Returns:
+            Dict[str, Dict[str, str]]: 自治体名がキー, 駅リンクの辞書が値の辞書.
+        """
+        man_names = self.target_man_names()
+        result: Dict[str, Dict[str, str]] = {}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for man_name, fragment, message, category in executor.map(
+                _reextract_station_links, man_names, chunksize=16
+            ):
+                if fragment is not None:
+                    railway_fragment_store.put(fragment)
+                    result[man_name] = fragment.links
+                if message:
+                    error_storage.add(message, category=category, man_name=man_name)
+        file_manager.save_station_links(result)
+        logger.info(f"re-extracted station links : {len(result)}/{len(man_names)}")
+        return result
+
+    def refresh(self) -> List[str]:
+        """変わったページに関わる自治体のデータを取り除き, 次のrunで収集し直すようにする.
+
+        既存データのある自治体の自治体ページと駅ページについて現在の版番号をAPIでまとめて問い合わせ,
+        記録した版番号と比べる. 自治体ページが変わった自治体は保存済みのhtmlを消し,
+        駅ページが変わったものは駅レコードを無効にしてキャッシュを期限切れにする.
+        版番号の記録がないページは現在の版番号を記録するだけなので, 初回は何も取り除かれない.
+        取り除いたデータはprevious_dataに残しておき, 収集し直せなかったものはsaveで元に戻す.
+
+        Returns:
+            List[str]: 収集し直す自治体名のリスト.
+        """
+        man_names = [m for m in self.target_man_names() if m in self.data]
+        if not self.station_links:
+            self.station_links = file_manager.load_station_links()
+        municipality_urls: Dict[str, str] = {}
+        station_urls: Dict[str, List[str]] = {}
+        for man_name in man_names:
+            if url := self.saved_municipality_url(man_name):
+                municipality_urls[man_name] = url
+            station_urls[man_name] = self.saved_station_urls(man_name)
+        urls = set(municipality_urls.values())
+        for urls_of_man in station_urls.values():
+            urls.update(urls_of_man)
+        titles = {url: title for url in urls if (title := url_to_title(url))}
+        current = self.crawler.resolver.query_revisions(list(titles.values()))
+        changed_urls: Set[str] = set()
+        baseline = 0
+        for url, title in titles.items():
+            if (revision_id := current.get(title)) is None:
+                continue
+            if (known := self.known_revision(url)) is None:
+                revision_store.record(url, revision_id)
+                baseline += 1
+            elif known != revision_id:
+                # 版番号は収集し直して取得したときに記録するので, 失敗しても次回また取り除かれる.
+                changed_urls.add(url)
+        station_changed: Set[str] = set()
+        for man_name in man_names:
+            if municipality_urls.get(man_name) in changed_urls:
+                file_manager.delete_local_html(man_name)
+                railway_fragment_store.delete(man_name)
+                logger.info(f"{man_name} : municipality page changed")
+            elif changed := changed_urls.intersection(station_urls[man_name]):
+                station_changed |= changed
+                logger.info(f"{man_name} : station page changed : {sorted(changed)}")
+            else:
+                continue
+            self.previous_data[man_name] = self.data.pop(man_name)
+        for url in station_changed:
+            station_record_store.invalidate(url)
+            station_page_cache.expire(url)
+        revision_store.save()
+        logger.info(
+            f"refresh : {len(titles)} pages checked, {len(changed_urls)} changed, "
+            f"{baseline} recorded as baseline, "
+            f"{len(self.previous_data)} municipalities to re-collect"
+        )
+        return list(self.previous_data)
+
+    def saved_municipality_url(self, man_name: str) -> Optional[str]:
+        """自治体ページのURLを返す. 記録がなければ保存済みのhtmlの見出しから記事名を取り出す."""
+        if url := revision_store.municipality_url(man_name):
+            return url
+        html = file_manager.load_local_html(man_name)
+        if html is None or not (match := FIRST_HEADING_PATTERN.search(html)):
+            return None
+        title = unescape(re.sub(r"<[^>]+>", "", match.group(1))).strip()
+        if not title:
+            return None
+        url = title_to_url(title)
+        revision_store.set_municipality_url(man_name, url)
+        return url
+
+    def saved_station_urls(self, man_name: str) -> List[str]:
+        """自治体のデータに使った駅ページのURLのリストを返す.
+
+        記録がなければ保存済みの駅リンクと鉄道の節の断片（なければ自治体ページのhtml）から取り出す
+        （ウェブにはアクセスしない）.
+        """
+        if (urls := revision_store.station_urls(man_name)) is not None:
+            return urls
+        links = dict(self.station_links.get(man_name, {}))
+        version = self.extraction_plan.version
+        if fragment := railway_fragment_store.get(man_name, version):
+            links.update(fragment.links)
+        elif (html := file_manager.load_local_html(man_name)) is not None:
+            try:
+                links.update(self.extraction_plan.extract(man_name, html)[0])
+            except ThisAppException:
+                pass
+        urls = [
+            "https://ja.wikipedia.org" + sta_link
+            for sta_link in links.values()
+            if "/wiki/" in sta_link
+        ]
+        revision_store.set_station_urls(man_name, urls)
+        return revision_store.station_urls(man_name) or []
+
+    @staticmethod
+    def known_revision(url: str) -> Optional[int]:
+        """記録されたページの版番号を返す. 記録がなければ駅ページキャッシュのhtmlから取り出す."""
+        if (revision_id := revision_store.revision(url)) is not None:
+            return revision_id
+        if cache_entry := station_page_cache.get(url):
+            return extract_revision_id(cache_entry.html)
+        return None
+
     def run(self) -> None:
         """実行
 
-        自治体リストを回してクローラに入れて結果を求める.
+        自治体リストを回して, まだデータのない自治体を収集パイプラインに流して結果を求める.
+        パイプラインは「記事名の解決 → 自治体ページの取得 → 駅リンクの抽出 → 駅ページの取得 → 集計」の段階からなり,
+        段階の間は大きさの決まったキューでつながれているので, 取得と解析が重なって進んでもメモリに載る自治体の数は増えない.
         """
-        for man_name in self.man_list[self.START_INDEX : self.END_INDEX]:  # noqa: E203
+        man_names: List[str] = []
+        for man_name in self.target_man_names():
             if man_name in self.data:
                 # 既存データにすでにあるとき, 優先データで置き換えるか単純に飛ばす
-                if pri_data := self.priority_data.get(man_name, {}).get("data", None):
-                    # 優先データが指定されているならそれで置き換える.
-                    # sta_data, max, minそれぞれについて個別に見る.
-                    if pri_sta_data := pri_data.get("sta_data", None):
-                        self.data[man_name]["sta_data"] = pri_sta_data
-                    if pri_max_data := pri_data.get("max", None):
-                        self.data[man_name]["max"] = pri_max_data
-                    if pri_min_data := pri_data.get("min", None):
-                        self.data[man_name]["min"] = pri_min_data
-                    logger.info(
-                        f"{man_name} : "
-                        "priority data found. partially or fully replaced it."
+                if self.apply_priority_data(man_name):
+                    file_manager.append_raw_data(
+                        man_name, self.data[man_name], self.data
                     )
                 else:
                     logger.info(f"{man_name} : data already exists. skipped")
                 continue
-            try:
-                result = self.get_year_data(man_name)
-                self.data[man_name] = result
-                logger.info(f"got data : {man_name} : {result}")
-            except ThisAppException as e:
-                file_manager.save_raw_data(self.data)
-                logger.error(e)
-                error_storage.add(e)
-                continue
-            except Exception:
-                e = traceback.format_exc()
-                error_storage.add(e)
-                logger.error(e)
-                file_manager.save_raw_data(self.data)
+            man_names.append(man_name)
+        fetch_workers: int = collector_config["pipeline_fetch_workers"]
+        pipeline = Pipeline(
+            [
+                # ブラウザでの検索があるので記事名の解決は一つのスレッドで行う.
+                Stage("resolve", self._resolve_stage),
+                Stage(
+                    "fetch_municipality", self._fetch_municipality_stage, fetch_workers
+                ),
+                Stage("extract_links", self._extract_links_stage),
+                Stage("fetch_stations", self._fetch_stations_stage, fetch_workers),
+                # データとジャーナルへの書き込みは一つのスレッドだけで行う.
+                Stage("aggregate", self._aggregate_stage),
+            ],
+            collector_config["pipeline_queue_size"],
+            self._on_pipeline_error,
+        )
+        parse_workers: int = collector_config["parse_workers"]
+        parse_executor = ProcessPoolExecutor(parse_workers) if parse_workers else None
+        if parse_executor is not None:
+            # スレッドを立ち上げる前に解析用のプロセスを作っておく.
+            parse_executor.submit(int).result()
+        self.parse_executor = parse_executor
+        self.crawler.parse_executor = parse_executor
+        try:
+            pipeline.run(_CollectJob(man_name) for man_name in man_names)
+        finally:
+            self.parse_executor = None
+            self.crawler.parse_executor = None
+            if parse_executor is not None:
+                parse_executor.shutdown()
+        pipeline.log_stats()
+        if self.OFFLINE_FIRST:
+            # 解決した駅リンクを次回のために保存する.
+            file_manager.save_station_links(self.station_links)
         self.crawler.close_browser()
 
+    def target_man_names(self) -> List[str]:
+        """この実行で受け持つ自治体名のリストを返す. START_INDEXからEND_INDEXまでのうちシャードのもの."""
+        man_names = self.man_list[self.START_INDEX : self.END_INDEX]  # noqa: E203
+        return self.SHARD.select(man_names) if self.SHARD else man_names
+
+    def apply_priority_data(self, man_name: str) -> bool:
+        """既存データを優先データで置き換える.
+
+        sta_data, max, minそれぞれについて個別に見る.
+
+        Args:
+            man_name (str): 既存データにある自治体名.
+
+        Returns:
+            bool: 優先データがあって置き換えたならTrue.
+        """
+        if not (pri_data := self.priority_data.get(man_name, {}).get("data", None)):
+            return False
+        if pri_sta_data := pri_data.get("sta_data", None):
+            self.data[man_name]["sta_data"] = pri_sta_data
+        if pri_max_data := pri_data.get("max", None):
+            self.data[man_name]["max"] = pri_max_data
+        if pri_min_data := pri_data.get("min", None):
+            self.data[man_name]["min"] = pri_min_data
+        logger.info(
+            f"{man_name} : priority data found. partially or fully replaced it."
+        )
+        return True
+
+    def merge_shards(self, count: int) -> None:
+        """シャードごとのパーティションをまとめて保存する.
+
+        各シャードのローデータ（ジャーナルも含む）・エラー・駅リンクを読み込んで既存データに重ね,
+        優先データで置き換えてから, ローデータと結果のcsv, エラーを元のパスに保存する.
+        エラーはシャードのものだけをまとめるので, 何度まとめ直しても重複しない.
+
+        Args:
+            count (int): シャードの数.
+        """
+        errors = ErrorStorage("", error_storage.max_samples)
+        station_links = file_manager.load_station_links()
+        for index in range(count):
+            io = file_manager.for_shard(Shard(index, count))
+            if not (shard_data := io.load_raw_data()):
+                logger.warning(f"no data in shard {index}/{count} ({io.raw_path})")
+            self.data.update(shard_data)
+            errors.merge(io.load_errors())
+            station_links.update(io.load_station_links())
+            logger.info(f"merged shard {index}/{count} : {len(shard_data)} data")
+        for man_name in self.data:
+            self.apply_priority_data(man_name)
+        file_manager.save_raw_data(self.data)
+        file_manager.output_csv(self.data)
+        file_manager.save_errors(errors.summary())
+        if station_links:
+            file_manager.save_station_links(station_links)
+        logger.info(f"merged {len(self.data)} data, {len(errors)} errors.")
+
+    def _resolve_stage(self, job: "_CollectJob") -> "_CollectJob":
+        # 優先データや所在地データで決まるものはここで決め, それ以外は自治体ページの場所を決める.
+        man_name = job.man_name
+        if pri_data := self.get_priority_year_data(man_name):
+            job.result = pri_data
+        elif self.OFFLINE_FIRST and self.gazetteer.stations(man_name):
+            job.offline_first = True
+            job.sta_url_data = self.offline_station_urls(man_name)
+        elif fragment := railway_fragment_store.get(
+            man_name, self.extraction_plan.version
+        ):
+            # 断片があれば自治体ページを読み込んで解析し直さずに済む.
+            logger.info(f"{man_name} : railway fragment is found.")
+            sta_link_data = self.check_station_links(
+                man_name, fragment.links, fragment.warning
+            )
+            job.sta_url_data, job.address_error_stations = self.select_station_urls(
+                man_name, sta_link_data
+            )
+        elif (html := file_manager.load_local_html(man_name)) is not None:
+            logger.info(f"{man_name} is found.")
+            job.html = html
+        else:
+            job.link = self.crawler.get_wiki_link(man_name)
+            logger.info(f"{man_name} : source not exists. fetching from {job.link}")
+        return job
+
+    def _fetch_municipality_stage(self, job: "_CollectJob") -> "_CollectJob":
+        if job.link is not None:
+            job.raw_html = self.crawler.fetch_html(job.link)
+            revision_store.set_municipality_url(job.man_name, job.link)
+            revision_store.record(job.link, extract_revision_id(job.raw_html))
+        return job
+
+    def _extract_links_stage(self, job: "_CollectJob") -> "_CollectJob":
+        # 整形と抽出はCPUを使うので, プロセスプールがあればそちらで行う.
+        if job.html is None and job.raw_html is None:
+            return job
+        if self.parse_executor is not None:
+            # 子プロセスでの記録は集計に入らないので, 待った時間をここで記録する.
+            with metrics.timer("format_and_extract_links"):
+                html, fragment = self.parse_executor.submit(
+                    _format_and_extract, job.man_name, job.html, job.raw_html
+                ).result()
+        else:
+            html, fragment = _format_and_extract(job.man_name, job.html, job.raw_html)
+        if job.raw_html is not None:
+            # ヘッダーなどが長くて邪魔なので交通以外の項やヘッダーを除去してから保存する.
+            file_manager.save_local_html(job.man_name, html)
+            logger.info(f"saved as {job.man_name}.html")
+            job.raw_html = None
+        job.html = None
+        if fragment.links:
+            railway_fragment_store.put(fragment)
+        sta_link_data = self.check_station_links(
+            job.man_name, fragment.links, fragment.warning
+        )
+        job.sta_url_data, job.address_error_stations = self.select_station_urls(
+            job.man_name, sta_link_data
+        )
+        return job
+
+    def _fetch_stations_stage(self, job: "_CollectJob") -> "_CollectJob":
+        if job.sta_url_data is not None:
+            job.sta_record_data = self.crawler.get_station_record_dict(job.sta_url_data)
+        return job
+
+    def _aggregate_stage(self, job: "_CollectJob") -> None:
+        man_name = job.man_name
+        if job.result is None:
+            job.result = self.aggregate_year_data(
+                man_name,
+                job.sta_record_data,
+                job.address_error_stations,
+                job.offline_first,
+            )
+        self.data[man_name] = job.result
+        # 取得できたものはすぐにジャーナルに追記しておき, 途中で落ちても続きから再開できるようにする.
+        file_manager.append_raw_data(man_name, job.result, self.data)
+        logger.info(f"got data : {man_name} : {job.result}")
+
+    def _on_pipeline_error(self, job: "_CollectJob", e: Exception, trace: str) -> None:
+        if isinstance(e, ThisAppException):
+            error_storage.add(e, "e", man_name=job.man_name)
+        else:
+            error_storage.add(
+                trace, "e", category=UNEXPECTED_CATEGORY, man_name=job.man_name
+            )
+
     def save(self) -> None:
         """実行結果をファイルに保存"""
+        for man_name, previous in self.previous_data.items():
+            if man_name not in self.data:
+                # refreshで取り除いたが収集し直せなかったものは元のデータに戻す.
+                logger.warning(f"{man_name} : re-collect failed. previous data kept")
+                self.data[man_name] = previous
+        revision_store.save()
         file_manager.save_raw_data(self.data)
         file_manager.output_csv(self.data)
+        file_manager.save_errors(error_storage.summary())
         logger.info("summary:")
         logger.info(f"got {len(self.data)} data correctly.")
-        if error_storage.storage:
-            logger.info("the following error caused.")
-            for e in error_storage.storage:
-                logger.info(e)
+        self.log_station_memo_stats()
+        self.log_errors()
         logger.info("script finished.")
+
+    def log_station_memo_stats(self) -> None:
+        """駅レコードのメモの当たり・外れの数と, 省けた取得時間の見積もりをログに出力"""
+        hits, misses = station_record_store.hits, station_record_store.misses
+        logger.info(
+            f"station record memo : {hits} hits, {misses} misses "
+            f"({len(station_record_store)} records stored)"
+        )
+        if hits and misses:
+            # 外れた駅の取得・解析にかかった平均時間から, 当たった駅の分を見積もる.
+            average = self.crawler.station_fetch_seconds / misses
+            logger.info(
+                f"station record memo saved {hits} fetches "
+                f"(about {hits * average:.1f} sec)"
+            )
+        elif hits:
+            logger.info(f"station record memo saved {hits} fetches")
+        if self.crawler.station_backend == "wikitext":
+            client = self.crawler.wikitext_client
+            logger.info(
+                f"wikitext backend : {client.requests} requests, "
+                f"{client.bytes_received / 1024:.0f} KB received"
+            )
+
+    def log_errors(self) -> None:
+        """実行中に記録されたエラーを種類ごとの件数と見本にまとめてログに出力"""
+        error_storage.log_summary()
@@ -1,14 +1,24 @@
 import re
-import chromedriver_binary  # noqa: F401
-from bs4.element import Tag
-from typing import Any, Dict, List, Union
-from time import sleep
+import codecs
+import gzip
+import zlib
+import threading
+import http.client
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Final,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from time import perf_counter
 from logzero import logger
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from urllib.parse import quote
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
+from urllib.parse import quote, urljoin, urlsplit
 from appexcp.my_exception import (
     NonWikipediaLink,
     CannotOpenURL,
@@ -17,35 +27,356 @@ from appexcp.my_exception import (
 
 # from error_storage import error_storage
 from filemanager import file_manager
+from infobox import HeaderRow, StreamingHeaderRows, extract_header_rows
+from metrics import metrics
+from page_cache import CacheEntry, normalize_wiki_url, station_page_cache
+from rate_limiter import rate_limiter
+from resolver import TitleResolver
+from revision import extract_revision_id, revision_store, url_to_title
+from station_record import StationRecord, station_record_store
+from wikitext import WikitextClient, parse_station_wikitext
+from settings import crawler_config, session_pool_config
+
+# seleniumとbs4は読み込みに時間がかかるので, 使うときに読み込む.
+# ブラウザを使わずに保存済みのページだけで実行するときはseleniumを読み込まない.
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+    from selenium import webdriver
+
+YEAR_PATTERN: Final = re.compile(r"([0-9]{4})年")
+WIKI_ORIGIN: Final = "https://ja.wikipedia.org"
+
+
+def format_address_text(text: str) -> str:
+    """所在地の欄のテキストから住所の主要部分を返す.
+
+    いらない文字を省き, 空白で分けた最初の部分を返す. これで住所の主要部分はまず取得できる.
+    """
+    return re.sub("[\n\ufeff/]", "", text).split(" ")[0]
+
+
+def parse_opening_year(text: str) -> Union[int, None]:
+    """開業年月日の欄のテキストから年を返す. なければNone."""
+    if year_matched := YEAR_PATTERN.search(text.replace("\n", "")):
+        return int(year_matched.groups()[0])
+    return None
+
+
+def decode_html(body: bytes, charset: Optional[str]) -> Tuple[str, bytes]:
+    """レスポンスの中身をデコードする.
+
+    Args:
+        body (bytes): レスポンスの中身.
+        charset (str | None): Content-Typeのcharset. Noneか分からないものならutf-8とする.
+
+    Returns:
+        Tuple[str, bytes]: デコードしたhtmlと, キャッシュに保存するutf-8のhtml.
+    """
+    try:
+        codec = codecs.lookup(charset or "utf-8").name
+    except LookupError:
+        codec = "utf-8"
+    # 途中で読むのをやめた中身は文字の途中で切れていることがあるので, 壊れた部分は置き換える.
+    html = body.decode(codec, errors="replace")
+    return html, body if codec == "utf-8" else html.encode("utf-8")
+
+
+def station_data_from_rows(rows: List[HeaderRow]) -> Tuple[List[str], Optional[int]]:
+    """thとその次の兄弟要素のテキストの組から所在地リストと開業年を作る.
+
+    Args:
+        rows (List[HeaderRow]): (thのテキスト, 次の兄弟要素のテキストまたはNone)のリスト.
+
+    Returns:
+        Tuple[List[str], int | None]: 所在地リスト（"ケ"は小文字）と開業年（複数あれば最古）.
+    """
+    address_list: List[str] = []
+    years: List[int] = []
+    for header_text, value_text in rows:
+        if value_text is None:
+            continue
+        if "所在地" in header_text:
+            address_list.append(format_address_text(value_text).replace("ケ", "ヶ"))
+        if "開業年月日" in header_text:
+            if (year := parse_opening_year(value_text)) is not None:
+                years.append(year)
+    return address_list, (min(years) if years else None)
+
+
+class HttpResponse:
+    """HTTPレスポンス
+
+    Attributes:
+        url (str): 最終的に取得したURL（リダイレクト後）.
+        status (int): ステータスコード.
+        headers (http.client.HTTPMessage): レスポンスヘッダー.
+        body (bytes): 中身. gzipで送られてきた場合は展開済み.
+        complete (bool): 中身を最後まで読んだかどうか. 途中で読むのをやめたらFalse.
+    """
+
+    __slots__ = ("url", "status", "headers", "body", "complete")
+
+    def __init__(
+        self,
+        url: str,
+        status: int,
+        headers: http.client.HTTPMessage,
+        body: bytes,
+        complete: bool = True,
+    ) -> None:
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.complete = complete
+
+
+class SessionPool:
+    """ブラウザとHTTP接続をまとめて管理するクラス
+
+    ブラウザは初めて必要になったときに起動する. HTTPはホストごとにkeep-aliveの接続を使い回し,
+    gzipで受け取る. 接続は使っていない間プールに戻すので, 複数スレッドから共有できる.
+
+    Attributes:
+        user_agent (str): リクエストに付けるUser-Agent.
+        timeout (float): 接続のタイムアウト秒数.
+        max_idle (int): ホストごとにプールに残しておく接続の最大数.
+        base_url (str): 空でなければja.wikipediaへのリクエストをこのURLに向ける（ローカルの再生サーバーなど）.
+
+    Args:
+        user_agent (str): リクエストに付けるUser-Agent.
+        timeout (float, optional): 接続のタイムアウト秒数.
+        max_idle (int, optional): ホストごとにプールに残しておく接続の最大数.
+        base_url (str, optional): ja.wikipediaの代わりに使うURL（"http://127.0.0.1:8080"など）.
+    """
+
+    MAX_REDIRECTS: Final[int] = 5
+    # 少しずつ読むときに一度に読む大きさ.
+    CHUNK_SIZE: Final[int] = 16384
+
+    def __init__(
+        self,
+        user_agent: str,
+        timeout: float = 30,
+        max_idle: int = 8,
+        base_url: str = "",
+    ) -> None:
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.base_url = base_url.rstrip("/")
+        self._idle: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._driver_lock = threading.Lock()
+        self._driver = None
+
+    @property
+    def driver(self) -> "webdriver.Chrome":
+        """ブラウザ. 初めて参照したときに起動する."""
+        with self._driver_lock:
+            if self._driver is None:
+                import chromedriver_binary  # noqa: F401
+                from selenium import webdriver
+                from selenium.webdriver.chrome.options import Options
+
+                options = Options()
+                options.add_argument("--headless")  # ヘッドレスモード
+                # options.add_argument("incognito")  # シークレットモード
+                self._driver = webdriver.Chrome(options=options)
+            return self._driver
+
+    def _acquire(self, scheme: str, host: str) -> http.client.HTTPConnection:
+        with self._lock:
+            if idle := self._idle.get((scheme, host)):
+                return idle.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _release(
+        self, scheme: str, host: str, connection: http.client.HTTPConnection
+    ) -> None:
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        on_chunk: Optional[Callable[[bytes], bool]] = None,
+    ) -> HttpResponse:
+        """GETリクエストを送る.
+
+        リダイレクトはたどり, 切れていた接続は一度だけ繋ぎ直す. ステータスコードによる例外は出さない.
+
+        Args:
+            url (str): URL.
+            headers (Dict[str, str] | None, optional): 追加のリクエストヘッダー.
+            on_chunk (Callable[[bytes], bool] | None, optional): 渡すと200のレスポンスの中身を
+                少しずつ展開しながら渡し, Trueが返ったらそこで読むのをやめて接続を閉じる.
+
+        Returns:
+            HttpResponse: レスポンス.
+        """
+        request_headers = {
+            "User-Agent": self.user_agent,
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
+        request_headers.update(headers or {})
+        if self.base_url and url.startswith(WIKI_ORIGIN):
+            # キャッシュやメモのキーは元のURLのままにし, 送り先だけを変える.
+            url = self.base_url + url[len(WIKI_ORIGIN) :]  # noqa: E203
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            for retry in range(2):
+                connection = self._acquire(parts.scheme, parts.netloc)
+                streaming = False
+                try:
+                    connection.request("GET", path, headers=request_headers)
+                    response = connection.getresponse()
+                    streaming = on_chunk is not None and response.status == 200
+                    if streaming:
+                        body, complete = self._read_chunks(response, on_chunk)
+                    else:
+                        body, complete = response.read(), True
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    # プールにあった接続がサーバー側で切られていた場合は繋ぎ直す.
+                    # 途中まで渡してしまった中身は取り消せないので, そのときは繋ぎ直さない.
+                    connection.close()
+                    if retry or streaming:
+                        raise
+                except BaseException:
+                    # タイムアウトなど繋ぎ直しても直らないものはそのまま送る. 途中まで使った接続は閉じる.
+                    connection.close()
+                    raise
+            if response.will_close or not complete:
+                # 読み残しがある接続は使い回せない.
+                connection.close()
+            else:
+                self._release(parts.scheme, parts.netloc, connection)
+            if not streaming and response.getheader("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            if response.status in (301, 302, 303, 307, 308) and (
+                location := response.getheader("Location")
+            ):
+                url = urljoin(url, location)
+                continue
+            metrics.count("http_requests")
+            metrics.count("http_bytes_received", len(body))
+            return HttpResponse(url, response.status, response.headers, body, complete)
+        raise http.client.HTTPException(f"too many redirects : {url}")
+
+    def _read_chunks(
+        self, response: http.client.HTTPResponse, on_chunk: Callable[[bytes], bool]
+    ) -> Tuple[bytes, bool]:
+        # 中身を少しずつ読んで展開しon_chunkに渡す. (読んだところまでの中身, 最後まで読んだか)を返す.
+        decompressor = (
+            zlib.decompressobj(wbits=31)
+            if response.getheader("Content-Encoding") == "gzip"
+            else None
+        )
+        chunks: List[bytes] = []
+        while chunk := response.read(self.CHUNK_SIZE):
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            chunks.append(chunk)
+            if chunk and on_chunk(chunk):
+                return b"".join(chunks), False
+        if decompressor is not None and (chunk := decompressor.flush()):
+            chunks.append(chunk)
+            on_chunk(chunk)
+        return b"".join(chunks), True
+
+    def close(self) -> None:
+        """ブラウザを起動していれば閉じ, プールの接続も全て閉じる."""
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+            driver, self._driver = self._driver, None
+        if driver is not None:
+            driver.quit()
 
 
 class Crawler:
-    def __init__(self) -> None:
+    """ウェブから情報を持ってくるクラス
+
+    Args:
+        fetch_workers (int, optional): 駅ページを同時に取得するスレッド数.
+        extractor_engine (str, optional): 駅ページの解析方法. "soup"ならBeautifulSoup,
+            "fast", "tokenizer", "lxml"ならinfoboxモジュールの高速な抽出を使う.
+        station_backend (str, optional): 駅情報の取得方法. "html"なら駅ページを一件ずつ取得し,
+            "wikitext"ならAPIでウィキテキストをまとめて取得する（取り出せなかった駅だけhtmlで取得する）.
+        stream_station_pages (bool, optional): 駅ページを少しずつ読みながら解析し,
+            導入部のinfoboxを読み終えたら残りを読まずに接続を閉じるかどうか. extractor_engineが"soup"なら使わない.
+        priority_data (Dict[str, Any] | None, optional): 優先データ. 読み込み済みのものを共有するときに渡す.
+            Noneならファイルから読み込む.
+    """
+
+    def __init__(
+        self,
+        fetch_workers: int = crawler_config["fetch_workers"],
+        extractor_engine: str = crawler_config["extractor_engine"],
+        station_backend: str = crawler_config["station_backend"],
+        stream_station_pages: bool = crawler_config["stream_station_pages"],
+        priority_data: Optional[Dict[str, Any]] = None,
+    ) -> None:
         # 優先データを辞書として持っておく.
         # URLが見つけられない場合のURLや, データが誤りのときのデータなどを手動で書いておく.
-        self.priority_data: Dict[str, Any] = file_manager.load_priority_data()
+        if priority_data is None:
+            priority_data = file_manager.load_priority_data()
+        self.priority_data: Dict[str, Any] = priority_data
+        # 駅ページを同時に取得するスレッド数. アクセス頻度自体はrate_limiterで制限する.
+        self.fetch_workers: int = max(fetch_workers, 1)
+        self.extractor_engine: str = extractor_engine
+        self.station_backend: str = station_backend
+        self.stream_station_pages: bool = (
+            stream_station_pages and extractor_engine != "soup"
+        )
+        # ブラウザは必要になるまで起動せず, HTTP接続は全ての取得で使い回す.
+        self.session_pool = SessionPool(**session_pool_config)
+        # 自治体名から記事名を解決する. ブラウザは使わずHTTPだけで問い合わせる.
+        self.resolver = TitleResolver(self.fetch, crawler_config["title_index_path"])
+        # 駅のウィキテキストをまとめて取得する. station_backendが"wikitext"のときだけ使う.
+        self.wikitext_client = WikitextClient(self.fetch, crawler_config["api_url"])
+        # 駅ページの解析を任せるプロセスプール. Noneなら取得したスレッドで解析する.
+        self.parse_executor: Optional[Executor] = None
+        # メモになかった駅の取得・解析にかかった合計秒数. メモで省けた時間の見積もりに使う.
+        self.station_fetch_seconds: float = 0.0
+        self._stats_lock = threading.Lock()
 
     def open_browser(self) -> None:
         """ブラウザーを起動. すでに起動しているならなにもしない."""
-        if not hasattr(self, "driver"):
-            options = Options()
-            options.add_argument("--headless")  # ヘッドレスモード
-            # options.add_argument("incognito")  # シークレットモード
-            self.driver = webdriver.Chrome(options=options)
+        self.session_pool.driver
 
     def close_browser(self) -> None:
-        """ブラウザを開いているなら閉じる.
+        """ブラウザを開いているなら閉じる. HTTP接続も閉じる.
 
         デストラクタでquitしようとするとエラーで落ちるのでこのようにしている. 必ず最後にこれを呼ぶ.
         """
-        if hasattr(self, "driver"):
-            self.driver.quit()
+        self.session_pool.close()
+
+    @property
+    def driver(self) -> "webdriver.Chrome":
+        """ブラウザ. 初めて参照したときに起動する."""
+        return self.session_pool.driver
 
+    @metrics.timed("get_wiki_link")
     def get_wiki_link(self, man_name: str) -> str:
         """wikipediaのリンクを取得.
 
-        seleniumでchromeを操作して自治体名から検索結果のリンクを取ってくる.
-        与えられた自治体名 + wikipediaで検索する.
+        優先データにURLがあればそれを返す. なければ記事名の候補とタイトル一覧・APIで記事を探し,
+        それでも見つからない場合に限りブラウザを起動して検索する.
         エラーを見つけたら手動で優先データに追加しておくこと.
 
         Args:
@@ -57,12 +388,34 @@ class Crawler:
         Raises:
             NonWikipediaLink: 取得したリンクがWikipediaのものでない場合に発生.
         """
-        self.open_browser()
         if self.priority_data.get(man_name, {}).get("url", None):
             link: str = self.priority_data[man_name]["url"]
             return link
-        self.driver.get(f"https://www.google.com/search?q={quote(man_name)}+wikipedia")
-        sleep(2)  # 待機
+        if link := self.resolver.resolve(man_name):
+            return link
+        logger.info(f"{man_name} : title not resolved. searching with browser.")
+        return self.search_wiki_link(man_name)
+
+    @metrics.timed("search_wiki_link")
+    def search_wiki_link(self, man_name: str) -> str:
+        """ブラウザで検索してwikipediaのリンクを取得.
+
+        seleniumでchromeを操作して自治体名から検索結果のリンクを取ってくる.
+        与えられた自治体名 + wikipediaで検索する. ブラウザはここで初めて起動する.
+
+        Args:
+            man_name (str): 自治体名.
+
+        Returns:
+            str: リンクを文字列で返す.
+
+        Raises:
+            NonWikipediaLink: 取得したリンクがWikipediaのものでない場合に発生.
+        """
+        search_url = f"https://www.google.com/search?q={quote(man_name)}+wikipedia"
+        # 検索もほかの取得と同じくホストごとのレート制限にかける.
+        rate_limiter.acquire(search_url)
+        self.driver.get(search_url)
         # 検索結果のブロックはgクラスがつけられている.
         search_result = self.driver.find_elements_by_css_selector(".g > div > div")
         link: str = search_result[0].find_element_by_tag_name("a").get_attribute("href")
@@ -71,7 +424,9 @@ class Crawler:
             raise NonWikipediaLink(man_name, link)
         return link
 
-    def source_formatting(self, html: str) -> str:
+    @staticmethod
+    @metrics.timed("source_formatting")
+    def source_formatting(html: str) -> str:
         """htmlを整形.
 
         与えられたhtmlの交通に関する部分以外をできるだけ潰して容量を削減する.
@@ -83,6 +438,8 @@ class Crawler:
         Returns:
             str: 整形済みhtmlソース.
         """
+        from bs4 import BeautifulSoup
+
         soup = BeautifulSoup(html, "html.parser")
         # soup.select_one("head").decompose()
         if head_elem := soup.select_one("head"):
@@ -112,6 +469,7 @@ class Crawler:
         )
         return result_html
 
+    @metrics.timed("get_source")
     def get_source(self, man_name: str) -> str:
         """自治体のhtmlソースを取得.
 
@@ -129,24 +487,80 @@ class Crawler:
         if html is None:
             link = self.get_wiki_link(man_name)
             logger.info(f"{man_name} : source not exists. fetching from {link}")
-            self.driver.get(link)
-            sleep(1)
             # ヘッダーなどが長くて邪魔なので交通以外の項やヘッダーを除去してからhtmlソースとする.
-            html = self.source_formatting(self.driver.page_source)
+            raw_html = self.fetch_html(link)
+            revision_store.set_municipality_url(man_name, link)
+            revision_store.record(link, extract_revision_id(raw_html))
+            html = self.source_formatting(raw_html)
             file_manager.save_local_html(man_name, html)
             logger.info(f"saved as {man_name}.html")
         else:
             logger.info(f"{man_name} is found.")
         return html
 
-    def get_station_html(self, sta_name: str, sta_link: str) -> str:
+    def fetch(self, url: str) -> bytes:
+        """URLの中身を取得.
+
+        ホストごとのレート制限で待機してから, 使い回しの接続でHTTPで取得する.
+
+        Args:
+            url (str): URL.
+
+        Returns:
+            bytes: レスポンスの中身.
+
+        Raises:
+            CannotOpenURL: 取得できなかった場合に発生.
+        """
+        return self._get(url).body
+
+    def fetch_html(self, url: str) -> str:
+        """URLのhtmlを取得して, Content-Typeの文字コードで読む.
+
+        Args:
+            url (str): URL.
+
+        Returns:
+            str: htmlソース.
+
+        Raises:
+            CannotOpenURL: 取得できなかった場合に発生.
+        """
+        response = self._get(url)
+        html, _ = decode_html(response.body, response.headers.get_content_charset())
+        return html
+
+    def _get(self, url: str) -> HttpResponse:
+        rate_limiter.acquire(url)
+        try:
+            response = self.session_pool.request(url)
+        except Exception as e:
+            raise CannotOpenURL(f"cannot open URL : {url} ({e})")
+        if response.status != 200:
+            raise CannotOpenURL(f"cannot open URL : {url} (status {response.status})")
+        return response
+
+    @metrics.timed("get_station_html")
+    def get_station_html(
+        self,
+        sta_name: str,
+        sta_link: str,
+        on_chunk: Optional[Callable[[bytes], bool]] = None,
+    ) -> str:
         """駅のリンク先のhtmlを返す.
 
-        駅名とリンクを入力し, リンク先のhtmlを正しく取得する. 取得に成功したら適当な秒数待つ.
+        駅名とリンクを入力し, リンク先のhtmlを正しく取得する.
+        キャッシュが有効期限内ならそれを返し, 期限切れなら条件付きリクエストで再検証する.
+        取得前にホストごとのレート制限で待機するので, 複数スレッドから呼んでもアクセス頻度は設定値に収まる.
+        on_chunkを渡すと, ウェブからでもキャッシュからでもhtmlを少しずつ渡し, Trueが返ったらそこで読むのをやめる.
+        このとき返すhtmlとキャッシュに保存するhtmlは読んだところまでになる. 途中までのhtmlは途中までと印を付けて
+        保存するので, on_chunkを渡さない取得ではキャッシュにないものとして扱う.
+        レスポンスはContent-Typeのcharsetで一度だけデコードし, キャッシュにはutf-8で保存する.
 
         Args:
             sta_name (str): 駅名. ログ表示にしか使っていないので必要ないかもしれない...
             sta_link (str): 駅のリンク. 特にチェックはしないので正しいリンクを入れる必要がある.
+            on_chunk (Callable[[bytes], bool] | None, optional): htmlの続きを受け取る関数.
 
         Returns:
             str: htmlソースを返す.
@@ -155,17 +569,243 @@ class Crawler:
             CannotOpenURL: 入力されたリンクが開けない, またはエラーが発生した場合に発生.
         """
         # 駅のリンク先htmlを返す.
+        cache_entry = station_page_cache.get(
+            sta_link, with_html=on_chunk is None, partial_ok=on_chunk is not None
+        )
+        if cache_entry is not None and station_page_cache.is_fresh(cache_entry):
+            metrics.count("station_cache_hits")
+            return self._read_cached_html(sta_name, cache_entry, on_chunk)
+        headers = cache_entry.validation_headers() if cache_entry else {}
+        rate_limiter.acquire(sta_link)
         try:
-            with urlopen(sta_link) as response:
-                html: str = response.read()
-                sleep(2.8)
+            response = self.session_pool.request(sta_link, headers, on_chunk)
         except Exception as e:
-            print(e)
-            raise CannotOpenURL(f"cannot open URL : {sta_link} ({sta_name})")
+            logger.warning(f"cannot open URL : {sta_link} ({sta_name}) : {e!r}")
+            raise CannotOpenURL(f"cannot open URL : {sta_link} ({sta_name}, {e})")
+        file_manager.record_fetch(
+            sta_link,
+            response.status,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+        if response.status == 304 and cache_entry is not None:
+            # 更新されていないのでキャッシュを使う.
+            station_page_cache.revalidated(cache_entry)
+            metrics.count("station_cache_revalidated")
+            return self._read_cached_html(sta_name, cache_entry, on_chunk)
+        if response.status != 200:
+            raise CannotOpenURL(
+                f"cannot open URL : {sta_link} ({sta_name}, status {response.status})"
+            )
+        html, body = decode_html(response.body, response.headers.get_content_charset())
+        revision_store.record(sta_link, extract_revision_id(body))
+        station_page_cache.put(
+            sta_link,
+            body,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            partial=not response.complete,
+        )
         return html
 
+    def _read_cached_html(
+        self,
+        sta_name: str,
+        cache_entry: CacheEntry,
+        on_chunk: Optional[Callable[[bytes], bool]],
+    ) -> str:
+        # on_chunkがなければ読み込み済みのhtmlを, あれば少しずつ読んで渡したところまでを返す.
+        if on_chunk is None:
+            return cache_entry.html.decode("utf-8", errors="replace")
+        if (html := station_page_cache.read_html(cache_entry.url, on_chunk)) is None:
+            raise CannotOpenURL(
+                f"cannot read cached page : {cache_entry.url} ({sta_name})"
+            )
+        return html.decode("utf-8", errors="replace")
+
+    def get_station_record(self, sta_name: str, sta_link: str) -> StationRecord:
+        """駅レコードを取得.
+
+        メモにあればそれを返し, なければ駅ページを取得・解析して駅レコードを作りメモに追加する.
+        駅レコードの所在地リストは駅ページのもののみで, 住所録のデータは含まない.
+
+        Args:
+            sta_name (str): 駅名.
+            sta_link (str): 駅のリンク（完全なURL）.
+
+        Returns:
+            StationRecord: 駅レコード.
+
+        Raises:
+            CannotOpenURL: 駅ページが取得できなかった場合に発生.
+        """
+        if record := station_record_store.get(sta_link):
+            return record
+        return self.fetch_station_record(sta_name, sta_link)
+
+    def fetch_station_record(self, sta_name: str, sta_link: str) -> StationRecord:
+        """メモを見ずに駅ページを取得・解析して駅レコードを作り, メモに追加する.
+
+        Args:
+            sta_name (str): 駅名.
+            sta_link (str): 駅のリンク（完全なURL）.
+
+        Returns:
+            StationRecord: 駅レコード.
+
+        Raises:
+            CannotOpenURL: 駅ページが取得できなかった場合に発生.
+        """
+        start = perf_counter()
+        if self.stream_station_pages:
+            # 読みながら解析するので, infoboxを読み終えたところで取得も解析も終わる.
+            rows = StreamingHeaderRows()
+            self.get_station_html(sta_name, sta_link, rows.feed)
+            address_list, opening_year = station_data_from_rows(rows.close())
+        elif self.parse_executor is not None:
+            html = self.get_station_html(sta_name, sta_link)
+            # 子プロセスでの記録は集計に入らないので, 待った時間をここで記録する.
+            with metrics.timer("parse_station_page"):
+                address_list, opening_year = self.parse_executor.submit(
+                    _parse_station_page, html, self.extractor_engine
+                ).result()
+        else:
+            html = self.get_station_html(sta_name, sta_link)
+            address_list, opening_year = self.parse_station_page(html)
+        record = StationRecord(sta_name, sta_link, address_list, opening_year)
+        station_record_store.put(record)
+        with self._stats_lock:
+            self.station_fetch_seconds += perf_counter() - start
+        return record
+
+    def get_station_record_dict(
+        self, sta_link_data: Dict[str, str]
+    ) -> Dict[str, Union[StationRecord, CannotOpenURL]]:
+        """複数の駅の駅レコードをまとめて取得.
+
+        駅名とリンクの辞書を受け取り, スレッドプールで並列に駅レコードを取得する.
+        取得に失敗した駅は例外を値として入れておき, 呼び出し側で扱いを決める.
+
+        Args:
+            sta_link_data (Dict[str, str]): 駅名がキー, リンク（完全なURL）が値の辞書.
+
+        Returns:
+            Dict[str, StationRecord | CannotOpenURL]: 駅名がキー, 駅レコードまたは発生した例外が値の辞書.
+        """
+
+        # 同じページへのリンクが複数あっても一度だけ取得する.
+        unique_links: Dict[str, Tuple[str, str]] = {}
+        for name, link in sta_link_data.items():
+            unique_links.setdefault(normalize_wiki_url(link), (name, link))
+        results: Dict[str, Union[StationRecord, CannotOpenURL]] = {}
+        get_record = self.get_station_record
+        if self.station_backend == "wikitext":
+            # メモになかった駅はウィキテキストでまとめて取得し, 取り出せなかった駅だけhtmlで取得する.
+            results.update(self.get_station_records_by_wikitext(unique_links))
+            get_record = self.fetch_station_record
+        remaining_links = {
+            url: args for url, args in unique_links.items() if url not in results
+        }
+
+        def fetch(sta_name: str, sta_link: str) -> Union[StationRecord, CannotOpenURL]:
+            try:
+                return get_record(sta_name, sta_link)
+            except CannotOpenURL as e:
+                return e
+
+        if self.fetch_workers == 1 or len(remaining_links) <= 1:
+            results.update({url: fetch(*args) for url, args in remaining_links.items()})
+        else:
+            with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+                futures = {
+                    url: executor.submit(fetch, *args)
+                    for url, args in remaining_links.items()
+                }
+                results.update(
+                    {url: future.result() for url, future in futures.items()}
+                )
+        return {
+            name: results[normalize_wiki_url(link)]
+            for name, link in sta_link_data.items()
+        }
+
+    def get_station_records_by_wikitext(
+        self, unique_links: Dict[str, Tuple[str, str]]
+    ) -> Dict[str, StationRecord]:
+        """メモになかった駅の駅レコードをウィキテキストからまとめて作る.
+
+        メモにある駅はそれを使い, 残りはAPIでウィキテキストを取得して所在地と開業年月日の引数から駅レコードを作り,
+        メモに追加する. 記事のURLでないもの, 取得できなかったもの, 所在地か開業年が読み取れなかったものは
+        メモに追加せず結果にも含めない（呼び出し側でhtmlから取得する）.
+
+        Args:
+            unique_links (Dict[str, Tuple[str, str]]): 正規化したURLがキー, (駅名, リンク)が値の辞書.
+
+        Returns:
+            Dict[str, StationRecord]: 正規化したURLがキー, 駅レコードが値の辞書.
+        """
+        records: Dict[str, StationRecord] = {}
+        titles: Dict[str, str] = {}
+        for url, (sta_name, sta_link) in unique_links.items():
+            if record := station_record_store.get(sta_link):
+                records[url] = record
+            elif title := url_to_title(url):
+                titles[url] = title
+        if not titles:
+            return records
+        start = perf_counter()
+        pages = self.wikitext_client.query_wikitext(list(titles.values()))
+        for url, title in titles.items():
+            if not (page := pages.get(title)):
+                continue
+            revision_id, wikitext = page
+            if (values := parse_station_wikitext(wikitext)) is None:
+                continue
+            address_values, date_values = values
+            address_list = [
+                format_address_text(text).replace("ケ", "ヶ") for text in address_values
+            ]
+            years = [
+                year
+                for text in date_values
+                if (year := parse_opening_year(text)) is not None
+            ]
+            if not any(address_list) or not years:
+                # 読み取れなかった欄があればメモに残さず, htmlで取得し直す.
+                continue
+            record = StationRecord(
+                unique_links[url][0], unique_links[url][1], address_list, min(years)
+            )
+            station_record_store.put(record)
+            revision_store.record(url, revision_id)
+            records[url] = record
+        with self._stats_lock:
+            self.station_fetch_seconds += perf_counter() - start
+        return records
+
+    def merge_address_list(
+        self, sta_name: str, address_dict: Dict[str, List[str]], record: StationRecord
+    ) -> List[str]:
+        """駅レコードの所在地リストに住所録のデータを加えて返す.
+
+        get_address_listと同じ形式（住所録のデータが先, "ケ"は小文字）のリストになる.
+
+        Args:
+            sta_name (str): 駅名.
+            address_dict (Dict[str, List[str]]): 住所録.
+            record (StationRecord): 駅レコード.
+
+        Returns:
+            List[str]: 所在地リスト.
+        """
+        result = [
+            text.replace("ケ", "ヶ") for text in address_dict.get(sta_name[:-1], [])
+        ]
+        result.extend(record.address_list)
+        return result
+
     def get_address_list(
-        self, sta_name: str, address_dict: Dict[str, List[str]], soup: BeautifulSoup
+        self, sta_name: str, address_dict: Dict[str, List[str]], soup: "BeautifulSoup"
     ) -> List[str]:
         """駅に対する所在地リストを取得
 
@@ -179,6 +819,8 @@ class Crawler:
         Returns:
             List[str]: 所在地リスト. 含まれる"ケ"の字はすべて小文字に置き換えられている.
         """
+        from bs4.element import Tag
+
         result: List[str] = []
         # 全駅データの辞書には「駅」を省いた名前が書いてあるのでそれに対応して一文字消す
         result.extend(address_dict.get(sta_name[:-1], []))
@@ -186,16 +828,14 @@ class Crawler:
         for address_header_tag in address_header_tag_list:
             # 所在地タグの隣のタグのテキストを取得し, とりあえずいらない文字を省く
             if type(address_elem := address_header_tag.find_next_sibling()) is Tag:
-                text = re.sub("[\n\ufeff/]", "", address_elem.get_text())
-                # 空白で分けた最初の部分を取得すれば住所の主要部分はまず取得できる.
-                result.append(text.split(" ")[0])
+                result.append(format_address_text(address_elem.get_text()))
         # 取得した住所の大きいケはすべて小文字にしておく.
         # 日本市町村人口.csvの自治体名は全て小文字なのでこれで統一される.
         return [text.replace("ケ", "ヶ") for text in result]
 
     def get_opening_date(
         self,
-        soup: BeautifulSoup,
+        soup: "BeautifulSoup",
     ) -> Union[int, None]:
         """開業年を返す.
 
@@ -208,23 +848,60 @@ class Crawler:
         Returns:
             int | None: 整数で開業年, またはNone.
         """
+        from bs4.element import Tag
+
         # 開業年月日というテキストを持つthタグの隣のタグを持ってくる.
         date_header_tag_list = soup.select("th:-soup-contains('開業年月日')")
         # そのような部分がない場合はNoneを返す.
         if not date_header_tag_list:
             return None
         # 正規表現で年を抜き出して整数にしてリストに格納
-        year_pattern = re.compile(r"([0-9]{4})年")
         years: List[int] = []
         for row in date_header_tag_list:
             if type(date_elem := row.find_next_sibling()) is Tag:
-                if year_matched := year_pattern.search(
-                    date_elem.get_text().replace("\n", "")
-                ):
-                    years.append(int(year_matched.groups()[0]))
+                if (year := parse_opening_year(date_elem.get_text())) is not None:
+                    years.append(year)
         # 最大の数字を返す.
         # ->ここは最小にしておく（最近wikiページでの別枠ができることは少ないだろうので）
         # 最後でも空の場合例外を送出
         if not years:
             return None
         return min(years)
+
+    @metrics.timed("parse_station_page")
+    def parse_station_page(
+        self, html: Union[str, bytes]
+    ) -> Tuple[List[str], Optional[int]]:
+        """駅ページから所在地リストと開業年を取得.
+
+        extractor_engineが"soup"ならget_address_listとget_opening_dateを使い,
+        それ以外ならthとその隣の要素だけを一度の走査で抜き出して同じ結果を作る.
+
+        Args:
+            html (str | bytes): 駅ページのhtmlソース.
+
+        Returns:
+            Tuple[List[str], int | None]: 所在地リスト（住所録のデータは含まない）と開業年.
+        """
+        if self.extractor_engine == "soup":
+            from bs4 import BeautifulSoup
+
+            soup = BeautifulSoup(html, "html.parser")
+            return self.get_address_list("", {}, soup), self.get_opening_date(soup)
+        return station_data_from_rows(extract_header_rows(html, self.extractor_engine))
+
+
+_parse_crawler: Optional[Crawler] = None
+
+
+def _parse_station_page(
+    html: Union[str, bytes], extractor_engine: str
+) -> Tuple[List[str], Optional[int]]:
+    # プロセスプールから呼ばれる. プロセスごとに一つ作ったクローラで解析する.
+    global _parse_crawler
+    if _parse_crawler is None or _parse_crawler.extractor_engine != extractor_engine:
+        # 解析しかしないので優先データは読み込まない.
+        _parse_crawler = Crawler(
+            fetch_workers=1, extractor_engine=extractor_engine, priority_data={}
+        )
+    return _parse_crawler.parse_station_page(html)
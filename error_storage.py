@@ -1,20 +1,292 @@
+"""実行中のエラーの記録
+
+エラーや警告を種類（例外のクラスや想定されるエラーの文から決める）ごとに数え,
+種類ごとに決まった数だけを無作為に選んだ見本として持つ. 長い実行でもメモリに持つ量は増えない.
+全ての記録は一件ずつjsonl形式でファイルに追記するので, 見本に残らなかったものも後から追える.
+
+    error_storage.add(e, "e", man_name=man_name)
+    error_storage.add(message, "w", category="address_check_failed", man_name=man_name)
+
+"""
+
+import json
+import random
+import threading
+from time import time
+from typing import Any, Dict, Final, List, Optional, Type, Union
 from logzero import logger
+from appexcp.my_exception import (
+    CannotOpenURL,
+    ElementNotFound,
+    NoDateInfo,
+    NonWikipediaLink,
+    ThisAppException,
+)
+from filemanager import file_manager
+from shard import Shard
+from settings import error_storage_config
+
+# 例外のクラスと種類の対応. 上にあるものから順に調べる.
+EXCEPTION_CATEGORIES: Final[Dict[Type[Exception], str]] = {
+    NonWikipediaLink: "non_wikipedia_link",
+    ElementNotFound: "railroad_section_not_found",
+    CannotOpenURL: "cannot_open_url",
+    NoDateInfo: "no_date_info",
+    ThisAppException: "app_error",
+}
+# 種類を指定しない文字列の種類.
+DEFAULT_CATEGORY: Final = "other"
+# 想定していない例外（トレースバック）の種類.
+UNEXPECTED_CATEGORY: Final = "unexpected"
+
+
+def error_category(error: Union[Exception, str]) -> str:
+    """エラーの種類を返す.
+
+    Args:
+        error (Exception | str): 例外かエラーの文.
+
+    Returns:
+        str: 例外ならそのクラスから決まる種類, 文ならDEFAULT_CATEGORY.
+    """
+    if not isinstance(error, Exception):
+        return DEFAULT_CATEGORY
+    for exception_class, category in EXCEPTION_CATEGORIES.items():
+        if isinstance(error, exception_class):
+            return category
+    return UNEXPECTED_CATEGORY
+
+
+class ErrorRecord:
+    """エラー一件の記録
+
+    Attributes:
+        category (str): 種類.
+        message (str): エラーの文.
+        man_name (str | None): 自治体名. 分からなければNone.
+        station (str | None): 駅名. 駅に関するものでなければNone.
+        time (float): 記録した時刻（UNIX時間）.
+    """
+
+    __slots__ = ("category", "message", "man_name", "station", "time")
+
+    def __init__(
+        self,
+        category: str,
+        message: str,
+        man_name: Optional[str] = None,
+        station: Optional[str] = None,
+        time: float = 0.0,
+    ) -> None:
+        self.category = category
+        self.message = message
+        self.man_name = man_name
+        self.station = station
+        self.time = time
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "category": self.category,
+            "message": self.message,
+            "man_name": self.man_name,
+            "station": self.station,
+            "time": self.time,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ErrorRecord":
+        return cls(
+            data["category"],
+            data["message"],
+            data.get("man_name"),
+            data.get("station"),
+            data.get("time", 0.0),
+        )
+
+    def __str__(self) -> str:
+        return self.message
+
+    def __repr__(self) -> str:
+        return f"ErrorRecord({self.category!r}, {self.message!r})"
 
 
 class ErrorStorage:
-    def __init__(self) -> None:
-        self.storage = []
-
-    def add(self, content, log: str = ""):
-        # log引数を付けておくと自動でログ出力もされる.
-        if log:
-            if log == "i":
-                logger.info(content)
-            elif log == "w":
-                logger.warning(content)
-            elif log == "e":
-                logger.error(content)
-        self.storage.append(content)
-
-
-error_storage = ErrorStorage()
+    """種類ごとに数えて見本を持つエラーの記録
+
+    種類ごとの見本は最大max_samples件で, それを超えたら蓄積サンプリング（reservoir sampling）で
+    それまでの全件から同じ確率で選ばれるように入れ替える.
+
+    Attributes:
+        path (str): 全ての記録を追記するjsonlファイルのパス. シャードを使うときはそのパーティション.
+        max_samples (int): 種類ごとに持つ見本の最大数.
+        counts (Dict[str, int]): 種類ごとの件数（記録した順）.
+
+    Args:
+        path (str): 全ての記録を追記するjsonlファイルのパス. 空なら追記しない.
+        max_samples (int, optional): 種類ごとに持つ見本の最大数.
+    """
+
+    def __init__(self, path: str, max_samples: int = 20) -> None:
+        self.path = path
+        self._base_path = path
+        self.max_samples = max_samples
+        self.counts: Dict[str, int] = {}
+        self._samples: Dict[str, List[ErrorRecord]] = {}
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        content: Union[Exception, str],
+        log: str = "",
+        category: Optional[str] = None,
+        man_name: Optional[str] = None,
+        station: Optional[str] = None,
+    ) -> ErrorRecord:
+        """エラーを記録する.
+
+        Args:
+            content (Exception | str): 例外かエラーの文.
+            log (str, optional): "i", "w", "e"のどれかを付けるとそのレベルでログにも出力する.
+            category (str | None, optional): 種類. Noneなら例外のクラスから決める.
+            man_name (str | None, optional): 自治体名. Noneなら例外が持っていればそれを使う.
+            station (str | None, optional): 駅名.
+
+        Returns:
+            ErrorRecord: 記録したもの.
+        """
+        if log == "i":
+            logger.info(content)
+        elif log == "w":
+            logger.warning(content)
+        elif log == "e":
+            logger.error(content)
+        record = ErrorRecord(
+            category or error_category(content),
+            str(content),
+            man_name or getattr(content, "man_name", None),
+            station,
+            time(),
+        )
+        with self._lock:
+            self._count(record)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+        file_manager.record_error(record.message, record.man_name)
+        return record
+
+    def _count(self, record: ErrorRecord) -> None:
+        count = self.counts.get(record.category, 0) + 1
+        self.counts[record.category] = count
+        samples = self._samples.setdefault(record.category, [])
+        if len(samples) < self.max_samples:
+            samples.append(record)
+        elif (index := self._random.randrange(count)) < self.max_samples:
+            samples[index] = record
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(self.counts.values())
+
+    def samples(self, category: Optional[str] = None) -> List[ErrorRecord]:
+        """見本を時刻順に返す.
+
+        Args:
+            category (str | None, optional): 種類. Noneなら全ての種類.
+        """
+        with self._lock:
+            if category is None:
+                records = [r for s in self._samples.values() for r in s]
+            else:
+                records = list(self._samples.get(category, []))
+        return sorted(records, key=lambda record: record.time)
+
+    def summary(self) -> Dict[str, Any]:
+        """件数と種類ごとの件数・見本をjsonにできる辞書で返す."""
+        with self._lock:
+            return {
+                "total": sum(self.counts.values()),
+                "categories": {
+                    category: {
+                        "count": count,
+                        "samples": [
+                            record.to_dict()
+                            for record in sorted(
+                                self._samples.get(category, []),
+                                key=lambda record: record.time,
+                            )
+                        ],
+                    }
+                    for category, count in self.counts.items()
+                },
+            }
+
+    def merge(self, summary: Union[Dict[str, Any], List[str]]) -> None:
+        """別のプロセス（シャード）のsummaryを足し合わせる. ファイルには追記しない.
+
+        件数は足し, 見本は件数に比例して選ばれるようにmax_samples件に減らす.
+        以前の形式（エラーの文のリスト）も受け付ける.
+
+        Args:
+            summary (Dict[str, Any] | List[str]): summaryの辞書かエラーの文のリスト.
+        """
+        if isinstance(summary, list):
+            summary = {
+                "categories": {
+                    DEFAULT_CATEGORY: {
+                        "count": len(summary),
+                        "samples": [
+                            {"category": DEFAULT_CATEGORY, "message": message}
+                            for message in summary[-self.max_samples :]  # noqa: E203
+                        ],
+                    }
+                }
+            }
+        with self._lock:
+            for category, aggregate in summary.get("categories", {}).items():
+                count = self.counts.get(category, 0)
+                other = [ErrorRecord.from_dict(data) for data in aggregate["samples"]]
+                samples = self._samples.get(category, [])
+                # 件数の比で見本を重みづけして選ぶ.
+                weighted = [(count / max(len(samples), 1), r) for r in samples] + [
+                    (aggregate["count"] / max(len(other), 1), r) for r in other
+                ]
+                if len(weighted) > self.max_samples:
+                    weighted = sorted(
+                        weighted,
+                        key=lambda item: self._random.random() ** (1 / item[0]),
+                        reverse=True,
+                    )[: self.max_samples]
+                self._samples[category] = [record for _, record in weighted]
+                self.counts[category] = count + aggregate["count"]
+
+    def log_summary(self, examples: int = 3) -> None:
+        """種類ごとの件数と最新の見本をいくつかログに出力する.
+
+        Args:
+            examples (int, optional): 種類ごとに出力する見本の数.
+        """
+        summary = self.summary()
+        if not summary["total"]:
+            return
+        logger.info(
+            f"errors : {summary['total']} "
+            f"({len(summary['categories'])} categories, details in {self.path})"
+        )
+        for category, aggregate in sorted(
+            summary["categories"].items(), key=lambda item: -item[1]["count"]
+        ):
+            logger.info(f"  {category} : {aggregate['count']}")
+            for data in aggregate["samples"][-examples:]:
+                # トレースバックなど複数行のものは最後の行だけを出す.
+                lines = data["message"].strip().splitlines() or [""]
+                logger.info(f"    {lines[-1][:200]}")
+
+    def use_shard(self, shard: Shard) -> None:
+        """追記するファイルをシャードのパーティションにする."""
+        with self._lock:
+            self.path = shard.partition_path(self._base_path)
+
+
+error_storage = ErrorStorage(**error_storage_config)
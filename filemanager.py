@@ -1,8 +1,16 @@
 import os
 import csv
+import copy
 import json
-from settings import file_manager_config
-from typing import Any, List, Dict, Union
+import pickle
+import sqlite3
+import threading
+from time import time
+from settings import file_manager_config, STORAGE_BACKEND, SQLITE_PATH
+from html_pack import HtmlPack
+from shard import Shard
+from metrics import metrics
+from typing import Any, Iterator, List, Dict, Mapping, Optional, Tuple, Union
 
 StationData = Dict[str, List[Union[str, int]]]
 
@@ -18,7 +26,13 @@ class DataFilesIO:
         result_path (str): 結果出力パス
         priority_data_path (str): 優先データのjsonファイルのパス.
         address_data_path (str): 駅ごとの所在地が書いてあるcsvのパス.
+        address_cache_path (str): 所在地のcsvを解析した結果をpickleで保存するパス. 空なら保存しない.
         wiki_storage_dir (str): 自治体のhtmlを保存しておくディレクトリ.
+        wiki_pack (HtmlPack | None): 自治体のhtmlをまとめて保存するパック. あればディレクトリの代わりに使う.
+        station_links_path (str): 自治体ごとの駅リンクを保存するjsonのパス.
+        errors_path (str): 実行中に記録したエラーを保存するjsonのパス.
+        shard (Shard | None): 分担して収集しているときのシャード. 書き込むファイルはシャードごとのパーティションになる.
+        journal_compact_every (int): ジャーナルにこの件数たまったらローデータをまとめて保存する.
     """
 
     def __init__(
@@ -29,18 +43,63 @@ class DataFilesIO:
         priority_data_path,
         address_data_path,
         wiki_storage_dir,
+        station_links_path,
+        errors_path="errors.json",
+        journal_compact_every=100,
+        wiki_pack_path="",
+        address_cache_path="",
     ) -> None:
         self.raw_path = raw_path
         self.input_path = input_path
         self.result_path = result_path
         self.priority_data_path = priority_data_path
         self.address_data_path = address_data_path
+        self.address_cache_path = address_cache_path
         self.wiki_storage_dir = wiki_storage_dir
+        self.station_links_path = station_links_path
+        self.errors_path = errors_path
+        self.journal_compact_every = journal_compact_every
+        self.wiki_pack: Optional[HtmlPack] = (
+            HtmlPack(wiki_pack_path) if wiki_pack_path else None
+        )
+        self.shard: Optional[Shard] = None
+        self._journal_count = 0
+        self._journal_broken = False
+        self._address_rows: Optional[List[Tuple[str, str, str]]] = None
+
+    def use_shard(self, shard: Shard) -> None:
+        """シャードのパーティションに読み書きするようにする.
+
+        ローデータ・結果・駅リンク・エラーのファイルをシャードごとのものにする.
+        自治体名リスト, 優先データ, 所在地データ, 自治体ページのhtmlは共有する（htmlは自治体ごとなのでぶつからない）.
+
+        Args:
+            shard (Shard): シャード.
+        """
+        self.shard = shard
+        self.raw_path = shard.partition_path(self.raw_path)
+        self.result_path = shard.partition_path(self.result_path)
+        self.station_links_path = shard.partition_path(self.station_links_path)
+        self.errors_path = shard.partition_path(self.errors_path)
+        self._journal_count = 0
+        self._journal_broken = False
+
+    def for_shard(self, shard: Shard) -> "DataFilesIO":
+        """シャードのパーティションを読み書きする別のオブジェクトを返す. まとめるときに使う."""
+        io = copy.copy(self)
+        io.use_shard(shard)
+        return io
+
+    @property
+    def journal_path(self) -> str:
+        """ローデータの追記用ジャーナル（jsonl）のパス."""
+        return self.raw_path + ".journal.jsonl"
 
     def load_raw_data(self) -> Dict[str, StationData]:
         """保存してあったローデータを取得
 
-        ファイルで保存してあるraw_dataを読み込み辞書形式で取得して返す.
+        ファイルで保存してあるraw_dataを読み込み, さらにジャーナルに追記されたものを順に反映して辞書形式で返す.
+        途中で落ちて最後の行が壊れている場合はその行だけ無視する.
 
         Returns:
             Dict[str, StationData]: 駅データの辞書.
@@ -49,23 +108,114 @@ class DataFilesIO:
             # jsonファイルでなければ開かずエラーにする.
             raise Exception("tried to open a non-json file. (raw data)")
         if os.path.isfile(self.raw_path):
-            with open(self.raw_path) as f:
+            with open(self.raw_path, encoding="utf-8") as f:
                 data: Dict[str, StationData] = json.load(f)
         else:
             data: Dict[str, StationData] = {}
+        self._journal_count = 0
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    # 書き込み途中で落ちた行は改行で終わっていないので, 次の追記の前に改行を入れる.
+                    self._journal_broken = not line.endswith("\n")
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    data[entry["man_name"]] = entry["data"]
+                    self._journal_count += 1
         return data
 
+    @metrics.timed("save_raw_data")
     def save_raw_data(self, data: Dict[str, StationData]) -> None:
         """ローデータを保存
 
-        駅データをraw_dataのパスのファイルに保存する.
+        駅データをraw_dataのパスのファイルに保存する. 一時ファイルに書いてから置き換えるので,
+        書き込み中に落ちても元のファイルは壊れない. 保存したらジャーナルは不要になるので消す.
 
         Args:
             data (Dict[str, StationData]): 駅データの辞書.
         """
-        with open(self.raw_path, "w", encoding="utf-8") as f:
+        tmp_path = self.raw_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data, ensure_ascii=False))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.raw_path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_count = 0
+        self._journal_broken = False
+
+    @metrics.timed("append_raw_data")
+    def append_raw_data(
+        self, man_name: str, station_data: StationData, data: Dict[str, StationData]
+    ) -> None:
+        """ローデータに1自治体分を追記
+
+        ジャーナルに1行追記するだけなのでデータ量によらず一定の時間で済む.
+        追記がjournal_compact_every件たまったらsave_raw_dataでまとめて保存する.
+
+        Args:
+            man_name (str): 自治体名.
+            station_data (StationData): その自治体の駅データ.
+            data (Dict[str, StationData]): 全体の駅データの辞書. まとめて保存するときに使う.
+        """
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            if self._journal_broken:
+                f.write("\n")
+                self._journal_broken = False
+            f.write(
+                json.dumps(
+                    {"man_name": man_name, "data": station_data}, ensure_ascii=False
+                )
+                + "\n"
+            )
+        self._journal_count += 1
+        if self._journal_count >= self.journal_compact_every:
+            self.save_raw_data(data)
+
+    def save_station_links(self, data: Dict[str, Dict[str, str]]) -> None:
+        """駅リンクを保存
+
+        自治体名がキー, 駅リンクの辞書が値の辞書をstation_links_pathのファイルに保存する.
+
+        Args:
+            data (Dict[str, Dict[str, str]]): 自治体ごとの駅リンクの辞書.
+        """
+        with open(self.station_links_path, "w", encoding="utf-8") as f:
             f.write(json.dumps(data, ensure_ascii=False))
 
+    def load_station_links(self) -> Dict[str, Dict[str, str]]:
+        """保存済みの駅リンクを返す. ファイルがなければ空の辞書.
+
+        Returns:
+            Dict[str, Dict[str, str]]: 自治体ごとの駅リンクの辞書.
+        """
+        if not os.path.isfile(self.station_links_path):
+            return {}
+        with open(self.station_links_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_errors(self, errors: Dict[str, Any]) -> None:
+        """実行中に記録したエラーの集計をerrors_pathのファイルに保存する.
+
+        Args:
+            errors (Dict[str, Any]): ErrorStorage.summaryの辞書.
+        """
+        with open(self.errors_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(errors, ensure_ascii=False))
+
+    def load_errors(self) -> Union[Dict[str, Any], List[str]]:
+        """保存されたエラーの集計を返す. ファイルがなければ空の辞書.
+
+        以前の形式で保存されたものはエラーの文のリストのまま返す.
+        """
+        if not os.path.isfile(self.errors_path):
+            return {}
+        with open(self.errors_path, encoding="utf-8") as f:
+            return json.load(f)
+
     def load_manicipalities_data(self) -> List[str]:
         """自治体名リストを取得
 
@@ -119,25 +269,97 @@ class DataFilesIO:
         Returns:
             Dict[str, List[str]]: 住所リストが値で駅名がキーの辞書.
         """
-        with open(self.address_data_path, encoding="utf-8") as f:
-            reader = csv.reader(f)
-            res_dict: Dict[str, List[str]] = {}
-            for row in reader:
-                if row[2] in res_dict:
-                    res_dict[row[2]].append(row[8])
-                else:
-                    res_dict[row[2]] = [row[8]]
+        res_dict: Dict[str, List[str]] = {}
+        for sta_name, _, address in self.load_address_rows():
+            if sta_name in res_dict:
+                res_dict[sta_name].append(address)
+            else:
+                res_dict[sta_name] = [address]
         return res_dict
 
+    def load_address_rows(self) -> List[Tuple[str, str, str]]:
+        """所在地データの行を(駅名, 都道府県コード, 住所)の組のリストで返す.
+
+        csvはプロセスごとに一度だけ読み込み, 同じリストを返す（変更しないこと）.
+
+        Returns:
+            List[Tuple[str, str, str]]: ファイルに書かれた順の組のリスト.
+        """
+        if self._address_rows is None:
+            self._address_rows = self._read_address_rows()
+        return self._address_rows
+
+    def _read_address_rows(self) -> List[Tuple[str, str, str]]:
+        # csvのパス・更新時刻・大きさが前回と同じなら, 解析した結果をpickleから読む.
+        stat = os.stat(self.address_data_path)
+        key = (
+            os.path.abspath(self.address_data_path),
+            stat.st_mtime_ns,
+            stat.st_size,
+        )
+        if self.address_cache_path:
+            try:
+                with open(self.address_cache_path, "rb") as f:
+                    cached_key, rows = pickle.load(f)
+                if cached_key == key:
+                    return rows
+            except (OSError, EOFError, ValueError, TypeError, pickle.PickleError):
+                pass
+        with open(self.address_data_path, encoding="utf-8") as f:
+            rows = [(row[2], row[6], row[8]) for row in csv.reader(f)]
+        if self.address_cache_path:
+            tmp_path = f"{self.address_cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((key, rows), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.address_cache_path)
+        return rows
+
+    def add_station_membership(self, man_name: str, station_urls: List[str]) -> None:
+        """自治体に属すると判定された駅を記録する. ファイル保存では何もしない.
+
+        Args:
+            man_name (str): 自治体名.
+            station_urls (List[str]): 駅ページのURLのリスト.
+        """
+
+    def record_fetch(
+        self,
+        url: str,
+        status: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """ページを取得したことを記録する. ファイル保存では何もしない.
+
+        Args:
+            url (str): 取得したURL.
+            status (int): ステータスコード.
+            etag (str | None, optional): レスポンスのETag.
+            last_modified (str | None, optional): レスポンスのLast-Modified.
+        """
+
+    def record_error(self, message: str, man_name: Optional[str] = None) -> None:
+        """エラーを記録する. ファイル保存では何もしない.
+
+        Args:
+            message (str): エラーの内容.
+            man_name (str | None, optional): 自治体名.
+        """
+
+    @metrics.timed("save_local_html")
     def save_local_html(self, man_name: str, html: str) -> None:
         """htmlを保存
 
         htmlソースを受け取ってman_nameをファイル名として保存ディレクトリに保存する.
+        パックがあればパックに保存する.
 
         Args:
             man_name (str): 自治体名. ファイル名も兼ねる.
             html (str): 保存する内容.
         """
+        if self.wiki_pack is not None:
+            self.wiki_pack.put(man_name, html)
+            return
         FILE_PATH = self.wiki_storage_dir + man_name + ".html"
         with open(FILE_PATH, mode="w") as f:
             f.write(html)
@@ -154,6 +376,9 @@ class DataFilesIO:
             str | None: htmlソースを返す. 返せないときはNone.
 
         """
+        # パックがあればまずそこから探し, なければ移行前のファイルを見る.
+        if self.wiki_pack is not None and (html := self.wiki_pack.get(man_name)):
+            return html
         # 受け取ったパスのファイルが存在するならそれを返し, 存在しなければNoneを返す.
         FILE_PATH = self.wiki_storage_dir + man_name + ".html"
         if os.path.exists(FILE_PATH):
@@ -163,5 +388,341 @@ class DataFilesIO:
         else:
             return None
 
+    def delete_local_html(self, man_name: str) -> None:
+        """保存されたhtmlを消す. 存在しなければ何もしない.
+
+        Args:
+            man_name (str): 自治体名.
+        """
+        if self.wiki_pack is not None:
+            self.wiki_pack.delete(man_name)
+        FILE_PATH = self.wiki_storage_dir + man_name + ".html"
+        if os.path.exists(FILE_PATH):
+            os.remove(FILE_PATH)
+
+    def pack_local_html(self) -> Tuple[int, int, int]:
+        """保存ディレクトリのhtmlをパックに移す.
+
+        パックにまだない自治体のhtmlを全て追記してからパックを作り直す. 元のファイルは消さない.
+
+        Returns:
+            Tuple[int, int, int]: 移した件数, 元のファイルの合計バイト数, パックのバイト数.
+
+        Raises:
+            ValueError: パックのパス（WIKI_PACK_PATH）が設定されていない場合に発生.
+        """
+        if self.wiki_pack is None:
+            raise ValueError("WIKI_PACK_PATH is not set.")
+        packed_names = set(self.wiki_pack.names())
+        count = 0
+        total_bytes = 0
+        for file_name in sorted(os.listdir(self.wiki_storage_dir)):
+            man_name, ext = os.path.splitext(file_name)
+            if ext != ".html" or man_name in packed_names:
+                continue
+            FILE_PATH = self.wiki_storage_dir + file_name
+            with open(FILE_PATH) as f:
+                self.wiki_pack.put(man_name, f.read())
+            total_bytes += os.path.getsize(FILE_PATH)
+            count += 1
+        self.wiki_pack.compact()
+        return count, total_bytes, self.wiki_pack.data_size()
+
+
+class SQLiteAddressDict(Mapping):
+    """SQLiteの住所テーブルを辞書のように引くためのクラス
+
+    全件をメモリに持たず, 引かれた駅名の行だけを読み込む.
 
-file_manager = DataFilesIO(**file_manager_config)
+    Args:
+        io (SQLiteDataIO): 住所テーブルを持つデータ入出力.
+    """
+
+    def __init__(self, io: "SQLiteDataIO") -> None:
+        self._io = io
+
+    def __getitem__(self, sta_name: str) -> List[str]:
+        rows = self._io.query(
+            "SELECT address FROM addresses WHERE station_name = ? ORDER BY rowid",
+            (sta_name,),
+        )
+        if not rows:
+            raise KeyError(sta_name)
+        return [row[0] for row in rows]
+
+    def __iter__(self) -> Iterator[str]:
+        for row in self._io.query("SELECT DISTINCT station_name FROM addresses"):
+            yield row[0]
+
+    def __len__(self) -> int:
+        rows = self._io.query("SELECT COUNT(DISTINCT station_name) FROM addresses")
+        return rows[0][0]
+
+
+class SQLiteDataIO(DataFilesIO):
+    """データをSQLiteで入出力するためのクラス
+
+    DataFilesIOと同じインターフェースで, ローデータ・駅レコード・所在地データ・取得記録・エラーを
+    一つのSQLiteファイルに保存する. 必要な行だけを読み書きするので, 再開や部分的な再実行でも全体を読み込まない.
+    自治体名リスト, 優先データ, 結果のcsv, 自治体ページのhtmlはファイルのまま扱う.
+
+    Attributes:
+        sqlite_path (str): SQLiteファイルのパス.
+
+    Args:
+        sqlite_path (str): SQLiteファイルのパス.
+        その他はDataFilesIOと同じ.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS municipalities (
+        name TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS stations (
+        url TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        address_list TEXT NOT NULL,
+        opening_year INTEGER,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS stations_name ON stations (name);
+    CREATE TABLE IF NOT EXISTS station_municipality (
+        station_url TEXT NOT NULL,
+        man_name TEXT NOT NULL,
+        PRIMARY KEY (station_url, man_name)
+    );
+    CREATE INDEX IF NOT EXISTS station_municipality_man_name
+        ON station_municipality (man_name);
+    CREATE TABLE IF NOT EXISTS addresses (
+        station_name TEXT NOT NULL,
+        pref_cd TEXT,
+        address TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS addresses_station_name ON addresses (station_name);
+    CREATE TABLE IF NOT EXISTS fetches (
+        url TEXT PRIMARY KEY,
+        status INTEGER NOT NULL,
+        etag TEXT,
+        last_modified TEXT,
+        fetched_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS errors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        man_name TEXT,
+        message TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS errors_man_name ON errors (man_name);
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, sqlite_path: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.sqlite_path = sqlite_path
+        # 複数スレッドから使うので一つの接続をロックで守る.
+        self._db_lock = threading.Lock()
+        self._connect()
+
+    def _connect(self) -> None:
+        self._connection = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(self.SCHEMA)
+
+    def use_shard(self, shard: Shard) -> None:
+        """シャードのパーティションに読み書きするようにする. SQLiteファイルもシャードごとにする."""
+        super().use_shard(shard)
+        # 元のファイルへの接続は閉じてから繋ぎ直す.
+        with self._db_lock:
+            self._connection.close()
+            self.sqlite_path = shard.partition_path(self.sqlite_path)
+            self._connect()
+
+    def query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        """SELECT文を実行して全ての行を返す."""
+        with self._db_lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> None:
+        """更新系の文を実行してコミットする."""
+        with self._db_lock, self._connection:
+            self._connection.execute(sql, params)
+
+    def load_raw_data(self) -> Dict[str, StationData]:
+        """保存してあったローデータを取得
+
+        Returns:
+            Dict[str, StationData]: 駅データの辞書.
+        """
+        return {
+            name: json.loads(data)
+            for name, data in self.query("SELECT name, data FROM municipalities")
+        }
+
+    @metrics.timed("save_raw_data")
+    def save_raw_data(self, data: Dict[str, StationData]) -> None:
+        """ローデータを保存
+
+        全ての自治体の行を一つのトランザクションで書き込む.
+
+        Args:
+            data (Dict[str, StationData]): 駅データの辞書.
+        """
+        now = time()
+        with self._db_lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO municipalities (name, data, updated_at) "
+                "VALUES (?, ?, ?)",
+                [
+                    (name, json.dumps(station_data, ensure_ascii=False), now)
+                    for name, station_data in data.items()
+                ],
+            )
+
+    @metrics.timed("append_raw_data")
+    def append_raw_data(
+        self, man_name: str, station_data: StationData, data: Dict[str, StationData]
+    ) -> None:
+        """ローデータに1自治体分を書き込む. その自治体の行だけを更新する.
+
+        Args:
+            man_name (str): 自治体名.
+            station_data (StationData): その自治体の駅データ.
+            data (Dict[str, StationData]): 全体の駅データの辞書. SQLiteでは使わない.
+        """
+        self.execute(
+            "INSERT OR REPLACE INTO municipalities (name, data, updated_at) "
+            "VALUES (?, ?, ?)",
+            (man_name, json.dumps(station_data, ensure_ascii=False), time()),
+        )
+
+    def load_address_dict(self) -> Mapping[str, List[str]]:
+        """所在地データを返す.
+
+        所在地のcsvが更新されていれば住所テーブルに取り込み直し, テーブルを引く辞書のようなオブジェクトを返す.
+
+        Returns:
+            Mapping[str, List[str]]: 住所リストが値で駅名がキーの辞書のようなオブジェクト.
+        """
+        self._import_address_data()
+        return SQLiteAddressDict(self)
+
+    def load_address_rows(self) -> List[Tuple[str, str, str]]:
+        """所在地データの行を(駅名, 都道府県コード, 住所)の組のリストで返す.
+
+        Returns:
+            List[Tuple[str, str, str]]: ファイルに書かれた順の組のリスト.
+        """
+        self._import_address_data()
+        return [
+            tuple(row)
+            for row in self.query(
+                "SELECT station_name, pref_cd, address FROM addresses ORDER BY rowid"
+            )
+        ]
+
+    def _import_address_data(self) -> None:
+        # 所在地のcsvが前回取り込んだときから更新されていれば取り込み直す.
+        mtime = str(os.path.getmtime(self.address_data_path))
+        rows = self.query("SELECT value FROM meta WHERE key = 'address_data_mtime'")
+        if not rows or rows[0][0] != mtime:
+            values = self._read_address_rows()
+            with self._db_lock, self._connection:
+                self._connection.execute("DELETE FROM addresses")
+                self._connection.executemany(
+                    "INSERT INTO addresses (station_name, pref_cd, address) "
+                    "VALUES (?, ?, ?)",
+                    values,
+                )
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) "
+                    "VALUES ('address_data_mtime', ?)",
+                    (mtime,),
+                )
+
+    def load_station_record(self, url: str) -> Union[Dict[str, Any], None]:
+        """駅レコードを辞書で返す. なければNone.
+
+        Args:
+            url (str): 正規化された駅ページのURL.
+        """
+        rows = self.query(
+            "SELECT name, url, address_list, opening_year FROM stations WHERE url = ?",
+            (url,),
+        )
+        if not rows:
+            return None
+        name, url, address_list, opening_year = rows[0]
+        return {
+            "name": name,
+            "url": url,
+            "address_list": json.loads(address_list),
+            "opening_year": opening_year,
+        }
+
+    def save_station_record(self, record: Dict[str, Any]) -> None:
+        """駅レコードを保存する.
+
+        Args:
+            record (Dict[str, Any]): StationRecord.to_dictの辞書.
+        """
+        self.execute(
+            "INSERT OR REPLACE INTO stations "
+            "(url, name, address_list, opening_year, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                record["url"],
+                record["name"],
+                json.dumps(record["address_list"], ensure_ascii=False),
+                record["opening_year"],
+                time(),
+            ),
+        )
+
+    def delete_station_record(self, url: str) -> None:
+        """駅レコードを消す.
+
+        Args:
+            url (str): 正規化された駅ページのURL.
+        """
+        self.execute("DELETE FROM stations WHERE url = ?", (url,))
+
+    def count_station_records(self) -> int:
+        return self.query("SELECT COUNT(*) FROM stations")[0][0]
+
+    def add_station_membership(self, man_name: str, station_urls: List[str]) -> None:
+        with self._db_lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO station_municipality (station_url, man_name) "
+                "VALUES (?, ?)",
+                [(url, man_name) for url in station_urls],
+            )
+
+    def record_fetch(
+        self,
+        url: str,
+        status: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        self.execute(
+            "INSERT OR REPLACE INTO fetches "
+            "(url, status, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (url, status, etag, last_modified, time()),
+        )
+
+    def record_error(self, message: str, man_name: Optional[str] = None) -> None:
+        self.execute(
+            "INSERT INTO errors (man_name, message, created_at) VALUES (?, ?, ?)",
+            (man_name, message, time()),
+        )
+
+
+if STORAGE_BACKEND == "sqlite":
+    file_manager: DataFilesIO = SQLiteDataIO(SQLITE_PATH, **file_manager_config)
+else:
+    file_manager = DataFilesIO(**file_manager_config)
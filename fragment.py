@@ -0,0 +1,189 @@
+"""鉄道の節の断片
+
+自治体ページから抽出プランで取り出した結果（鉄道の見出しの下のブロックのhtml, 駅リンク, 廃線の警告）を
+自治体ごとに保存しておく. 次回からは自治体ページを読み込んで解析し直さずに駅リンクが分かる.
+断片には抽出プランの版を記録し, 版が変わったもの（抽出方法やリストを変えたとき）は無いものとして扱う.
+
+"""
+
+import os
+import json
+import threading
+from typing import Any, Dict, Final, Optional, Union
+from shard import Shard, partition_paths
+from settings import railway_fragment_config
+
+
+class RailwayFragment:
+    """自治体ページの鉄道の節の断片
+
+    Attributes:
+        man_name (str): 自治体名.
+        version (str): 取り出した抽出プランの版.
+        links (Dict[str, str]): 駅名がキー, リンクが値の辞書.
+        warning (str): 廃線の警告文. なければ空文字列.
+        html (str): 鉄道の見出しの下のブロックをつなげたhtml.
+    """
+
+    __slots__ = ("man_name", "version", "links", "warning", "html")
+
+    def __init__(
+        self,
+        man_name: str,
+        version: str,
+        links: Dict[str, str],
+        warning: str,
+        html: str,
+    ) -> None:
+        self.man_name = man_name
+        self.version = version
+        self.links = links
+        self.warning = warning
+        self.html = html
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "man_name": self.man_name,
+            "version": self.version,
+            "links": self.links,
+            "warning": self.warning,
+            "html": self.html,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RailwayFragment":
+        return cls(
+            data["man_name"],
+            data["version"],
+            data["links"],
+            data["warning"],
+            data["html"],
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"RailwayFragment({self.man_name!r}, {self.version!r}, "
+            f"{len(self.links)} links, warning={self.warning!r})"
+        )
+
+
+class RailwayFragmentStore:
+    """鉄道の節の断片の保存
+
+    自治体名をキーに断片をメモリ上に持ち, 追加したものはjsonl形式でファイルに追記していく.
+    シャードのパーティションのファイルもあれば読み込む.
+    同じ内容の断片は追記せず, 上書きや消した行が増えたファイルは読み込んだときに作り直す.
+
+    Attributes:
+        path (str): 保存するjsonlファイルのパス. シャードを使うときはそのパーティション.
+
+    Args:
+        path (str): 保存するjsonlファイルのパス.
+    """
+
+    # 追記するファイルの行数が断片の数のこの倍を超えていたら, 読み込んだときに作り直す.
+    COMPACT_RATIO: Final[float] = 2.0
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._base_path = path
+        self._fragments: Union[Dict[str, RailwayFragment], None] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, RailwayFragment]:
+        # 初回アクセス時にファイルを読み込む. 後から書かれた行で上書きする.
+        if self._fragments is None:
+            fragments: Dict[str, RailwayFragment] = {}
+            # 作り直すときは追記するファイルに書かれた分だけを書き戻す.
+            own: Dict[str, RailwayFragment] = {}
+            lines = 0
+            for path in [self._base_path] + partition_paths(self._base_path):
+                if not os.path.isfile(path):
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        is_own = path == self.path
+                        lines += int(is_own)
+                        try:
+                            data = json.loads(line)
+                            if data.get("deleted"):
+                                fragments.pop(data["man_name"], None)
+                                own.pop(data["man_name"], None)
+                                continue
+                            fragment = RailwayFragment.from_dict(data)
+                        except (ValueError, KeyError, AttributeError):
+                            # 書き込み途中で落ちた行などは無視する.
+                            continue
+                        fragments[fragment.man_name] = fragment
+                        if is_own:
+                            own[fragment.man_name] = fragment
+            self._fragments = fragments
+            # シャードのパーティションに書くときは, 前のファイルで書いた分を消した印が要るので作り直さない.
+            stale = lines > len(own) * self.COMPACT_RATIO
+            if stale and self.path == self._base_path:
+                self._compact(own)
+        return self._fragments
+
+    def _compact(self, fragments: Dict[str, RailwayFragment]) -> None:
+        # このファイルに書かれた今の断片だけで作り直す. 消した印の行はもういらない.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for fragment in fragments.values():
+                f.write(json.dumps(fragment.to_dict(), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def get(self, man_name: str, version: str) -> Optional[RailwayFragment]:
+        """自治体の断片を返す. ないか, 版が違えばNone.
+
+        Args:
+            man_name (str): 自治体名.
+            version (str): 今の抽出プランの版.
+
+        Returns:
+            RailwayFragment | None: 断片.
+        """
+        with self._lock:
+            fragment = self._load().get(man_name)
+        if fragment is None or fragment.version != version:
+            return None
+        return fragment
+
+    def put(self, fragment: RailwayFragment) -> None:
+        """断片を追加してファイルに追記する. 同じ内容の断片があれば何もしない.
+
+        Args:
+            fragment (RailwayFragment): 追加する断片.
+        """
+        with self._lock:
+            fragments = self._load()
+            old = fragments.get(fragment.man_name)
+            if old is not None and old.to_dict() == fragment.to_dict():
+                return
+            fragments[fragment.man_name] = fragment
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(fragment.to_dict(), ensure_ascii=False) + "\n")
+
+    def delete(self, man_name: str) -> None:
+        """断片を消す. ファイルには消した印の行を追記する.
+
+        Args:
+            man_name (str): 自治体名.
+        """
+        with self._lock:
+            if self._load().pop(man_name, None) is None:
+                return
+            mark = {"man_name": man_name, "deleted": True}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(mark, ensure_ascii=False) + "\n")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def use_shard(self, shard: Shard) -> None:
+        """追記するファイルをシャードのパーティションにする. 読み込みは全てのパーティションから行う."""
+        with self._lock:
+            self.path = shard.partition_path(self._base_path)
+
+
+railway_fragment_store = RailwayFragmentStore(**railway_fragment_config)
@@ -0,0 +1,223 @@
+"""駅の地名辞典
+
+所在地データ（station20210312free.csv）の駅を, 住所からMANDARA10の自治体に割り当てた索引.
+自治体名の一覧から作った文字単位のトライ木を住所に沿ってたどるだけで, 住所がどの自治体のものかが分かる.
+同名の駅は都道府県で区別するので, 駅ページを取得しなくても自治体に属するかどうかを判定できる.
+
+"""
+
+import re
+from typing import Dict, Final, Iterable, Iterator, List, Optional, Set, Tuple
+from resolver import split_man_name
+
+# 住所の先頭の都道府県名.
+PREFECTURE_PATTERN: Final = re.compile(r"^(東京都|北海道|京都府|大阪府|.{2,3}?県)")
+# 都道府県名に続く郡名. 自治体名には郡名が含まれないので飛ばしてもたどれるようにする.
+# 高市郡や西村山郡のように郡名に"市"や"村"を含むものもある.
+DISTRICT_PATTERN: Final = re.compile(r"^.+?郡")
+STATION_SUFFIXES: Final = ("停留場", "駅")
+
+
+def normalize_address(text: str) -> str:
+    """住所の表記を揃える. 空白を除き, "ケ"を小文字にする."""
+    return "".join(text.split()).replace("ケ", "ヶ")
+
+
+def station_key(sta_name: str) -> str:
+    """駅名を索引のキーにする. 末尾の"駅"または"停留場"を除き（所在地データの駅名はこの形）, "ケ"を小文字にする."""
+    for suffix in STATION_SUFFIXES:
+        if sta_name.endswith(suffix) and len(sta_name) > len(suffix):
+            sta_name = sta_name[: -len(suffix)]
+            break
+    return sta_name.replace("ケ", "ヶ")
+
+
+def split_prefecture(address: str) -> Tuple[Optional[str], str]:
+    """住所を(都道府県名, 残り)に分ける. 都道府県名がなければNone."""
+    if match := PREFECTURE_PATTERN.match(address):
+        return match.group(1), address[match.end() :]  # noqa: E203
+    return None, address
+
+
+class GazetteerEntry:
+    """所在地データの駅
+
+    Attributes:
+        name (str): 所在地データの駅名（"駅"などはつかない）.
+        prefecture (str | None): 住所の都道府県名.
+        address (str): 住所.
+    """
+
+    __slots__ = ("name", "prefecture", "address")
+
+    def __init__(self, name: str, prefecture: Optional[str], address: str) -> None:
+        self.name = name
+        self.prefecture = prefecture
+        self.address = address
+
+    def __repr__(self) -> str:
+        return f"GazetteerEntry({self.name!r}, {self.prefecture!r}, {self.address!r})"
+
+
+class _TrieNode:
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.values: List[Tuple[Optional[str], str]] = []
+
+
+class MunicipalityTrie:
+    """自治体名のトライ木
+
+    キーは都道府県名を除いた自治体名（政令市の区は「札幌市中央区」のように市名から）,
+    値は(都道府県名（政令市の区ならNone）, 自治体名).
+    """
+
+    def __init__(self) -> None:
+        self._root = _TrieNode()
+
+    @staticmethod
+    def municipality_key(man_name: str) -> Optional[Tuple[Optional[str], str]]:
+        """自治体名を(都道府県名またはNone, 住所の都道府県名より後ろと照らし合わせる文字列)にする."""
+        if not (names := split_man_name(man_name)):
+            return None
+        upper_name, local_name = names
+        if upper_name.endswith(("都", "道", "府", "県")):
+            return upper_name, normalize_address(local_name)
+        # 政令市の区は市名から照らし合わせる. 都道府県は問わない.
+        return None, normalize_address(upper_name + local_name)
+
+    def insert(self, man_name: str) -> None:
+        if not (key := self.municipality_key(man_name)):
+            return
+        prefecture, text = key
+        node = self._root
+        for char in text:
+            node = node.children.setdefault(char, _TrieNode())
+        node.values.append((prefecture, man_name))
+
+    def _walk(self, text: str) -> Iterator[Tuple[Optional[str], str]]:
+        # textの先頭から一文字ずつたどり, 途中で見つかった自治体をすべて返す.
+        node = self._root
+        for char in text:
+            if (node := node.children.get(char)) is None:
+                return
+            yield from node.values
+
+    def locate(self, address: str) -> Set[str]:
+        """住所が属する自治体名の集合を返す. 住所の長さに比例する時間で済む.
+
+        Args:
+            address (str): 住所.
+
+        Returns:
+            Set[str]: 自治体名の集合. 見つからなければ空.
+        """
+        prefecture, rest = split_prefecture(normalize_address(address))
+        texts = [rest]
+        if match := DISTRICT_PATTERN.match(rest):
+            texts.append(rest[match.end() :])  # noqa: E203
+        result: Set[str] = set()
+        for text in texts:
+            for man_prefecture, man_name in self._walk(text):
+                if man_prefecture is None or prefecture in (None, man_prefecture):
+                    result.add(man_name)
+        return result
+
+
+class Gazetteer:
+    """所在地データの駅を自治体に割り当てた索引
+
+    Attributes:
+        trie (MunicipalityTrie): 自治体名のトライ木.
+
+    Args:
+        rows (Iterable[Tuple[str, str, str]]): 所在地データの(駅名, 都道府県コード, 住所)の組.
+        man_list (List[str]): 自治体名リスト.
+    """
+
+    def __init__(
+        self, rows: Iterable[Tuple[str, str, str]], man_list: List[str]
+    ) -> None:
+        self.trie = MunicipalityTrie()
+        for man_name in man_list:
+            self.trie.insert(man_name)
+        # 駅名 → 所在地データの各行が属する自治体名の集合のリスト
+        self._located: Dict[str, List[Set[str]]] = {}
+        # 自治体名 → 駅名のキー → 所在地データの駅
+        self._stations: Dict[str, Dict[str, GazetteerEntry]] = {}
+        for sta_name, _, address in rows:
+            man_names = self.trie.locate(address)
+            key = station_key(sta_name)
+            self._located.setdefault(key, []).append(man_names)
+            if not man_names:
+                continue
+            entry = GazetteerEntry(
+                sta_name, split_prefecture(normalize_address(address))[0], address
+            )
+            for man_name in man_names:
+                self._stations.setdefault(man_name, {}).setdefault(key, entry)
+
+    def __contains__(self, sta_name: str) -> bool:
+        return station_key(sta_name) in self._located
+
+    def stations(self, man_name: str) -> Dict[str, GazetteerEntry]:
+        """所在地データで自治体に属する駅を返す.
+
+        Args:
+            man_name (str): 自治体名.
+
+        Returns:
+            Dict[str, GazetteerEntry]: 駅名のキー（station_keyの形）がキー, 所在地データの駅が値の辞書.
+        """
+        return self._stations.get(man_name, {})
+
+    def is_member(
+        self,
+        man_name: str,
+        sta_name: str,
+        address_list: Optional[List[str]] = None,
+    ) -> bool:
+        """所在地データで駅が自治体に属しているかを返す.
+
+        駅名だけでは別の県の同名駅のページを見ていることがあるので, ページの所在地を渡すと
+        所在地データの駅と都道府県が同じかも確かめる.
+
+        Args:
+            man_name (str): 自治体名.
+            sta_name (str): 駅名. 末尾の"駅"や"停留場"はあってもなくてもよい.
+            address_list (List[str] | None, optional): 駅ページの所在地のリスト.
+
+        Returns:
+            bool: 同名の駅のどれかが自治体にあればTrue. 所在地を渡したときは,
+                そのどれかの都道府県が所在地データの駅と同じ場合だけTrue.
+        """
+        entry = self._stations.get(man_name, {}).get(station_key(sta_name))
+        if entry is None:
+            return False
+        if address_list is None:
+            return True
+        return entry.prefecture is not None and any(
+            split_prefecture(normalize_address(address))[0] == entry.prefecture
+            for address in address_list
+        )
+
+    def excludes(self, man_name: str, sta_name: str) -> bool:
+        """所在地データだけで駅が自治体に属さないと言い切れるかを返す.
+
+        同名の駅がすべて何れかの自治体に割り当てられていて, そのどれもが対象の自治体でない場合にTrue.
+        所在地データにない駅や, 住所がどの自治体にも当てはまらない行がある駅はFalse（ページで確かめる）.
+        所在地データの住所は一つだけなので, 自治体の境にあり駅ページでは両方の自治体が所在地になっている駅も
+        Trueになることがある.
+
+        Args:
+            man_name (str): 自治体名.
+            sta_name (str): 駅名.
+
+        Returns:
+            bool: 属さないと言い切れるならTrue.
+        """
+        if not (located := self._located.get(station_key(sta_name))):
+            return False
+        return all(man_names and man_name not in man_names for man_names in located)
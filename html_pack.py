@@ -0,0 +1,179 @@
+"""自治体ページのパック
+
+自治体ページのhtmlを一件ずつのファイルにする代わりに, zlibで圧縮して一つのデータファイルに追記し,
+自治体名 → (位置, 長さ)の索引を索引ファイル（jsonl）に追記する.
+読み込みはデータファイルをmmapして索引の位置から展開するだけなので, 何千ものファイルを開かずに済む.
+同じパックに複数のプロセス（シャード）から追記してもぶつからないように, 追記の間はファイルをロックする.
+
+"""
+
+import os
+import json
+import mmap
+import zlib
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windowsではプロセス間のロックをしない.
+    fcntl = None
+
+
+class HtmlPack:
+    """自治体ページのパック
+
+    Attributes:
+        path (str): データファイルのパス.
+        index_path (str): 索引ファイルのパス（データファイルのパス + ".idx"）.
+
+    Args:
+        path (str): データファイルのパス.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.index_path = path + ".idx"
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._index_position = 0
+        self._view: Optional[mmap.mmap] = None
+        self._view_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _read_index(self) -> None:
+        # 索引ファイルの前回読んだところから後を読む. 後から書かれた行で上書きする.
+        if not os.path.isfile(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_position)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 書き込み途中の行は次に読む.
+                    break
+                self._index_position += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("deleted"):
+                    self._index.pop(entry["name"], None)
+                else:
+                    self._index[entry["name"]] = (entry["offset"], entry["length"])
+
+    def _map(self, end: int) -> Optional[mmap.mmap]:
+        # データファイルのmmapを返す. 別のプロセスになったか, endまで届いていなければ作り直す.
+        if self._view is None or self._view_pid != os.getpid() or len(self._view) < end:
+            if self._view is not None and self._view_pid == os.getpid():
+                self._view.close()
+            self._view = None
+            if not os.path.isfile(self.path) or os.path.getsize(self.path) < end:
+                return None
+            with open(self.path, "rb") as f:
+                self._view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view_pid = os.getpid()
+        return self._view
+
+    def get(self, name: str) -> Optional[str]:
+        """htmlを返す. なければNone.
+
+        Args:
+            name (str): 自治体名.
+
+        Returns:
+            str | None: htmlソース.
+        """
+        with self._lock:
+            if name not in self._index:
+                # 別のプロセスが追記したかもしれないので索引を読み直す.
+                self._read_index()
+            if (location := self._index.get(name)) is None:
+                return None
+            offset, length = location
+            if (view := self._map(offset + length)) is None:
+                return None
+            data = view[offset : offset + length]  # noqa: E203
+        return zlib.decompress(data).decode("utf-8")
+
+    def put(self, name: str, html: str) -> None:
+        """htmlを圧縮して追記する. 同じ名前があれば索引を新しいものに置き換える.
+
+        Args:
+            name (str): 自治体名.
+            html (str): htmlソース.
+        """
+        data = zlib.compress(html.encode("utf-8"), 9)
+        with self._lock, open(self.path, "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+                # データを書き終えてから索引を追記するので, 途中で落ちても壊れた項目は読まれない.
+                entry = {"name": name, "offset": offset, "length": len(data)}
+                self._append_index(entry)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+            self._read_index()
+
+    def delete(self, name: str) -> None:
+        """索引から消す. データは次にcompactするまで残る.
+
+        Args:
+            name (str): 自治体名.
+        """
+        with self._lock:
+            self._read_index()
+            if name not in self._index:
+                return
+            self._append_index({"name": name, "deleted": True})
+            self._read_index()
+
+    def _append_index(self, entry: Dict) -> None:
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def names(self) -> List[str]:
+        """パックにある自治体名のリストを返す."""
+        with self._lock:
+            self._read_index()
+            return list(self._index)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            self._read_index()
+            return name in self._index
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """(自治体名, htmlソース)を順に返す."""
+        for name in self.names():
+            if (html := self.get(name)) is not None:
+                yield name, html
+
+    def data_size(self) -> int:
+        """データファイルの大きさ（バイト）. 置き換えや削除で使われなくなった分も含む."""
+        return os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+
+    def compact(self) -> None:
+        """使われている項目だけでデータファイルと索引を作り直す. 他のプロセスが使っていないときに呼ぶ."""
+        entries = list(self.items())
+        with self._lock:
+            if self._view is not None and self._view_pid == os.getpid():
+                self._view.close()
+            self._view = None
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            tmp_index_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f, open(
+                tmp_index_path, "w", encoding="utf-8"
+            ) as index_file:
+                for name, html in entries:
+                    data = zlib.compress(html.encode("utf-8"), 9)
+                    entry = {"name": name, "offset": f.tell(), "length": len(data)}
+                    f.write(data)
+                    index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            os.replace(tmp_index_path, self.index_path)
+            self._index = {}
+            self._index_position = 0
+            self._read_index()
@@ -0,0 +1,348 @@
+"""高速な表見出し抽出
+
+駅ページから「thタグのテキスト」と「その次の兄弟要素のテキスト」の組だけを取り出す.
+BeautifulSoupで木を作ってからsoupsieveで全thを検索する代わりに, html.parserのトークナイザ
+（またはlxml）を直接使い, 木を作らずに一度走査するだけで済ませる.
+
+トークナイザの結果はBeautifulSoup(html, "html.parser")に対する
+`soup.select("th:-soup-contains(...)")` と `th.find_next_sibling().get_text()`
+と同じになるようにしている（壊れたhtmlも含む）. lxmlは木の作り方が違うので,
+壊れたhtml（閉じタグの省略など）では結果が変わることがある.
+
+"""
+
+import codecs
+import importlib.util
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple, Union
+
+# lxmlはなくても動くようにする. 読み込みに時間がかかるので, 使うときに読み込む.
+HAS_LXML = importlib.util.find_spec("lxml") is not None
+
+# (thのテキスト, 次の兄弟要素のテキスト（なければNone）)
+HeaderRow = Tuple[str, Optional[str]]
+
+# 終了タグを持たない要素. html.parserのBeautifulSoupと同じく子を持たないものとして扱う.
+VOID_ELEMENTS = frozenset(
+    [
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+        "basefont",
+        "bgsound",
+        "command",
+        "frame",
+        "image",
+        "isindex",
+        "nextid",
+        "spacer",
+    ]
+)
+# get_textでは含まれないテキストを持つ要素.
+# （soupsieveの:-soup-containsでは含まれるので, thのテキストには含める.）
+NON_TEXT_ELEMENTS = frozenset(["script", "style", "template"])
+# 空白だけのテキストを詰めない要素.
+PRESERVE_WHITESPACE_ELEMENTS = frozenset(["pre", "textarea"])
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+_ASCII_SPACES_TABLE = str.maketrans("", "", ASCII_SPACES)
+
+
+def collapse_whitespace(text: str) -> str:
+    """BeautifulSoupと同じく, ASCII空白だけのテキストを改行一つまたは空白一つに詰める."""
+    if text and not text.translate(_ASCII_SPACES_TABLE):
+        return "\n" if "\n" in text else " "
+    return text
+
+
+class _Capture:
+    # テキストを集めている要素. depthはその要素自身の深さ.
+    # non_text_depthはその要素の中でのscript等の深さで, これより深いscript等のテキストは含めない.
+    __slots__ = ("depth", "texts", "row_index", "is_header", "non_text_depth")
+
+    def __init__(self, depth: int, row_index: int, is_header: bool) -> None:
+        self.depth = depth
+        self.texts: List[str] = []
+        self.row_index = row_index
+        self.is_header = is_header
+        self.non_text_depth = 0
+
+
+class HeaderRowParser(HTMLParser):
+    """thとその次の兄弟要素のテキストを集めるパーサ
+
+    feedで少しずつ渡すこともできる. stop_after_leadをTrueにすると,
+    infoboxを見たあとに最初のh2（導入部の終わり）が来た時点でdoneをTrueにしてそれ以降を無視する.
+
+    Attributes:
+        rows (List[HeaderRow]): 集めた組のリスト. 文書中の順番.
+        done (bool): 走査を打ち切ったかどうか.
+
+    Args:
+        stop_after_lead (bool, optional): 導入部のinfoboxを読み終えたら打ち切るかどうか.
+    """
+
+    def __init__(self, stop_after_lead: bool = False) -> None:
+        super().__init__(convert_charrefs=True)
+        self.rows: List[List[Optional[str]]] = []
+        self.done = False
+        self.stop_after_lead = stop_after_lead
+        self._seen_infobox = False
+        self._stack: List[str] = []
+        self._captures: List[_Capture] = []
+        # 次の兄弟要素を待っているthの (親の深さ, 行番号) のリスト
+        self._waiting: List[Tuple[int, int]] = []
+        self._non_text_depth = 0
+        self._preserve_depth = 0
+        self._pending: List[str] = []
+
+    @property
+    def header_rows(self) -> List[HeaderRow]:
+        return [(row[0] or "", row[1]) for row in self.rows]
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if self.done:
+            return
+        self._flush()
+        if tag == "table" and not self._seen_infobox:
+            for name, value in attrs:
+                if name == "class" and value and "infobox" in value.split():
+                    self._seen_infobox = True
+        if tag == "h2" and self.stop_after_lead and self._seen_infobox:
+            self.done = True
+            return
+        depth = len(self._stack)
+        # この要素が兄弟要素を待っているthの次の要素ならテキストを集め始める.
+        started: List[_Capture] = []
+        if self._waiting:
+            still_waiting = []
+            for parent_depth, row_index in self._waiting:
+                if parent_depth == depth - 1:
+                    started.append(_Capture(depth, row_index, False))
+                else:
+                    still_waiting.append((parent_depth, row_index))
+            self._waiting = still_waiting
+        if tag in VOID_ELEMENTS:
+            # 子を持たないので, 次の兄弟要素がこれならテキストは空で確定する.
+            for capture in started:
+                self.rows[capture.row_index][1] = ""
+            return
+        self._stack.append(tag)
+        if tag == "th":
+            self.rows.append([None, None])
+            started.append(_Capture(depth, len(self.rows) - 1, True))
+        if tag in NON_TEXT_ELEMENTS:
+            self._non_text_depth += 1
+        if tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self._preserve_depth += 1
+        # 兄弟要素自身がscript等なら, get_textと同じくその中のテキストは含める.
+        for capture in started:
+            capture.non_text_depth = self._non_text_depth
+        self._captures.extend(started)
+
+    def handle_startendtag(self, tag, attrs) -> None:
+        # <br/>などは子を持たない要素として扱う.
+        if self.done:
+            return
+        if tag in VOID_ELEMENTS:
+            self.handle_starttag(tag, attrs)
+        else:
+            self.handle_starttag(tag, attrs)
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag) -> None:
+        if self.done:
+            return
+        # BeautifulSoupと同じく, 開いていないタグの終了タグでもテキストはそこで区切る.
+        self._flush()
+        if tag not in self._stack:
+            # 開いていないタグの終了タグは無視する.
+            return
+        while self._stack:
+            name = self._stack.pop()
+            depth = len(self._stack)
+            if name in NON_TEXT_ELEMENTS:
+                self._non_text_depth -= 1
+            if name in PRESERVE_WHITESPACE_ELEMENTS:
+                self._preserve_depth -= 1
+            # 閉じた要素のテキスト収集を終える.
+            remaining = []
+            for capture in self._captures:
+                if capture.depth == depth:
+                    text = "".join(capture.texts)
+                    if capture.is_header:
+                        self.rows[capture.row_index][0] = text
+                        # thの次の兄弟要素を待つ.
+                        self._waiting.append((depth - 1, capture.row_index))
+                    else:
+                        self.rows[capture.row_index][1] = text
+                else:
+                    remaining.append(capture)
+            self._captures = remaining
+            # 親が閉じたら兄弟要素はもう来ない.
+            self._waiting = [w for w in self._waiting if w[0] < depth]
+            if name == tag:
+                break
+
+    def handle_data(self, data) -> None:
+        if not self.done:
+            # 連続するテキストはタグやコメントが来るまでまとめておく.
+            self._pending.append(data)
+
+    def handle_comment(self, data) -> None:
+        self._flush()
+
+    def handle_decl(self, decl) -> None:
+        self._flush()
+
+    def handle_pi(self, data) -> None:
+        self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending = []
+        if not self._preserve_depth:
+            text = collapse_whitespace(text)
+        for capture in self._captures:
+            # thのテキストはsoupsieveと同じくscript等も含め, 兄弟要素はget_textと同じく含めない.
+            if capture.is_header or self._non_text_depth <= capture.non_text_depth:
+                capture.texts.append(text)
+
+    def close(self) -> None:
+        if not self.done:
+            super().close()
+            self._flush()
+        # 閉じられなかった要素のテキストも確定させる.
+        for capture in self._captures:
+            text = "".join(capture.texts)
+            self.rows[capture.row_index][0 if capture.is_header else 1] = text
+        self._captures = []
+
+
+class StreamingHeaderRows:
+    """少しずつ届くhtmlから導入部のthとその次の兄弟要素のテキストを集める
+
+    バイト列をutf-8として少しずつデコードしながらHeaderRowParser(stop_after_lead=True)に渡す.
+    feedがTrueを返したら導入部（infobox）を読み終えているので, それ以降は読まなくてよい.
+
+    Attributes:
+        parser (HeaderRowParser): 中で使うパーサ.
+        bytes_read (int): feedで受け取った合計バイト数.
+    """
+
+    def __init__(self) -> None:
+        self.parser = HeaderRowParser(stop_after_lead=True)
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, chunk: bytes) -> bool:
+        """htmlの続きを渡す. 読み終えてよければTrueを返す."""
+        self.bytes_read += len(chunk)
+        if not self.parser.done:
+            self.parser.feed(self._decoder.decode(chunk))
+        return self.parser.done
+
+    def close(self) -> List[HeaderRow]:
+        """集めた(thのテキスト, 次の兄弟要素のテキストまたはNone)のリストを返す."""
+        if not self.parser.done:
+            self.parser.feed(self._decoder.decode(b"", final=True))
+        self.parser.close()
+        return self.parser.header_rows
+
+
+def _extract_with_tokenizer(html: str) -> List[HeaderRow]:
+    parser = HeaderRowParser()
+    parser.feed(html)
+    parser.close()
+    return parser.header_rows
+
+
+def _lxml_text(elem, include_non_text: bool) -> str:
+    texts: List[str] = []
+
+    def add(text: str, preserve: bool) -> None:
+        if text:
+            texts.append(text if preserve else collapse_whitespace(text))
+
+    def walk(node, preserve: bool = False) -> None:
+        # コメントなどの中身と, 必要ならscript等の中身は含めない.
+        if not isinstance(node.tag, str):
+            return
+        if not include_non_text and node.tag in NON_TEXT_ELEMENTS:
+            return
+        preserve = preserve or node.tag in PRESERVE_WHITESPACE_ELEMENTS
+        add(node.text, preserve)
+        for child in node:
+            walk(child, preserve)
+            add(child.tail, preserve)
+
+    walk(elem)
+    return "".join(texts)
+
+
+def _extract_with_lxml(html: str) -> List[HeaderRow]:
+    from lxml import etree
+    from lxml import html as lxml_html
+
+    try:
+        doc = lxml_html.fromstring(html)
+    except etree.ParserError:
+        # 空白だけの文書などはBeautifulSoupと同じく何も見つからなかったものとする.
+        return []
+    rows: List[HeaderRow] = []
+    for th in doc.iter("th"):
+        sibling = th.getnext()
+        # コメントなどの要素でないものは飛ばす.
+        while sibling is not None and not isinstance(sibling.tag, str):
+            sibling = sibling.getnext()
+        rows.append(
+            (
+                _lxml_text(th, True),
+                None if sibling is None else _lxml_text(sibling, False),
+            )
+        )
+    return rows
+
+
+def available_engines() -> List[str]:
+    """使える抽出エンジンの名前のリストを返す."""
+    return ["tokenizer", "lxml"] if HAS_LXML else ["tokenizer"]
+
+
+def extract_header_rows(
+    html: Union[str, bytes], engine: str = "fast"
+) -> List[HeaderRow]:
+    """thとその次の兄弟要素のテキストの組を抜き出す.
+
+    Args:
+        html (str | bytes): htmlソース. bytesならutf-8としてデコードする.
+        engine (str, optional): "tokenizer", "lxml", または"fast"（tokenizerと同じ）.
+            lxmlは壊れたhtmlでは木の作り方が違うので結果が変わることがある.
+
+    Returns:
+        List[HeaderRow]: (thのテキスト, 次の兄弟要素のテキストまたはNone)のリスト.
+    """
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    if engine == "fast":
+        # BeautifulSoupと結果が同じになるのはトークナイザだけなので, lxmlは明示したときだけ使う.
+        engine = "tokenizer"
+    if engine == "lxml":
+        if not HAS_LXML:
+            raise ValueError("lxml is not installed.")
+        return _extract_with_lxml(html)
+    return _extract_with_tokenizer(html)
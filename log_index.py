@@ -0,0 +1,211 @@
+"""ログの索引
+
+ログファイルの各行の開始位置とレベルを索引にし, 前回読んだところから後ろだけを読んで索引に足していく.
+件数などの集計も追記された行だけで更新するので, ページを開くたびにファイル全体を読み直さずに済む.
+行の中身は必要になったときに開始位置から読む.
+
+"""
+
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Final, List, Optional
+
+# logzeroの行頭（"[I 211005 12:00:00 collector:123] "）. 一文字目がレベル.
+LOG_PREFIX_PATTERN: Final = re.compile(rb"\[([A-Z])[^\]]*\] ")
+# これ以降の行はまとめ（エラーの一覧など）として扱う.
+SUMMARY_MARKER: Final = b"summary:"
+# 追記された分を一度に読む大きさ.
+READ_CHUNK_SIZE: Final = 1 << 20
+
+
+class LogIndex:
+    """ログファイルの索引
+
+    ファイルが小さくなったか置き換えられた（ローテーションされた）ら索引を作り直す.
+    行頭のないトレースバックなどの行は直前の行のレベルとして扱う.
+
+    Attributes:
+        path (str): ログファイルのパス.
+        got_count (int): まとめより前の"got"を含む行の数（取得できた自治体の数）.
+        summary_start (int | None): 最初のまとめの印の行番号. まだなければNone.
+
+    Args:
+        path (str): ログファイルのパス.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._position = 0
+        self._inode: Optional[int] = None
+        self._offsets = array("q")
+        self._levels = bytearray()
+        self._by_level: Dict[str, array] = {}
+        self.got_count = 0
+        self.summary_start: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def update(self) -> int:
+        """前回読んだところから後ろを読んで索引に足す. 書きかけの最後の行は次に読む.
+
+        Returns:
+            int: 足した行の数.
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return 0
+            if stat.st_size < self._position or (
+                self._inode is not None and stat.st_ino != self._inode
+            ):
+                self._reset()
+            self._inode = stat.st_ino
+            if stat.st_size == self._position:
+                return 0
+            added = 0
+            carry = b""
+            with open(self.path, "rb") as f:
+                f.seek(self._position)
+                remaining = stat.st_size - self._position
+                while remaining > 0:
+                    chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    # 前の塊の終わりで切れた行の続きから読む.
+                    data = carry + chunk
+                    start = 0
+                    while (line_end := data.find(b"\n", start)) >= 0:
+                        self._add_line(self._position, data[start:line_end])
+                        self._position += line_end + 1 - start
+                        start = line_end + 1
+                        added += 1
+                    carry = data[start:]
+            return added
+
+    def _add_line(self, offset: int, raw: bytes) -> None:
+        if match := LOG_PREFIX_PATTERN.match(raw):
+            level = match.group(1).decode("ascii")
+            text = raw[match.end() :]  # noqa: E203
+        else:
+            level = chr(self._levels[-1]) if self._levels else "I"
+            text = raw
+        index = len(self._offsets)
+        self._offsets.append(offset)
+        self._levels.append(ord(level))
+        self._by_level.setdefault(level, array("q")).append(index)
+        if self.summary_start is None:
+            if text.strip() == SUMMARY_MARKER:
+                self.summary_start = index
+            elif b"got" in text:
+                self.got_count += 1
+
+    def _read_lines(self, indices: List[int]) -> List[Dict[str, Any]]:
+        # 行番号のリストから行の中身を読む. 続いている行はシークせずに読む.
+        result: List[Dict[str, Any]] = []
+        if not indices:
+            return result
+        with open(self.path, "rb") as f:
+            for index in indices:
+                start = self._offsets[index]
+                end = (
+                    self._offsets[index + 1]
+                    if index + 1 < len(self._offsets)
+                    else self._position
+                )
+                if f.tell() != start:
+                    f.seek(start)
+                raw = f.read(end - start).rstrip(b"\r\n")
+                if match := LOG_PREFIX_PATTERN.match(raw):
+                    raw = raw[match.end() :]  # noqa: E203
+                result.append(
+                    {
+                        "n": index,
+                        "level": chr(self._levels[index]),
+                        "text": raw.decode("utf-8", errors="replace"),
+                    }
+                )
+        return result
+
+    def lines(
+        self,
+        start: int = 0,
+        count: int = 100,
+        level: Optional[str] = None,
+        query: Optional[str] = None,
+        end: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """行を番号順に一ページ分返す.
+
+        レベルだけで絞るなら索引から読むので読むのはページ分だけ. 文字列で絞るとファイル全体を探す.
+
+        Args:
+            start (int, optional): 絞り込んだ結果の何番目から返すか. 負なら後ろから数える.
+            count (int, optional): 返す最大数.
+            level (str | None, optional): "I", "W", "E"などのレベルで絞る.
+            query (str | None, optional): 含む文字列で絞る.
+            end (int | None, optional): この行番号より前だけを対象にする.
+
+        Returns:
+            Dict[str, Any]: 絞り込んだ行の数total, 返した最初の位置start, 行のリストlines.
+                行は行番号n, レベルlevel, 行頭を除いた中身textの辞書.
+        """
+        with self._lock:
+            limit = len(self._offsets) if end is None else min(end, len(self._offsets))
+            if level:
+                candidates: Any = self._by_level.get(level, array("q"))
+                # 行番号は昇順に並んでいる.
+                total = bisect_left(candidates, limit)
+            else:
+                candidates = range(limit)
+                total = limit
+            if query:
+                matched = [
+                    line["n"]
+                    for line in self._read_lines(list(candidates[:total]))
+                    if query in line["text"]
+                ]
+                candidates, total = matched, len(matched)
+            if start < 0:
+                start = max(total + start, 0)
+            stop = min(start + max(count, 0), total)
+            indices = list(candidates[start:stop])
+            return {
+                "total": total,
+                "start": start,
+                "lines": self._read_lines(indices),
+            }
+
+    def tail(self, after: int, limit: int = 1000) -> List[Dict[str, Any]]:
+        """行番号がafterより後の行を返す.
+
+        Args:
+            after (int): この行番号より後を返す. -1なら最初から.
+            limit (int, optional): 返す最大数.
+        """
+        with self._lock:
+            first = max(after + 1, 0)
+            return self._read_lines(
+                list(range(first, min(first + limit, len(self._offsets))))
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """行数・レベルごとの行数・取得できた自治体の数・まとめの開始行を返す."""
+        with self._lock:
+            return {
+                "lines": len(self._offsets),
+                "levels": {
+                    level: len(indices) for level, indices in self._by_level.items()
+                },
+                "got": self.got_count,
+                "summary_start": self.summary_start,
+            }
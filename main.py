@@ -1,17 +1,87 @@
-from logzero import logfile
+import argparse
+from logzero import logfile, logger
 from collector import Collector
+from filemanager import file_manager
+from metrics import metrics
+from shard import Shard
+from settings import LOG_PATH
 
-logfile("log.log", disableStderrLogger=False)
+logfile(LOG_PATH, disableStderrLogger=False)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--reextract",
+        action="store_true",
+        help="保存済みの自治体ページから駅リンクだけを並列に取り出し直す（ウェブにはアクセスしない）.",
+    )
+    parser.add_argument(
+        "--offline-first",
+        action="store_true",
+        help="自治体ページを使わず, 所在地データから駅を決めて設置年がわからない駅だけを取得する.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="既存データのページの版番号を問い合わせ, 変わったページに関わる自治体だけを収集し直す.",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        help="i/Nの形で指定すると, 自治体リストをN個に分けたうちのi番目（0から）だけを収集し, シャードごとのファイルに保存する.",
+    )
+    parser.add_argument(
+        "--shard-method",
+        choices=Shard.METHODS,
+        default="hash",
+        help="--shardでの分け方. hashは自治体名のハッシュ, prefectureは都道府県ごとに均等.",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        default=None,
+        metavar="N",
+        help="N個のシャードの結果をまとめてローデータと結果のcsvを出力する.",
+    )
+    parser.add_argument(
+        "--pack-html",
+        action="store_true",
+        help="保存済みの自治体ページ（WIKI_STORAGE_DIR）をWIKI_PACK_PATHのパックに移す.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="--reextractで使うプロセス数."
+    )
+    args = parser.parse_args()
+    if args.pack_html:
+        count, total_bytes, pack_bytes = file_manager.pack_local_html()
+        logger.info(
+            f"packed {count} pages : {total_bytes / 1024:.0f} KB -> "
+            f"{pack_bytes / 1024:.0f} KB ({file_manager.wiki_pack.path})"
+        )
+        return
     config = {
         "START_INDEX": 0,  # 検索開始するインデックス
         "GET_NUM": 1900,  # データを取得する最大数. 指定しなければすべて取得する.
+        "OFFLINE_FIRST": args.offline_first,  # 所在地データから駅を決めるモード
+        # 分担して収集するときのシャード
+        "SHARD": Shard.parse(args.shard, args.shard_method) if args.shard else None,
     }
     collector = Collector(config)
+    if args.merge:
+        collector.merge_shards(args.merge)
+        return
+    if args.reextract:
+        collector.reextract_station_links(args.workers)
+        collector.log_errors()
+        return
+    # 集計をserver_appから見られるように書き出す.
+    metrics.enable()
+    if args.refresh:
+        collector.refresh()
     collector.run()
     collector.save()
+    metrics.write()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+"""処理時間と回数の計測
+
+主な処理（記事名の解決, ページの取得, 解析, 保存など）の時間をヒストグラムに, 回数をカウンタにプロセス内で集計する.
+収集を実行するプロセスとログを表示するserver_appは別のプロセスなので, 集計はjsonファイルに書き出して受け渡す.
+server_appはそれをjsonとPrometheusのテキスト形式で返す.
+
+    with metrics.timer("get_source"):
+        ...
+
+    @metrics.timed("parse_station_page")
+    def parse_station_page(...):
+        ...
+
+"""
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import monotonic, perf_counter
+from typing import Any, Callable, Dict, Final, Iterator, List, Optional, Tuple
+from shard import Shard, partition_paths
+from settings import metrics_config
+
+# ヒストグラムのバケットの上限（秒）. 最後に+Infのバケットがつく.
+BUCKETS: Final[Tuple[float, ...]] = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    30.0,
+)
+# Prometheusのメトリクス名の接頭辞.
+PROMETHEUS_PREFIX: Final = "station_year"
+
+
+def empty_histogram() -> Dict[str, Any]:
+    return {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+
+
+class Metrics:
+    """処理時間のヒストグラムと回数のカウンタの集計
+
+    スレッドから同時に記録してよい. enableしたプロセスでだけファイルに書き出し,
+    記録のたびに前回からinterval秒以上経っていれば書き出す.
+
+    Attributes:
+        path (str): 書き出すjsonファイルのパス. シャードを使うときはそのパーティション.
+        interval (float): 書き出す最短の間隔（秒）.
+        enabled (bool): ファイルに書き出すかどうか.
+
+    Args:
+        path (str): 書き出すjsonファイルのパス.
+        interval (float, optional): 書き出す最短の間隔（秒）.
+    """
+
+    def __init__(self, path: str, interval: float = 5.0) -> None:
+        self.path = path
+        self._base_path = path
+        self.interval = interval
+        self.enabled = False
+        self._owner_pid: Optional[int] = None
+        self._histograms: Dict[str, Dict[str, Any]] = {}
+        self._counters: Dict[str, float] = {}
+        self._started_at = monotonic()
+        self._last_write = 0.0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def enable(self) -> None:
+        """このプロセスで記録したものをファイルに書き出すようにする. 子プロセスでは書き出さない."""
+        self.enabled = True
+        self._owner_pid = os.getpid()
+
+    def use_shard(self, shard: Shard) -> None:
+        """書き出すファイルをシャードのパーティションにする."""
+        self.path = shard.partition_path(self._base_path)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """処理時間を一つ記録する.
+
+        Args:
+            name (str): 処理の名前.
+            seconds (float): 秒数.
+        """
+        index = next(
+            (i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS)
+        )
+        with self._lock:
+            histogram = self._histograms.setdefault(name, empty_histogram())
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+            histogram["buckets"][index] += 1
+        self.maybe_write()
+
+    def count(self, name: str, value: float = 1) -> None:
+        """カウンタを増やす.
+
+        Args:
+            name (str): カウンタの名前.
+            value (float, optional): 増やす量.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """withの中の処理時間を記録する. 例外で抜けたときも記録する."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """関数の処理時間を記録するデコレータ."""
+
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        """今の集計をjsonにできる辞書で返す."""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": monotonic() - self._started_at,
+                "buckets": list(BUCKETS),
+                "histograms": {
+                    name: dict(histogram, buckets=list(histogram["buckets"]))
+                    for name, histogram in self._histograms.items()
+                },
+                "counters": dict(self._counters),
+            }
+
+    def maybe_write(self) -> None:
+        """前回書き出してからinterval秒以上経っていれば書き出す."""
+        if self.enabled and monotonic() - self._last_write >= self.interval:
+            self.write()
+
+    def write(self) -> None:
+        """集計をファイルに書き出す. enableしたプロセスでなければ何もしない."""
+        if not self.enabled or self._owner_pid != os.getpid():
+            return
+        with self._write_lock:
+            self._last_write = monotonic()
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+
+def merge_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """複数のプロセス（シャード）の集計を足し合わせる.
+
+    Args:
+        snapshots (List[Dict[str, Any]]): Metrics.snapshotの辞書のリスト.
+
+    Returns:
+        Dict[str, Any]: 足し合わせた集計. uptimeは最大のもの.
+    """
+    merged: Dict[str, Any] = {
+        "processes": len(snapshots),
+        "uptime": max((s.get("uptime", 0.0) for s in snapshots), default=0.0),
+        "buckets": list(BUCKETS),
+        "histograms": {},
+        "counters": {},
+    }
+    for snapshot in snapshots:
+        for name, histogram in snapshot.get("histograms", {}).items():
+            total = merged["histograms"].setdefault(name, empty_histogram())
+            total["count"] += histogram["count"]
+            total["sum"] += histogram["sum"]
+            total["max"] = max(total["max"], histogram["max"])
+            total["buckets"] = [
+                a + b for a, b in zip(total["buckets"], histogram["buckets"])
+            ]
+        for name, value in snapshot.get("counters", {}).items():
+            merged["counters"][name] = merged["counters"].get(name, 0) + value
+    return merged
+
+
+def load_snapshot(path: str = metrics_config["path"]) -> Dict[str, Any]:
+    """書き出された集計を読み込む. シャードのパーティションのファイルもあれば足し合わせる.
+
+    Args:
+        path (str, optional): 書き出されたjsonファイルのパス.
+
+    Returns:
+        Dict[str, Any]: 足し合わせた集計. ファイルがなければ空の集計.
+    """
+    snapshots = []
+    for snapshot_path in [path] + partition_paths(path):
+        try:
+            with open(snapshot_path, encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return merge_snapshots(snapshots)
+
+
+def to_prometheus(snapshot: Dict[str, Any]) -> str:
+    """集計をPrometheusのテキスト形式にする.
+
+    処理時間は処理の名前をラベルにした一つのヒストグラムに, カウンタはそれぞれ_totalのついた名前にする.
+
+    Args:
+        snapshot (Dict[str, Any]): load_snapshotやMetrics.snapshotの辞書.
+
+    Returns:
+        str: テキスト.
+    """
+    name = f"{PROMETHEUS_PREFIX}_operation_seconds"
+    lines = [
+        f"# HELP {name} Time spent in each operation.",
+        f"# TYPE {name} histogram",
+    ]
+    for operation, histogram in sorted(snapshot["histograms"].items()):
+        cumulative = 0
+        bounds = [str(bound) for bound in snapshot["buckets"]] + ["+Inf"]
+        for bound, bucket_count in zip(bounds, histogram["buckets"]):
+            cumulative += bucket_count
+            lines.append(
+                f'{name}_bucket{{operation="{operation}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{name}_sum{{operation="{operation}"}} {histogram["sum"]}')
+        lines.append(f'{name}_count{{operation="{operation}"}} {histogram["count"]}')
+    for counter, value in sorted(snapshot["counters"].items()):
+        counter_name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+        lines.append(f"# TYPE {counter_name} counter")
+        lines.append(f"{counter_name} {value}")
+    uptime_name = f"{PROMETHEUS_PREFIX}_uptime_seconds"
+    lines.append(f"# TYPE {uptime_name} gauge")
+    lines.append(f"{uptime_name} {snapshot['uptime']}")
+    return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(**metrics_config)
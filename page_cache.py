@@ -0,0 +1,309 @@
+"""駅ページキャッシュ
+
+駅ページのhtmlを正規化したURLのハッシュをキーにしてgzip圧縮で保存する.
+有効期限（TTL）を過ぎたものはETag/Last-Modifiedで再検証し, 合計サイズが上限を超えたら古く使われたものから消す.
+途中で読むのをやめたhtmlは途中までと印を付けて保存し, 全体が必要な読み出しではないものとして扱う.
+
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+from time import time
+from typing import Callable, Dict, Optional, Union
+from urllib.parse import quote, unquote, urlsplit, urlunsplit
+from settings import station_cache_config
+
+
+def normalize_wiki_url(url: str) -> str:
+    """URLを正規化
+
+    パーセントエンコードの有無やフラグメントの違いで同じページが別のキーにならないようにする.
+
+    Args:
+        url (str): URL.
+
+    Returns:
+        str: スキームとホストを小文字にし, パスを一度デコードしてからエンコードし直したURL.
+    """
+    parts = urlsplit(url)
+    path = quote(unquote(parts.path), safe="/:()_,'!-.~")
+    return urlunsplit(
+        (parts.scheme.lower() or "https", parts.netloc.lower(), path, parts.query, "")
+    )
+
+
+class CacheEntry:
+    """キャッシュの1件分
+
+    Attributes:
+        url (str): 正規化されたURL.
+        html (bytes): htmlソース.
+        fetched_at (float): 取得（または再検証）した時刻.
+        etag (str | None): レスポンスのETag.
+        last_modified (str | None): レスポンスのLast-Modified.
+        partial (bool): htmlが途中までしかなければTrue.
+    """
+
+    __slots__ = ("url", "html", "fetched_at", "etag", "last_modified", "partial")
+
+    def __init__(
+        self,
+        url: str,
+        html: bytes,
+        fetched_at: float,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        partial: bool = False,
+    ) -> None:
+        self.url = url
+        self.html = html
+        self.fetched_at = fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+        self.partial = partial
+
+    def validation_headers(self) -> Dict[str, str]:
+        """条件付きリクエスト用のヘッダーを返す."""
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class StationPageCache:
+    """駅ページのディスクキャッシュ
+
+    ファイルは`<cache_dir>/<キーの先頭2文字>/<キー>.html.gz`とメタデータの`.json`の組で保存する.
+    ファイル単位で書き込むので複数のプロセスが同じディレクトリを共有しても壊れない.
+
+    Attributes:
+        cache_dir (str): 保存ディレクトリ.
+        ttl (float): 再検証せずに使う秒数.
+        max_bytes (int): 圧縮後の合計サイズの上限. これを超えたら最終アクセスが古いものから消す.
+
+    Args:
+        cache_dir (str): 保存ディレクトリ.
+        ttl (float): 再検証せずに使う秒数.
+        max_bytes (int): 合計サイズの上限.
+    """
+
+    def __init__(self, cache_dir: str, ttl: float, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    @staticmethod
+    def key(url: str) -> str:
+        """正規化したURLのハッシュをキーとして返す."""
+        return hashlib.sha1(normalize_wiki_url(url).encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> Dict[str, str]:
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return {"html": base + ".html.gz", "meta": base + ".json"}
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(
+        self, url: str, with_html: bool = True, partial_ok: bool = False
+    ) -> Union[CacheEntry, None]:
+        """キャッシュを取得
+
+        存在すればアクセス時刻を更新して返す. 有効期限の判定はしないのでis_freshで確認すること.
+
+        Args:
+            url (str): 駅ページのURL.
+            with_html (bool, optional): Falseならhtmlは読み込まず空にする（read_htmlで少しずつ読む）.
+            partial_ok (bool, optional): Trueなら途中までのhtmlも返す. Falseならないものとして扱う.
+
+        Returns:
+            CacheEntry | None: キャッシュ. 存在しないか読めなければNone.
+        """
+        paths = self._paths(self.key(url))
+        try:
+            with open(paths["meta"], encoding="utf-8") as f:
+                meta = json.load(f)
+            partial = meta.get("partial", False)
+            if partial and not partial_ok:
+                return None
+            if with_html:
+                with gzip.open(paths["html"], "rb") as f:
+                    html = f.read()
+            elif os.path.exists(paths["html"]):
+                html = b""
+            else:
+                return None
+            # 最終アクセス時刻をLRUの順番として使う.
+            os.utime(paths["html"])
+        except (OSError, ValueError, EOFError):
+            return None
+        return CacheEntry(
+            meta["url"],
+            html,
+            meta["fetched_at"],
+            meta["etag"],
+            meta["last_modified"],
+            partial,
+        )
+
+    def read_html(
+        self, url: str, on_chunk: Callable[[bytes], bool], chunk_size: int = 16384
+    ) -> Union[bytes, None]:
+        """キャッシュのhtmlを少しずつ展開してon_chunkに渡す. on_chunkがTrueを返したらそこでやめる.
+
+        Args:
+            url (str): 駅ページのURL.
+            on_chunk (Callable[[bytes], bool]): 展開したhtmlの続きを受け取る関数.
+            chunk_size (int, optional): 一度に渡す大きさ.
+
+        Returns:
+            bytes | None: 読んだところまでのhtml. 読めなければNone.
+        """
+        path = self._paths(self.key(url))["html"]
+        chunks = []
+        try:
+            with gzip.open(path, "rb") as f:
+                while chunk := f.read(chunk_size):
+                    chunks.append(chunk)
+                    if on_chunk(chunk):
+                        break
+            os.utime(path)
+        except (OSError, EOFError):
+            return None
+        return b"".join(chunks)
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """有効期限内ならTrue."""
+        return time() - entry.fetched_at < self.ttl
+
+    def put(
+        self,
+        url: str,
+        html: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        partial: bool = False,
+    ) -> None:
+        """キャッシュに保存
+
+        Args:
+            url (str): 駅ページのURL.
+            html (bytes): htmlソース.
+            etag (str | None, optional): レスポンスのETag.
+            last_modified (str | None, optional): レスポンスのLast-Modified.
+            partial (bool, optional): htmlが途中までならTrue.
+        """
+        paths = self._paths(self.key(url))
+        os.makedirs(os.path.dirname(paths["html"]), exist_ok=True)
+        old_size = (
+            os.path.getsize(paths["html"]) if os.path.exists(paths["html"]) else 0
+        )
+        compressed = gzip.compress(html)
+        self._write_atomic(paths["html"], compressed)
+        self._write_meta(paths["meta"], url, time(), etag, last_modified, partial)
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(compressed) - old_size
+        self.evict()
+
+    def revalidated(self, entry: CacheEntry) -> None:
+        """304で再検証できたときに取得時刻だけ更新する.
+
+        Args:
+            entry (CacheEntry): 再検証したキャッシュ.
+        """
+        entry.fetched_at = time()
+        paths = self._paths(self.key(entry.url))
+        self._write_meta(
+            paths["meta"],
+            entry.url,
+            entry.fetched_at,
+            entry.etag,
+            entry.last_modified,
+            entry.partial,
+        )
+
+    def expire(self, url: str) -> None:
+        """キャッシュを期限切れにする. 次の取得では条件付きリクエストで再検証する.
+
+        Args:
+            url (str): 駅ページのURL.
+        """
+        paths = self._paths(self.key(url))
+        try:
+            with open(paths["meta"], encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._write_meta(
+            paths["meta"],
+            meta["url"],
+            0.0,
+            meta["etag"],
+            meta["last_modified"],
+            meta.get("partial", False),
+        )
+
+    def _write_meta(
+        self,
+        path: str,
+        url: str,
+        fetched_at: float,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        partial: bool = False,
+    ) -> None:
+        meta = {
+            "url": normalize_wiki_url(url),
+            "fetched_at": fetched_at,
+            "etag": etag,
+            "last_modified": last_modified,
+            "partial": partial,
+        }
+        self._write_atomic(path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+    def _scan(self) -> Dict[str, os.stat_result]:
+        # 全てのhtmlファイルのstatを返す.
+        result: Dict[str, os.stat_result] = {}
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(".html.gz"):
+                    result[entry.path] = entry.stat()
+        return result
+
+    def evict(self) -> None:
+        """合計サイズが上限を超えていれば, 最終アクセスが古いものから上限の9割まで消す."""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(st.st_size for st in self._scan().values())
+            if self._total_bytes <= self.max_bytes:
+                return
+            files = sorted(self._scan().items(), key=lambda item: item[1].st_mtime)
+            total = sum(st.st_size for _, st in files)
+            for path, st in files:
+                if total <= self.max_bytes * 0.9:
+                    break
+                for remove_path in (path, path[: -len(".html.gz")] + ".json"):
+                    try:
+                        os.remove(remove_path)
+                    except OSError:
+                        pass
+                total -= st.st_size
+            self._total_bytes = total
+
+
+station_page_cache = StationPageCache(**station_cache_config)
@@ -0,0 +1,145 @@
+"""段階的な処理のパイプライン
+
+処理をいくつかの段階に分け, 段階ごとのスレッドを大きさの決まったキューでつなぐ.
+ネットワークを待つ段階と解析する段階が重なって進み, 後ろの段階が詰まればキューが一杯になって前の段階が待つので,
+全体の項目数が多くてもメモリに載る項目の数はキューの大きさで決まる.
+
+"""
+
+import queue
+import threading
+import traceback
+from time import perf_counter
+from typing import Any, Callable, Iterable, List, Optional
+from logzero import logger
+from metrics import metrics
+
+# 段階の終わりを次の段階に伝えるための印.
+_DONE: Any = object()
+
+
+class Stage:
+    """パイプラインの一段階
+
+    Attributes:
+        name (str): 段階の名前.
+        func (Callable[[Any], Any]): 項目を受け取り次の段階に渡す項目を返す関数. Noneを返すとそこで終わる.
+        workers (int): この段階を処理するスレッドの数.
+        processed (int): 処理した項目の数.
+        failed (int): 例外が起きた項目の数.
+        busy_seconds (float): funcの中にいた合計秒数（スレッドの合計）.
+
+    Args:
+        name (str): 段階の名前.
+        func (Callable[[Any], Any]): 項目を処理する関数.
+        workers (int, optional): スレッドの数.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1) -> None:
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, elapsed: float, failed: bool) -> None:
+        with self._lock:
+            self.processed += 1
+            self.failed += int(failed)
+            self.busy_seconds += elapsed
+        metrics.observe(f"stage_{self.name}", elapsed)
+        if failed:
+            metrics.count(f"stage_{self.name}_failed")
+
+
+class Pipeline:
+    """段階をキューでつないだパイプライン
+
+    Args:
+        stages (List[Stage]): 段階のリスト. 前から順に処理する.
+        queue_size (int, optional): 段階の間のキューに入る項目の最大数.
+        on_error (Callable[[Any, Exception, str], None] | None, optional):
+            段階で例外が起きたときに(項目, 例外, トレースバック)で呼ばれる関数. その項目はそこで終わる.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        queue_size: int = 8,
+        on_error: Optional[Callable[[Any, Exception, str], None]] = None,
+    ) -> None:
+        self.stages = stages
+        self.queue_size = max(queue_size, 1)
+        self.on_error = on_error
+
+    def run(self, items: Iterable[Any]) -> None:
+        """項目を全て流し, 最後の段階が終わるまで待つ.
+
+        Args:
+            items (Iterable[Any]): 最初の段階に渡す項目.
+        """
+        queues: List["queue.Queue[Any]"] = [
+            queue.Queue(maxsize=self.queue_size) for _ in self.stages
+        ]
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        def work(index: int) -> None:
+            stage = self.stages[index]
+            in_queue = queues[index]
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+            try:
+                while (item := in_queue.get()) is not _DONE:
+                    start = perf_counter()
+                    try:
+                        result = stage.func(item)
+                    except Exception as e:
+                        stage._count(perf_counter() - start, True)
+                        self._handle_error(item, e, traceback.format_exc())
+                        continue
+                    stage._count(perf_counter() - start, False)
+                    if result is not None and out_queue is not None:
+                        # 次の段階が詰まっていればここで待つ.
+                        out_queue.put(result)
+            finally:
+                # スレッドが例外で終わっても, この段階の最後のスレッドなら次の段階のスレッドに終わりを伝える.
+                with remaining_lock:
+                    remaining[index] -= 1
+                    is_last = remaining[index] == 0
+                if is_last and out_queue is not None:
+                    for _ in range(self.stages[index + 1].workers):
+                        out_queue.put(_DONE)
+
+        threads = [
+            threading.Thread(target=work, args=(index,), name=stage.name, daemon=True)
+            for index, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    def _handle_error(self, item: Any, error: Exception, trace: str) -> None:
+        # on_errorで例外が起きてもスレッドを止めずにログに出して次の項目に進む.
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(item, error, trace)
+        except Exception:
+            logger.exception(f"on_error failed ({error!r})")
+
+    def log_stats(self) -> None:
+        """段階ごとの処理数と処理時間をログに出力"""
+        for stage in self.stages:
+            logger.info(
+                f"stage {stage.name} : {stage.processed} processed, "
+                f"{stage.failed} failed, busy {stage.busy_seconds:.1f} sec "
+                f"({stage.workers} workers)"
+            )
@@ -0,0 +1,102 @@
+"""レート制限
+
+ホストごとのトークンバケットでリクエストの間隔を制御する.
+固定のsleepの代わりに使い, 複数スレッドから同時に取得しても全体のアクセス頻度が設定値を超えないようにする.
+
+"""
+
+import threading
+from time import monotonic, sleep
+from typing import Dict
+from urllib.parse import urlparse
+from metrics import metrics
+from settings import rate_limiter_config
+
+
+class TokenBucket:
+    """トークンバケット
+
+    一定の速度でトークンが補充され, リクエストごとに一つ消費する. トークンが足りなければ補充されるまで待つ.
+
+    Attributes:
+        rate (float): 1秒あたりに補充されるトークン数. すなわち平均のリクエスト数/秒.
+        capacity (float): バケットの容量. 連続して待たずに送れるリクエストの最大数.
+
+    Args:
+        rate (float): 1秒あたりに補充されるトークン数.
+        capacity (float): バケットの容量.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._last = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """トークンを一つ取得
+
+        トークンを予約し, 足りない分が補充されるまで待機する. 待機はロックの外で行うので他のスレッドを止めない.
+
+        Returns:
+            float: 実際に待機した秒数.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            # 先にトークンを消費しておき, マイナスになった分だけ待つ.
+            self._tokens -= 1.0
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+
+class HostRateLimiter:
+    """ホストごとのレート制限
+
+    URLのホスト名ごとにトークンバケットを持ち, 同じホストへのアクセスを共通の制限にかける.
+
+    Attributes:
+        rate (float): 各ホストの1秒あたりのリクエスト数.
+        capacity (float): 各ホストのバースト数.
+
+    Args:
+        rate (float): 各ホストの1秒あたりのリクエスト数.
+        capacity (float): 各ホストのバースト数.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, host: str) -> TokenBucket:
+        """ホストのバケットを返す. なければ作る."""
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate, self.capacity)
+            return self._buckets[host]
+
+    def acquire(self, url: str) -> float:
+        """URLのホストに対してトークンを一つ取得する.
+
+        Args:
+            url (str): アクセスするURL.
+
+        Returns:
+            float: 待機した秒数.
+        """
+        wait = self.bucket(urlparse(url).netloc).acquire()
+        metrics.observe("rate_limit_wait", wait)
+        return wait
+
+
+rate_limiter = HostRateLimiter(**rate_limiter_config)
@@ -0,0 +1,297 @@
+"""ローカルの再生サーバー
+
+記録しておいた自治体ページと駅ページを, ja.wikipediaの代わりにローカルのHTTPサーバーから返す.
+`WIKI_BASE_URL`をこのサーバーに向けると, ネットワークにアクセスせずに取得から集計までを実行できる.
+記事は/wiki/記事名で返し, /w/api.phpでは記事の存在と版番号の問い合わせに答える.
+ウィキテキストの内容の問い合わせには, 記録しておいたAPIの応答にある記事だけ答え, ほかは記事が存在しないと答える.
+
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from revision import extract_revision_id, url_to_title
+
+
+class ReplayCorpus:
+    """記録したページの集まり
+
+    ディレクトリにページをgzipで一件ずつ保存し, manifest.jsonに記事名とファイル名の対応,
+    自治体名と自治体ページの記事名の対応, 駅ページの記事名のリストを書く.
+    APIの応答から取り出したウィキテキストも記事ごとに(版番号, 内容)のjsonをgzipで保存する.
+
+    Attributes:
+        root (str): 保存するディレクトリ.
+        municipalities (Dict[str, str]): 自治体名がキー, 自治体ページの記事名が値の辞書（記録した順）.
+        stations (List[str]): 駅ページの記事名のリスト.
+
+    Args:
+        root (str): 保存するディレクトリ. manifest.jsonがあれば読み込む.
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        self.municipalities: Dict[str, str] = {}
+        self.stations: List[str] = []
+        self._pages: Dict[str, str] = {}
+        self._wikitexts: Dict[str, str] = {}
+        self._revisions: Dict[str, Optional[int]] = {}
+        manifest_path = os.path.join(root, self.MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.municipalities = manifest["municipalities"]
+            self.stations = manifest["stations"]
+            self._pages = manifest["pages"]
+            self._wikitexts = manifest.get("wikitexts", {})
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.root, "pages", file_name)
+
+    def add_page(self, title: str, html: bytes, station: bool = False) -> None:
+        """ページを追加する. 同じ記事名があれば置き換える.
+
+        Args:
+            title (str): 記事名.
+            html (bytes): htmlソース.
+            station (bool, optional): 駅ページならTrue.
+        """
+        file_name = hashlib.sha1(title.encode("utf-8")).hexdigest() + ".html.gz"
+        os.makedirs(os.path.join(self.root, "pages"), exist_ok=True)
+        with open(self._path(file_name), "wb") as f:
+            f.write(gzip.compress(html, 6))
+        self._pages[title] = file_name
+        if station and title not in self.stations:
+            self.stations.append(title)
+
+    def add_api_response(self, response: dict) -> int:
+        """記録したAPIの応答のウィキテキストを追加する. 同じ記事名があれば置き換える.
+
+        Args:
+            response (dict): APIの応答（rvprop=ids|content, formatversion=2）.
+
+        Returns:
+            int: 追加した記事の数.
+        """
+        added = 0
+        for page in response.get("query", {}).get("pages", []):
+            if not (revisions := page.get("revisions")):
+                continue
+            revision = revisions[0]
+            data = json.dumps(
+                {
+                    "revid": revision["revid"],
+                    "content": revision["slots"]["main"]["content"],
+                },
+                ensure_ascii=False,
+            ).encode("utf-8")
+            file_name = (
+                hashlib.sha1(page["title"].encode("utf-8")).hexdigest() + ".wiki.gz"
+            )
+            os.makedirs(os.path.join(self.root, "pages"), exist_ok=True)
+            with open(self._path(file_name), "wb") as f:
+                f.write(gzip.compress(data, 6))
+            self._wikitexts[page["title"]] = file_name
+            added += 1
+        return added
+
+    def add_municipality(self, man_name: str, title: str, html: bytes) -> None:
+        """自治体ページを追加する."""
+        self.add_page(title, html)
+        self.municipalities[man_name] = title
+
+    def save(self) -> None:
+        """manifest.jsonを書く."""
+        os.makedirs(self.root, exist_ok=True)
+        manifest = {
+            "municipalities": self.municipalities,
+            "stations": self.stations,
+            "pages": self._pages,
+            "wikitexts": self._wikitexts,
+        }
+        with open(
+            os.path.join(self.root, self.MANIFEST_NAME), "w", encoding="utf-8"
+        ) as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    def __contains__(self, title: str) -> bool:
+        return title in self._pages
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def gzipped(self, title: str) -> Optional[bytes]:
+        """ページをgzip圧縮したまま返す. なければNone."""
+        if (file_name := self._pages.get(title)) is None:
+            return None
+        try:
+            with open(self._path(file_name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def wikitext(self, title: str) -> Optional[Tuple[int, str]]:
+        """記録したウィキテキストを(版番号, 内容)で返す. なければNone."""
+        if (file_name := self._wikitexts.get(title)) is None:
+            return None
+        try:
+            with open(self._path(file_name), "rb") as f:
+                data = json.loads(gzip.decompress(f.read()))
+        except OSError:
+            return None
+        return data["revid"], data["content"]
+
+    def revision(self, title: str) -> Optional[int]:
+        """ページの版番号を返す. htmlに書かれていなければ0, ページがなければNone."""
+        if title not in self._revisions:
+            data = self.gzipped(title)
+            self._revisions[title] = (
+                None
+                if data is None
+                else extract_revision_id(gzip.decompress(data)) or 0
+            )
+        return self._revisions[title]
+
+
+class ReplayServer:
+    """記録したページを返すHTTPサーバー
+
+    別スレッドで動かす. 受けたリクエストの数と送った中身のバイト数を数える.
+
+    Attributes:
+        corpus (ReplayCorpus): 返すページ.
+        requests (int): 受けたリクエストの数.
+        bytes_sent (int): 送った中身の合計バイト数.
+        not_found (int): 記録になかったページへのリクエストの数.
+
+    Args:
+        corpus (ReplayCorpus): 返すページ.
+        host (str, optional): 待ち受けるアドレス.
+        port (int, optional): 待ち受けるポート. 0なら空いているものを使う.
+    """
+
+    def __init__(
+        self, corpus: ReplayCorpus, host: str = "127.0.0.1", port: int = 0
+    ) -> None:
+        self.corpus = corpus
+        self.requests = 0
+        self.bytes_sent = 0
+        self.not_found = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """WIKI_BASE_URLに設定するURL."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "ReplayServer":
+        """別スレッドで待ち受けを始める."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="replay-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """待ち受けをやめる."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def reset_stats(self) -> None:
+        """数えたリクエスト数などを0に戻す."""
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.not_found = 0
+
+    def __enter__(self) -> "ReplayServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _count(self, size: int, found: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += size
+            self.not_found += int(not found)
+
+    def api_response(self, params: Dict[str, List[str]]) -> dict:
+        """APIの問い合わせ（action=query）への応答を作る.
+
+        記録した記事は存在して曖昧さ回避でないものとし, 版番号はhtmlに書かれたものを返す.
+        内容（rvprop=content）の問い合わせには記録したウィキテキストを返し,
+        記録していない記事は存在しないと答えるので, 呼び出し側はhtmlで取得し直す.
+        """
+        titles = [t for t in params.get("titles", [""])[0].split("|") if t]
+        prop = params.get("prop", [""])[0]
+        with_content = "content" in params.get("rvprop", [""])[0]
+        pages = []
+        for title in titles:
+            if with_content:
+                if (page := self.corpus.wikitext(title)) is None:
+                    pages.append({"title": title, "missing": True})
+                    continue
+                revid, content = page
+                revision = {"revid": revid, "slots": {"main": {"content": content}}}
+                pages.append({"title": title, "revisions": [revision]})
+            elif title not in self.corpus:
+                pages.append({"title": title, "missing": True})
+            elif prop == "revisions":
+                revid = self.corpus.revision(title)
+                pages.append({"title": title, "revisions": [{"revid": revid}]})
+            else:
+                pages.append({"title": title, "pageprops": {}})
+        return {"batchcomplete": True, "query": {"pages": pages}}
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-aliveで接続を使い回せるようにする.
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                parts = urlsplit(self.path)
+                accept_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+                status, content_type = 404, "text/plain"
+                body, gzipped = b"not found", False
+                if parts.path == "/w/api.php":
+                    response = server.api_response(parse_qs(parts.query))
+                    status, content_type = 200, "application/json; charset=utf-8"
+                    body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+                elif (title := url_to_title(parts.path)) is not None and (
+                    data := server.corpus.gzipped(title)
+                ) is not None:
+                    status, content_type = 200, "text/html; charset=utf-8"
+                    # 保存してあるgzipをそのまま送れるならそうする.
+                    if accept_gzip:
+                        body, gzipped = data, True
+                    else:
+                        body = gzip.decompress(data)
+                server._count(len(body), status == 200)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
@@ -0,0 +1,263 @@
+"""Wikipediaの記事名解決
+
+MANDARA10の自治体名からja.wikipediaの記事名を決める.
+記事名の候補を規則的に作り, タイトル一覧（ダンプ）とAPIへの一回の問い合わせで存在と曖昧さ回避でないことを確かめる.
+ブラウザでの検索はこれで見つからなかった場合の最後の手段として呼び出し側で行う.
+
+"""
+
+import os
+import re
+import gzip
+import json
+from typing import Callable, Dict, Final, List, Optional, Set, Tuple, Union
+from urllib.parse import quote, urlencode
+from logzero import logger
+
+# これで（都道府県または政令市）（市区町村または政令市区）に分けることができる.
+MAN_NAME_PATTERN: Final = re.compile(r"(さいたま市|堺市|...??[都道府県市])(.+?[市区町村])")
+# タイトル一覧から読み込む記事名（自治体名らしいもの）の形.
+MUNICIPALITY_TITLE_PATTERN: Final = re.compile(r"^.+?[市区町村]( \(.+\))?$")
+WIKI_URL: Final = "https://ja.wikipedia.org/wiki/"
+# APIの一回の問い合わせで渡せる記事名の数.
+QUERY_TITLES_LIMIT: Final = 50
+
+
+def split_man_name(man_name: str) -> Union[Tuple[str, str], None]:
+    """自治体名を（都道府県または政令市）と（市区町村または政令市区）に分ける.
+
+    Args:
+        man_name (str): 自治体名.
+
+    Returns:
+        Tuple[str, str] | None: 分けた二つの文字列. 形式に沿っていなければNone.
+    """
+    if match := MAN_NAME_PATTERN.search(man_name):
+        return match.groups()[0], match.groups()[1]
+    return None
+
+
+def title_to_url(title: str) -> str:
+    """記事名からja.wikipediaのURLを作る."""
+    return WIKI_URL + quote(title.replace(" ", "_"), safe="()")
+
+
+class TitleResolver:
+    """自治体名から記事名を解決するクラス
+
+    Attributes:
+        API_URL (str): MediaWiki APIのURL.
+        fetch (Callable[[str], bytes]): URLを受け取りレスポンスの中身を返す関数. 取得に失敗したら例外を送る.
+        title_index_path (str | None): タイトル一覧ファイル
+            （jawiki-latest-all-titles-in-ns0, gzip可）のパス.
+
+    Args:
+        fetch (Callable[[str], bytes]): URLを受け取りレスポンスの中身を返す関数.
+        title_index_path (str | None, optional): タイトル一覧ファイルのパス. なければAPIだけで確かめる.
+    """
+
+    API_URL: Final[str] = "https://ja.wikipedia.org/w/api.php"
+
+    def __init__(
+        self, fetch: Callable[[str], bytes], title_index_path: Optional[str] = None
+    ) -> None:
+        self.fetch = fetch
+        self.title_index_path = title_index_path
+        self._title_index: Union[Set[str], None] = None
+
+    @staticmethod
+    def candidate_titles(man_name: str) -> List[str]:
+        """記事名の候補を優先順に返す.
+
+        同名の自治体がある場合, Wikipediaでは「府中市 (東京都)」「中央区 (札幌市)」のように括弧で区別されるので,
+        まず括弧つきのものを, 次に名前だけのものを候補にする.
+
+        Args:
+            man_name (str): 自治体名.
+
+        Returns:
+            List[str]: 記事名の候補. 自治体名が形式に沿っていなければ空.
+        """
+        if not (names := split_man_name(man_name)):
+            return []
+        upper_name, local_name = names
+        return [f"{local_name} ({upper_name})", local_name]
+
+    @staticmethod
+    def station_candidate_titles(sta_name: str, prefecture: Optional[str]) -> List[str]:
+        """駅の記事名の候補を優先順に返す.
+
+        同名の駅は「府中駅 (東京都)」のように都道府県名の括弧で区別されることが多いので, それを最初の候補にする.
+
+        Args:
+            sta_name (str): "駅"などがつかない駅名.
+            prefecture (str | None): 駅がある都道府県名.
+
+        Returns:
+            List[str]: 記事名の候補.
+        """
+        titles = [f"{sta_name}駅", f"{sta_name}停留場"]
+        if prefecture:
+            titles.insert(0, f"{sta_name}駅 ({prefecture})")
+        return titles
+
+    @property
+    def title_index(self) -> Set[str]:
+        """タイトル一覧から自治体名らしい記事名だけを集めた集合. 初めて使うときに読み込む."""
+        if self._title_index is None:
+            self._title_index = set()
+            if self.title_index_path and os.path.isfile(self.title_index_path):
+                opener = gzip.open if self.title_index_path.endswith(".gz") else open
+                with opener(self.title_index_path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        title = line.rstrip("\n").replace("_", " ")
+                        if MUNICIPALITY_TITLE_PATTERN.match(title):
+                            self._title_index.add(title)
+                logger.info(f"title index loaded : {len(self._title_index)} titles")
+        return self._title_index
+
+    def query_titles(self, titles: List[str]) -> Dict[str, Union[str, None]]:
+        """記事が存在し曖昧さ回避でないかをAPIで一度に問い合わせる.
+
+        Args:
+            titles (List[str]): 記事名のリスト（50件まで）.
+
+        Returns:
+            Dict[str, str | None]: 記事名がキー, リダイレクトをたどった記事名（存在しないか曖昧さ回避ならNone）が値.
+        """
+        params = {
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "redirects": "1",
+            "prop": "pageprops",
+            "ppprop": "disambiguation",
+            "titles": "|".join(titles),
+        }
+        response = json.loads(self.fetch(f"{self.API_URL}?{urlencode(params)}"))
+        query = response.get("query", {})
+        # 正規化とリダイレクトをたどった記事名の対応.
+        renamed: Dict[str, str] = {}
+        for item in query.get("normalized", []) + query.get("redirects", []):
+            renamed[item["from"]] = item["to"]
+        valid_titles = {
+            page["title"]
+            for page in query.get("pages", [])
+            if not page.get("missing")
+            and not page.get("invalid")
+            and "disambiguation" not in page.get("pageprops", {})
+        }
+        result: Dict[str, Union[str, None]] = {}
+        for title in titles:
+            resolved = title
+            # 正規化→リダイレクトの順に変換されることがあるので, 変わらなくなるまでたどる.
+            for _ in range(3):
+                resolved = renamed.get(resolved, resolved)
+            result[title] = resolved if resolved in valid_titles else None
+        return result
+
+    def query_revisions(self, titles: List[str]) -> Dict[str, Union[int, None]]:
+        """記事の現在の版番号をAPIでまとめて問い合わせる.
+
+        QUERY_TITLES_LIMIT件ずつに分けて問い合わせ, 失敗した分は結果に含めない.
+
+        Args:
+            titles (List[str]): 記事名のリスト.
+
+        Returns:
+            Dict[str, int | None]: 記事名がキー, リダイレクトをたどった記事の版番号（存在しなければNone）が値.
+        """
+        result: Dict[str, Union[int, None]] = {}
+        titles = list(dict.fromkeys(titles))
+        for start in range(0, len(titles), QUERY_TITLES_LIMIT):
+            chunk = titles[start : start + QUERY_TITLES_LIMIT]  # noqa: E203
+            params = {
+                "action": "query",
+                "format": "json",
+                "formatversion": "2",
+                "redirects": "1",
+                "prop": "revisions",
+                "rvprop": "ids",
+                "titles": "|".join(chunk),
+            }
+            try:
+                response = json.loads(self.fetch(f"{self.API_URL}?{urlencode(params)}"))
+            except Exception as e:
+                logger.warning(f"revision query failed ({e})")
+                continue
+            query = response.get("query", {})
+            renamed: Dict[str, str] = {}
+            for item in query.get("normalized", []) + query.get("redirects", []):
+                renamed[item["from"]] = item["to"]
+            revisions = {
+                page["title"]: page["revisions"][0]["revid"]
+                for page in query.get("pages", [])
+                if page.get("revisions")
+            }
+            for title in chunk:
+                resolved = title
+                for _ in range(3):
+                    resolved = renamed.get(resolved, resolved)
+                result[title] = revisions.get(resolved)
+        return result
+
+    def resolve_station_titles(
+        self, stations: List[Tuple[str, Optional[str]]]
+    ) -> Dict[Tuple[str, Optional[str]], Union[str, None]]:
+        """複数の駅の記事名をまとめて解決する.
+
+        候補をQUERY_TITLES_LIMIT件ずつまとめてAPIに問い合わせ, 駅ごとに最初に有効だった記事名を返す.
+
+        Args:
+            stations (List[Tuple[str, str | None]]): (駅名, 都道府県名)のリスト.
+
+        Returns:
+            Dict[Tuple[str, str | None], str | None]: (駅名, 都道府県名)がキー,
+                記事名（見つからなければNone）が値.
+        """
+        candidates = {
+            station: self.station_candidate_titles(*station) for station in stations
+        }
+        titles = list(dict.fromkeys(t for ts in candidates.values() for t in ts))
+        resolved: Dict[str, Union[str, None]] = {}
+        for start in range(0, len(titles), QUERY_TITLES_LIMIT):
+            chunk = titles[start : start + QUERY_TITLES_LIMIT]  # noqa: E203
+            try:
+                resolved.update(self.query_titles(chunk))
+            except Exception as e:
+                logger.warning(f"station title query failed ({e})")
+        return {
+            station: next(
+                (resolved[t] for t in station_titles if resolved.get(t)), None
+            )
+            for station, station_titles in candidates.items()
+        }
+
+    def resolve(self, man_name: str) -> Union[str, None]:
+        """自治体名から記事のURLを返す.
+
+        タイトル一覧があればそれに載っている候補だけに絞り, APIで確かめて最初に有効だったものを返す.
+        APIが使えない場合はタイトル一覧に載っている最初の候補を返す.
+
+        Args:
+            man_name (str): 自治体名.
+
+        Returns:
+            str | None: 記事のURL. 見つからなければNone.
+        """
+        candidates = self.candidate_titles(man_name)
+        if self.title_index:
+            candidates = [title for title in candidates if title in self.title_index]
+        if not candidates:
+            return None
+        try:
+            resolved = self.query_titles(candidates)
+        except Exception as e:
+            logger.warning(f"{man_name} : title query failed ({e})")
+            if self.title_index:
+                return title_to_url(candidates[0])
+            return None
+        for title in candidates:
+            if resolved_title := resolved.get(title):
+                return title_to_url(resolved_title)
+        return None
@@ -0,0 +1,136 @@
+"""ページの版
+
+取得したページの版番号（revision ID）と, 自治体のデータがどのページから作られたかを記録する.
+次の実行で現在の版番号をAPIでまとめて問い合わせれば, 変わったページに関わる自治体だけを収集し直せる.
+
+"""
+
+import os
+import re
+import json
+import threading
+from typing import Any, Dict, Final, List, Optional, Union
+from urllib.parse import unquote, urlsplit
+from page_cache import normalize_wiki_url
+from shard import Shard, partition_paths
+from settings import revision_config
+
+# ページのhtmlのhead内のスクリプトに書かれた版番号.
+REVISION_ID_PATTERN: Final = re.compile(rb'"wgRevisionId":(\d+)')
+
+
+def extract_revision_id(html: Union[str, bytes]) -> Optional[int]:
+    """ページのhtmlから版番号を取り出す. 整形前のhtmlでないと含まれない.
+
+    Args:
+        html (str | bytes): htmlソース.
+
+    Returns:
+        int | None: 版番号. 見つからなければNone.
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    if match := REVISION_ID_PATTERN.search(html):
+        return int(match.group(1))
+    return None
+
+
+def url_to_title(url: str) -> Optional[str]:
+    """wikipediaのURLから記事名を返す. 記事のURLでなければNone."""
+    path = urlsplit(url).path
+    if not path.startswith("/wiki/"):
+        return None
+    return unquote(path[len("/wiki/") :]).replace("_", " ")  # noqa: E203
+
+
+class RevisionStore:
+    """ページの版番号と自治体の依存ページの記録
+
+    jsonファイルに保存する. 中身はページのURL → 版番号と,
+    自治体名 → 自治体ページのURLとデータに使った駅ページのURLのリスト.
+    シャードのパーティションのファイルもあれば読み込む.
+
+    Attributes:
+        path (str): 保存するjsonファイルのパス. シャードを使うときはそのパーティション.
+
+    Args:
+        path (str): 保存するjsonファイルのパス.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._base_path = path
+        self._data: Union[Dict[str, Dict[str, Any]], None] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        # 初回アクセス時に読み込む. パーティションの内容で上書きする.
+        if self._data is None:
+            data: Dict[str, Dict[str, Any]] = {"pages": {}, "municipalities": {}}
+            for path in [self._base_path] + partition_paths(self._base_path):
+                if not os.path.isfile(path):
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    try:
+                        loaded = json.load(f)
+                    except ValueError:
+                        continue
+                for key in data:
+                    data[key].update(loaded.get(key, {}))
+            self._data = data
+        return self._data
+
+    def record(self, url: str, revision_id: Optional[int]) -> None:
+        """ページの版番号を記録する. 版番号がNoneなら何もしない.
+
+        Args:
+            url (str): ページのURL.
+            revision_id (int | None): 版番号.
+        """
+        if revision_id is None:
+            return
+        with self._lock:
+            self._load()["pages"][normalize_wiki_url(url)] = revision_id
+
+    def revision(self, url: str) -> Optional[int]:
+        """記録されたページの版番号を返す. 記録がなければNone."""
+        with self._lock:
+            return self._load()["pages"].get(normalize_wiki_url(url))
+
+    def set_municipality_url(self, man_name: str, url: str) -> None:
+        """自治体ページのURLを記録する."""
+        with self._lock:
+            entry = self._load()["municipalities"].setdefault(man_name, {})
+            entry["url"] = normalize_wiki_url(url)
+
+    def set_station_urls(self, man_name: str, urls: List[str]) -> None:
+        """自治体のデータに使った駅ページのURLを記録する."""
+        with self._lock:
+            entry = self._load()["municipalities"].setdefault(man_name, {})
+            entry["stations"] = sorted({normalize_wiki_url(url) for url in urls})
+
+    def municipality_url(self, man_name: str) -> Optional[str]:
+        """記録された自治体ページのURLを返す. 記録がなければNone."""
+        with self._lock:
+            return self._load()["municipalities"].get(man_name, {}).get("url")
+
+    def station_urls(self, man_name: str) -> Optional[List[str]]:
+        """記録された自治体の駅ページのURLのリストを返す. 記録がなければNone."""
+        with self._lock:
+            return self._load()["municipalities"].get(man_name, {}).get("stations")
+
+    def save(self) -> None:
+        """ファイルに保存する. 読み込んでいなければ何もしない."""
+        with self._lock:
+            if self._data is None:
+                return
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False)
+
+    def use_shard(self, shard: Shard) -> None:
+        """保存するファイルをシャードのパーティションにする. 読み込みは全てのパーティションから行う."""
+        with self._lock:
+            self.path = shard.partition_path(self._base_path)
+
+
+revision_store = RevisionStore(**revision_config)
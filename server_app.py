@@ -1,30 +1,108 @@
-from flask import Flask, render_template
-import re
+from flask import Flask, Response, jsonify, render_template, request
+from log_index import LogIndex
+from metrics import load_snapshot, to_prometheus
+from settings import LOG_PATH
+from time import sleep
+import json
 
 app = Flask(__name__, template_folder=".")
+# ログは前回読んだところから後ろだけを読んで索引に足す.
+log_index = LogIndex(LOG_PATH)
+# トップページに表示するログの行数.
+PAGE_SIZE = 200
+# ライブ表示で新しい行を確認する間隔（秒）.
+STREAM_INTERVAL = 1.0
 
 
 @app.route("/")
 def index():
-    try:
-        with open("log.log") as f:
-            log_list = [
-                re.sub(r"\[.*?\] ", "", line.strip(), count=1) for line in f.readlines()
-            ]
-        if "summary:" in log_list:
-            sum_index = log_list.index("summary:")
-            summary = log_list[sum_index + 1 :]  # noqa: E203
-            log_list = log_list[:sum_index]
-        else:
-            summary = []
-        data_num = len([line for line in log_list if "got" in line])
-    except Exception as e:
-        print(e)
-        log_list = []
-        summary = []
-        data_num = 0
+    log_index.update()
+    stats = log_index.stats()
+    summary_start = stats["summary_start"]
+    # まとめより前の最後のPAGE_SIZE行を表示し, 続きはライブ表示で足していく.
+    page = log_index.lines(-PAGE_SIZE, PAGE_SIZE, end=summary_start)
+    log_list = [line["text"] for line in page["lines"]]
+    summary = (
+        [line["text"] for line in log_index.tail(summary_start, stats["lines"])]
+        if summary_start is not None
+        else []
+    )
+    # 合計時間の長い処理から並べる.
+    timings = sorted(
+        (
+            (name, histogram["count"], histogram["sum"], histogram["max"])
+            for name, histogram in load_snapshot()["histograms"].items()
+        ),
+        key=lambda row: row[2],
+        reverse=True,
+    )
     return render_template(
-        "test.html", log_list=log_list, summary=summary, data_num=data_num
+        "test.html",
+        log_list=log_list,
+        log_total=page["total"],
+        last_line=stats["lines"] - 1,
+        live=summary_start is None,
+        summary=summary,
+        data_num=stats["got"],
+        timings=timings,
+    )
+
+
+@app.route("/log/lines")
+def log_lines():
+    """ログの行を一ページ分返す. start（負なら後ろから）, count, level, qで指定する."""
+    log_index.update()
+    return jsonify(
+        log_index.lines(
+            request.args.get("start", -PAGE_SIZE, type=int),
+            min(request.args.get("count", PAGE_SIZE, type=int), 5000),
+            request.args.get("level") or None,
+            request.args.get("q") or None,
+        )
+    )
+
+
+@app.route("/log/stats")
+def log_stats():
+    log_index.update()
+    return jsonify(log_index.stats())
+
+
+@app.route("/log/stream")
+def log_stream():
+    """ログに追記された行をserver-sent eventsで送り続ける. 行番号をイベントのidにする."""
+    after = request.headers.get("Last-Event-ID", type=int)
+    if after is None:
+        after = request.args.get("after", len(log_index) - 1, type=int)
+
+    def generate(after: int):
+        while True:
+            log_index.update()
+            lines = log_index.tail(after)
+            for line in lines:
+                after = line["n"]
+                yield f"id: {after}\ndata: {json.dumps(line, ensure_ascii=False)}\n\n"
+            if not lines:
+                # 切断されたことに気づけるように空のコメントを送る.
+                yield ":\n\n"
+                sleep(STREAM_INTERVAL)
+
+    return Response(
+        generate(after),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/metrics.json")
+def metrics_json():
+    return jsonify(load_snapshot())
+
+
+@app.route("/metrics")
+def metrics_text():
+    return Response(
+        to_prometheus(load_snapshot()), mimetype="text/plain; version=0.0.4"
     )
 
 
@@ -12,7 +12,69 @@ INPUT_PATH = os.environ.get("INPUT_PATH")
 RESULT_PATH = os.environ.get("RESULT_PATH")
 PRIORITY_DATA_PATH = os.environ.get("PRIORITY_DATA_PATH")
 ADDRESS_DATA_PATH = os.environ.get("ADDRESS_DATA_PATH")
+# 所在地のcsvを解析した結果の保存先. csvが更新されたら作り直す. 空なら保存しない.
+ADDRESS_CACHE_PATH = os.environ.get("ADDRESS_CACHE_PATH", "address_data.pickle")
 WIKI_STORAGE_DIR = os.environ.get("WIKI_STORAGE_DIR")
+# 自治体ページのhtmlをまとめて保存するパックのパス. 空ならWIKI_STORAGE_DIRに一件ずつ保存する.
+WIKI_PACK_PATH = os.environ.get("WIKI_PACK_PATH", "")
+STATION_LINKS_PATH = os.environ.get("STATION_LINKS_PATH", "station_links.json")
+# 実行中に記録したエラーの保存先
+ERRORS_PATH = os.environ.get("ERRORS_PATH", "errors.json")
+# エラーを一件ずつ追記する保存先と, エラーの種類ごとにメモリに持つ見本の数
+ERRORS_LOG_PATH = os.environ.get("ERRORS_LOG_PATH", "errors.jsonl")
+ERROR_SAMPLES = int(os.environ.get("ERROR_SAMPLES", "20"))
+# データの保存方法（files: json/csvファイル, sqlite: SQLiteファイル）とSQLiteファイルのパス
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "files")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "station_data.sqlite3")
+# ローデータのジャーナルにこの件数たまったらraw.jsonにまとめる
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", "100"))
+# 取得の並列数とホストごとのアクセス頻度（リクエスト/秒, バースト数）
+FETCH_RATE = float(os.environ.get("FETCH_RATE", "0.36"))
+FETCH_BURST = float(os.environ.get("FETCH_BURST", "1"))
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "1"))
+# HTTPリクエストに付けるUser-Agent
+USER_AGENT = os.environ.get(
+    "USER_AGENT",
+    "year_of_station_by_municipality "
+    "(+https://github.com/aiwaka/year_of_station_by_municipality)",
+)
+# 駅ページキャッシュの保存先, 有効期限（秒）, 合計サイズの上限（バイト）
+STATION_CACHE_DIR = os.environ.get("STATION_CACHE_DIR", "station_page_cache/")
+STATION_CACHE_TTL = float(os.environ.get("STATION_CACHE_TTL", str(30 * 24 * 3600)))
+STATION_CACHE_MAX_BYTES = int(
+    os.environ.get("STATION_CACHE_MAX_BYTES", str(2 * 1024 ** 3))
+)
+# Wikipediaのタイトル一覧ファイル（jawiki-latest-all-titles-in-ns0.gz）のパス. なくてもよい.
+TITLE_INDEX_PATH = os.environ.get("TITLE_INDEX_PATH", "")
+# 駅情報の取得方法. htmlは駅ページを一件ずつ取得し, wikitextはAPIでウィキテキストを50件ずつまとめて取得する.
+STATION_FETCH_BACKEND = os.environ.get("STATION_FETCH_BACKEND", "html")
+# MediaWiki APIのURL. ローカルのスタブサーバーで試すときに変える.
+WIKI_API_URL = os.environ.get("WIKI_API_URL", "https://ja.wikipedia.org/w/api.php")
+# ja.wikipediaの代わりにリクエストを送るURL. ベンチマークでローカルの再生サーバーに向けるときに使う.
+WIKI_BASE_URL = os.environ.get("WIKI_BASE_URL", "")
+# 駅ページの解析方法（soup, fast, tokenizer, lxml）. fastはtokenizerと同じ
+EXTRACTOR_ENGINE = os.environ.get("EXTRACTOR_ENGINE", "soup")
+# 駅ページを読みながら解析し, 導入部のinfoboxを読み終えたら残りを読まないかどうか（soupでは使わない）
+STREAM_STATION_PAGES = os.environ.get("STREAM_STATION_PAGES", "0") == "1"
+# 所在地データだけで自治体に属さないと分かる駅のページを取得しないかどうか
+GAZETTEER_SKIP_FETCH = os.environ.get("GAZETTEER_SKIP_FETCH", "0") == "1"
+# 収集パイプラインの段階の間のキューの大きさ, ページを取得する段階のスレッド数, 解析のプロセス数（0なら取得したスレッドで解析）
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "8"))
+PIPELINE_FETCH_WORKERS = int(os.environ.get("PIPELINE_FETCH_WORKERS", "2"))
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", "0"))
+# 駅ページから抜き出したデータ（駅レコード）の保存先
+STATION_RECORD_PATH = os.environ.get("STATION_RECORD_PATH", "station_records.jsonl")
+# 自治体ページから取り出した鉄道の節の断片（駅リンクなど）の保存先
+RAILWAY_FRAGMENT_PATH = os.environ.get(
+    "RAILWAY_FRAGMENT_PATH", "railway_fragments.jsonl"
+)
+# ログファイルのパス. server_appが読む.
+LOG_PATH = os.environ.get("LOG_PATH", "log.log")
+# 処理時間と回数の集計の書き出し先と, 書き出す最短の間隔（秒）. server_appが読む.
+METRICS_PATH = os.environ.get("METRICS_PATH", "metrics.json")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "5"))
+# 取得したページの版番号と自治体ごとの依存ページの保存先（--refreshで使う）
+REVISIONS_PATH = os.environ.get("REVISIONS_PATH", "page_revisions.json")
 
 file_manager_config = {
     "raw_path": RAW_PATH,
@@ -20,5 +82,65 @@ file_manager_config = {
     "result_path": RESULT_PATH,
     "priority_data_path": PRIORITY_DATA_PATH,
     "address_data_path": ADDRESS_DATA_PATH,
+    "address_cache_path": ADDRESS_CACHE_PATH,
     "wiki_storage_dir": WIKI_STORAGE_DIR,
+    "wiki_pack_path": WIKI_PACK_PATH,
+    "station_links_path": STATION_LINKS_PATH,
+    "errors_path": ERRORS_PATH,
+    "journal_compact_every": JOURNAL_COMPACT_EVERY,
+}
+
+rate_limiter_config = {
+    "rate": FETCH_RATE,
+    "capacity": FETCH_BURST,
+}
+
+crawler_config = {
+    "fetch_workers": FETCH_WORKERS,
+    "extractor_engine": EXTRACTOR_ENGINE,
+    "title_index_path": TITLE_INDEX_PATH,
+    "station_backend": STATION_FETCH_BACKEND,
+    "stream_station_pages": STREAM_STATION_PAGES,
+    "api_url": WIKI_API_URL,
+}
+
+collector_config = {
+    "gazetteer_skip_fetch": GAZETTEER_SKIP_FETCH,
+    "pipeline_queue_size": PIPELINE_QUEUE_SIZE,
+    "pipeline_fetch_workers": PIPELINE_FETCH_WORKERS,
+    "parse_workers": PARSE_WORKERS,
+}
+
+session_pool_config = {
+    "user_agent": USER_AGENT,
+    "max_idle": FETCH_WORKERS,
+    "base_url": WIKI_BASE_URL,
+}
+
+station_cache_config = {
+    "cache_dir": STATION_CACHE_DIR,
+    "ttl": STATION_CACHE_TTL,
+    "max_bytes": STATION_CACHE_MAX_BYTES,
+}
+
+station_record_config = {
+    "path": STATION_RECORD_PATH,
+}
+
+revision_config = {
+    "path": REVISIONS_PATH,
+}
+
+railway_fragment_config = {
+    "path": RAILWAY_FRAGMENT_PATH,
+}
+
+error_storage_config = {
+    "path": ERRORS_LOG_PATH,
+    "max_samples": ERROR_SAMPLES,
+}
+
+metrics_config = {
+    "path": METRICS_PATH,
+    "interval": METRICS_INTERVAL,
 }
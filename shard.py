@@ -0,0 +1,114 @@
+"""自治体リストの分割
+
+自治体リストを決まった規則でN個に分け, 複数のプロセスやマシンで分担して収集できるようにする.
+分担した実行（シャード）はローデータ・結果・駅レコードなどをそれぞれ別のファイル（パーティション）に書くので,
+同じディレクトリを共有していても書き込みがぶつからない. 最後にmain.pyの--mergeでまとめる.
+
+"""
+
+import os
+import re
+import zlib
+from typing import Dict, Final, List, Tuple
+from resolver import split_man_name
+
+# パーティションのファイル名につける印. raw.json → raw.shard-0-of-4.json
+PARTITION_PATTERN: Final = re.compile(r"\.shard-(\d+)-of-(\d+)$")
+
+
+def stable_hash(text: str) -> int:
+    """実行ごとに変わらない文字列のハッシュ値を返す."""
+    return zlib.crc32(text.encode("utf-8"))
+
+
+class Shard:
+    """自治体リストの分担
+
+    Attributes:
+        METHODS (Tuple[str, ...]): 分け方の名前. hashは自治体名のハッシュで,
+            prefectureは都道府県（政令市の区は市）ごとに均等になるように分ける.
+        index (int): 何番目のシャードか. 0から数える.
+        count (int): シャードの数.
+        method (str): 分け方.
+
+    Args:
+        index (int): 何番目のシャードか. 0から数える.
+        count (int): シャードの数.
+        method (str, optional): 分け方.
+    """
+
+    METHODS: Final[Tuple[str, ...]] = ("hash", "prefecture")
+
+    def __init__(self, index: int, count: int, method: str = "hash") -> None:
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"invalid shard : {index}/{count}")
+        if method not in self.METHODS:
+            raise ValueError(f"unknown shard method : {method}")
+        self.index = index
+        self.count = count
+        self.method = method
+
+    @classmethod
+    def parse(cls, text: str, method: str = "hash") -> "Shard":
+        """「i/N」の形の文字列からシャードを作る."""
+        index, _, count = text.partition("/")
+        try:
+            return cls(int(index), int(count), method)
+        except ValueError:
+            raise ValueError(f"shard must be like 0/4 : {text}") from None
+
+    def __repr__(self) -> str:
+        return f"Shard({self.index}, {self.count}, {self.method!r})"
+
+    @property
+    def suffix(self) -> str:
+        return f".shard-{self.index}-of-{self.count}"
+
+    def partition_path(self, path: str) -> str:
+        """ファイルのパスからこのシャードのパーティションのパスを作る."""
+        root, ext = os.path.splitext(path)
+        return root + self.suffix + ext
+
+    def select(self, man_list: List[str]) -> List[str]:
+        """自治体リストからこのシャードが受け持つものを元の順番のまま返す.
+
+        Args:
+            man_list (List[str]): 自治体名リスト.
+
+        Returns:
+            List[str]: このシャードの自治体名リスト.
+        """
+        if self.method == "hash":
+            return [
+                man_name
+                for man_name in man_list
+                if stable_hash(man_name) % self.count == self.index
+            ]
+        # 都道府県ごとに順番に配り, 都道府県ごとに配り始めるシャードをずらす.
+        positions: Dict[str, int] = {}
+        result: List[str] = []
+        for man_name in man_list:
+            group = names[0] if (names := split_man_name(man_name)) else ""
+            position = positions.get(group, stable_hash(group))
+            positions[group] = position + 1
+            if position % self.count == self.index:
+                result.append(man_name)
+        return result
+
+
+def partition_paths(path: str) -> List[str]:
+    """パスに対して存在するパーティションのパスをシャードの番号順に返す."""
+    root, ext = os.path.splitext(path)
+    directory = os.path.dirname(root) or "."
+    base_name = os.path.basename(root)
+    found: List[Tuple[int, str]] = []
+    if not os.path.isdir(directory):
+        return []
+    for file_name in os.listdir(directory):
+        name, file_ext = os.path.splitext(file_name)
+        if file_ext != ext or not name.startswith(base_name):
+            continue
+        suffix = name[len(base_name) :]  # noqa: E203
+        if (match := PARTITION_PATTERN.match(suffix)) is not None:
+            found.append((int(match.group(1)), os.path.join(directory, file_name)))
+    return [found_path for _, found_path in sorted(found)]
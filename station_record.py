@@ -0,0 +1,232 @@
+"""駅レコード
+
+駅ページから必要な情報（所在地と開業年）だけを抜き出した小さなオブジェクトと, そのメモを扱う.
+一度解析した駅は複数の自治体から参照されてもhtmlを解析し直さずに済むようにする.
+
+"""
+
+import os
+import json
+import threading
+from typing import Any, Dict, Final, List, Optional, Union
+from filemanager import file_manager, SQLiteDataIO
+from page_cache import normalize_wiki_url
+from shard import Shard, partition_paths
+from settings import station_record_config
+
+
+class StationRecord:
+    """駅ページから抜き出したデータ
+
+    Attributes:
+        name (str): 駅名（最初に取得したときのリンクのテキスト）.
+        url (str): 正規化された駅ページのURL.
+        address_list (List[str]): 駅ページに記載された所在地のリスト. "ケ"は小文字に置き換え済み.
+        opening_year (int | None): 開業年. 複数ある場合は最古のもの. 取得できなければNone.
+    """
+
+    __slots__ = ("name", "url", "address_list", "opening_year")
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        address_list: List[str],
+        opening_year: Optional[int],
+    ) -> None:
+        self.name = name
+        self.url = normalize_wiki_url(url)
+        self.address_list = address_list
+        self.opening_year = opening_year
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "address_list": self.address_list,
+            "opening_year": self.opening_year,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StationRecord":
+        return cls(
+            data["name"], data["url"], data["address_list"], data["opening_year"]
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"StationRecord({self.name!r}, {self.url!r}, "
+            f"{self.address_list!r}, {self.opening_year!r})"
+        )
+
+
+class StationRecordStore:
+    """駅レコードのメモ
+
+    URLをキーに駅レコードをメモリ上に持ち, 追加したものはjsonl形式でファイルに追記していく.
+    次回以降の実行では最初にファイルを読み込むので, 一度解析した駅はhtmlを取得も解析もしない.
+    シャードのパーティションのファイルもあれば読み込むので, 分担して取得した駅も使える.
+    同じ内容の駅レコードは追記せず, 上書きや無効にした行が増えたファイルは読み込んだときに作り直す.
+
+    Attributes:
+        path (str): 保存するjsonlファイルのパス. シャードを使うときはそのパーティション.
+        hits (int): この実行でメモから返した回数.
+        misses (int): この実行でメモになかった回数.
+
+    Args:
+        path (str): 保存するjsonlファイルのパス.
+    """
+
+    # 追記するファイルの行数が駅レコードの数のこの倍を超えていたら, 読み込んだときに作り直す.
+    COMPACT_RATIO: Final[float] = 2.0
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._base_path = path
+        self.hits = 0
+        self.misses = 0
+        self._records: Union[Dict[str, StationRecord], None] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, StationRecord]:
+        # 初回アクセス時にファイルを読み込む. 後から書かれた行で上書きする.
+        if self._records is None:
+            records: Dict[str, StationRecord] = {}
+            # 作り直すときは追記するファイルに書かれた分だけを書き戻す.
+            own: Dict[str, StationRecord] = {}
+            lines = 0
+            for path in [self._base_path] + partition_paths(self._base_path):
+                if not os.path.isfile(path):
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        is_own = path == self.path
+                        lines += int(is_own)
+                        try:
+                            data = json.loads(line)
+                            if data.get("deleted"):
+                                # 無効にした印の行. それより前の同じURLの行を消す.
+                                records.pop(data["url"], None)
+                                own.pop(data["url"], None)
+                                continue
+                            record = StationRecord.from_dict(data)
+                        except (ValueError, KeyError, AttributeError):
+                            # 書き込み途中で落ちた行などは無視する.
+                            continue
+                        records[record.url] = record
+                        if is_own:
+                            own[record.url] = record
+            self._records = records
+            # シャードのパーティションに書くときは, 前のファイルで書いた分を消した印が要るので作り直さない.
+            stale = lines > len(own) * self.COMPACT_RATIO
+            if stale and self.path == self._base_path:
+                self._compact(own)
+        return self._records
+
+    def _compact(self, records: Dict[str, StationRecord]) -> None:
+        # このファイルに書かれた今の駅レコードだけで作り直す. 無効にした印の行はもういらない.
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records.values():
+                f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def get(self, url: str) -> Union[StationRecord, None]:
+        """URLに対する駅レコードを返す. なければNone.
+
+        Args:
+            url (str): 駅ページのURL.
+
+        Returns:
+            StationRecord | None: 駅レコード.
+        """
+        with self._lock:
+            record = self._load().get(normalize_wiki_url(url))
+            if record is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return record
+
+    def put(self, record: StationRecord) -> None:
+        """駅レコードを追加してファイルに追記する. 同じ内容の駅レコードがあれば何もしない.
+
+        Args:
+            record (StationRecord): 追加する駅レコード.
+        """
+        with self._lock:
+            records = self._load()
+            if (old := records.get(record.url)) and old.to_dict() == record.to_dict():
+                return
+            records[record.url] = record
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record.to_dict(), ensure_ascii=False) + "\n")
+
+    def invalidate(self, url: str) -> None:
+        """駅レコードを無効にする. 次に引かれたときは駅ページを取得し直す.
+
+        ファイルには無効にした印の行を追記するので, 次回以降の実行でも無効のまま.
+
+        Args:
+            url (str): 駅ページのURL.
+        """
+        url = normalize_wiki_url(url)
+        with self._lock:
+            if self._load().pop(url, None) is None:
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"url": url, "deleted": True}) + "\n")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+    def use_shard(self, shard: Shard) -> None:
+        """追記するファイルをシャードのパーティションにする. 読み込みは全てのパーティションから行う."""
+        with self._lock:
+            self.path = shard.partition_path(self._base_path)
+
+
+class SQLiteStationRecordStore:
+    """SQLiteの駅テーブルを使う駅レコードのメモ
+
+    StationRecordStoreと同じインターフェースで, 引かれたURLの行だけを読み込む.
+
+    Args:
+        io (SQLiteDataIO): 駅テーブルを持つデータ入出力.
+    """
+
+    def __init__(self, io: SQLiteDataIO) -> None:
+        self.io = io
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Union[StationRecord, None]:
+        data = self.io.load_station_record(normalize_wiki_url(url))
+        with self._lock:
+            if data:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return StationRecord.from_dict(data) if data else None
+
+    def put(self, record: StationRecord) -> None:
+        self.io.save_station_record(record.to_dict())
+
+    def invalidate(self, url: str) -> None:
+        self.io.delete_station_record(normalize_wiki_url(url))
+
+    def __len__(self) -> int:
+        return self.io.count_station_records()
+
+    def use_shard(self, shard: Shard) -> None:
+        """SQLiteファイルはfile_managerでシャードごとになるので何もしない."""
+
+
+if isinstance(file_manager, SQLiteDataIO):
+    station_record_store: Union[
+        StationRecordStore, SQLiteStationRecordStore
+    ] = SQLiteStationRecordStore(file_manager)
+else:
+    station_record_store = StationRecordStore(**station_record_config)
@@ -0,0 +1,82 @@
+"""駅ページの取得まわりの確認"""
+
+import http.server
+import socket
+import threading
+import pytest
+from crawl import Crawler, SessionPool, decode_html
+
+HTML = "<html><th>所在地</th><td>京都府京都市</td></html>"
+
+
+@pytest.mark.parametrize("charset", [None, "utf-8", "UTF8", "unknown-charset"])
+def test_decode_html_utf8(charset):
+    body = HTML.encode("utf-8")
+    html, cached = decode_html(body, charset)
+    assert html == HTML
+    assert cached is body
+
+
+def test_decode_html_other_charset():
+    html, cached = decode_html(HTML.encode("euc-jp"), "EUC-JP")
+    assert html == HTML
+    # キャッシュにはutf-8で保存する.
+    assert cached == HTML.encode("utf-8")
+
+
+def test_decode_html_truncated():
+    # 途中で読むのをやめた中身は文字の途中で切れていることがある.
+    html, _ = decode_html(HTML.encode("utf-8")[:-10], "utf-8")
+    assert html.startswith("<html><th>所在地</th><td>京都府")
+
+
+def test_session_pool_closes_connection_on_timeout():
+    # 接続は受け付けるが何も返さないサーバー.
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    host, port = server.getsockname()
+    pool = SessionPool("test", timeout=0.2)
+    acquired = []
+    acquire = pool._acquire
+
+    def record_acquire(scheme, netloc):
+        acquired.append(acquire(scheme, netloc))
+        return acquired[-1]
+
+    pool._acquire = record_acquire
+    try:
+        with pytest.raises(OSError):
+            pool.request(f"http://{host}:{port}/")
+    finally:
+        server.close()
+    # タイムアウトは繋ぎ直さず, 使った接続は閉じてプールにも戻さない.
+    assert len(acquired) == 1
+    assert acquired[0].sock is None
+    assert not pool._idle
+
+
+def test_fetch_html_uses_response_charset():
+    body = HTML.encode("euc-jp")
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=EUC-JP")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address
+        crawler = Crawler(priority_data={})
+        assert crawler.fetch_html(f"http://{host}:{port}/wiki/Kyoto") == HTML
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,60 @@
+"""鉄道の節の断片の保存の確認"""
+
+from fragment import RailwayFragment, RailwayFragmentStore
+from shard import Shard
+
+LINKS = {"京都駅": "/wiki/京都駅"}
+
+
+def count_lines(path) -> int:
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def test_reload_and_delete(tmp_path):
+    path = str(tmp_path / "fragments.jsonl")
+    store = RailwayFragmentStore(path)
+    store.put(RailwayFragment("京都府京都市", "v1", LINKS, "", "<ul></ul>"))
+    store.put(RailwayFragment("京都府宇治市", "v1", {}, "廃線", "<p></p>"))
+    store.delete("京都府宇治市")
+    reloaded = RailwayFragmentStore(path)
+    assert reloaded.get("京都府京都市", "v1").links == LINKS
+    # 版が違う断片はないものとして扱う.
+    assert reloaded.get("京都府京都市", "v2") is None
+    assert reloaded.get("京都府宇治市", "v1") is None
+    assert len(reloaded) == 1
+
+
+def test_reextract_does_not_grow_the_file(tmp_path):
+    path = str(tmp_path / "fragments.jsonl")
+    store = RailwayFragmentStore(path)
+    for _ in range(3):
+        store.put(RailwayFragment("京都府京都市", "v1", LINKS, "", "<ul></ul>"))
+    assert count_lines(path) == 1
+    for version in ("v2", "v3", "v4"):
+        store.put(RailwayFragment("京都府京都市", version, LINKS, "", "<ul></ul>"))
+    store.put(RailwayFragment("京都府宇治市", "v4", {}, "", "<p></p>"))
+    store.delete("京都府宇治市")
+    assert count_lines(path) == 6
+    # 読み込んだときに今の断片だけのファイルに作り直す.
+    reloaded = RailwayFragmentStore(path)
+    assert reloaded.get("京都府京都市", "v4") is not None
+    assert count_lines(path) == 1
+    again = RailwayFragmentStore(path)
+    assert again.get("京都府京都市", "v4") is not None
+    assert again.get("京都府宇治市", "v4") is None
+
+
+def test_compact_keeps_partitions_out_of_base_file(tmp_path):
+    path = str(tmp_path / "fragments.jsonl")
+    store = RailwayFragmentStore(path)
+    for version in ("v1", "v2", "v3"):
+        store.put(RailwayFragment("京都府京都市", version, LINKS, "", "<ul></ul>"))
+    sharded = RailwayFragmentStore(path)
+    sharded.use_shard(Shard(0, 2))
+    sharded.put(RailwayFragment("京都府宇治市", "v3", {}, "", "<p></p>"))
+    reloaded = RailwayFragmentStore(path)
+    assert reloaded.get("京都府宇治市", "v3") is not None
+    # パーティションの断片は元のファイルに書き戻さない.
+    assert count_lines(path) == 1
+    assert count_lines(Shard(0, 2).partition_path(path)) == 1
@@ -0,0 +1,68 @@
+"""駅の地名辞典の確認"""
+
+import pytest
+from gazetteer import Gazetteer, MunicipalityTrie
+
+MAN_LIST = [
+    "奈良県高取町",
+    "奈良県明日香村",
+    "奈良県大和郡山市",
+    "山形県河北町",
+    "山形県西川町",
+    "北海道中標津町",
+    "福島県郡山市",
+    "京都府京都市",
+    "京都市北区",
+]
+
+
+@pytest.fixture
+def trie():
+    trie = MunicipalityTrie()
+    for man_name in MAN_LIST:
+        trie.insert(man_name)
+    return trie
+
+
+@pytest.mark.parametrize(
+    "address, expected",
+    [
+        # 郡名に"市"や"村"を含むもの
+        ("奈良県高市郡高取町大字観覚寺", {"奈良県高取町"}),
+        ("奈良県高市郡明日香村大字岡", {"奈良県明日香村"}),
+        ("山形県西村山郡河北町谷地", {"山形県河北町"}),
+        ("北海道標津郡中標津町", {"北海道中標津町"}),
+        # 郡を含む自治体名
+        ("奈良県大和郡山市北郡山町", {"奈良県大和郡山市"}),
+        ("福島県郡山市燧田", {"福島県郡山市"}),
+        ("京都府京都市北区上賀茂", {"京都府京都市", "京都市北区"}),
+        ("山形県西置賜郡小国町", set()),
+    ],
+)
+def test_locate(trie, address, expected):
+    assert trie.locate(address) == expected
+
+
+def test_excludes():
+    rows = [
+        ("岡寺", "29", "奈良県高市郡明日香村大字岡"),
+        ("壺阪山", "29", "奈良県高市郡高取町大字観覚寺"),
+        # 同名の駅の一方が自治体に当てはまらなければページで確かめる.
+        ("北山", "26", "京都府京都市北区上賀茂"),
+        ("北山", "99", "どこか"),
+    ]
+    gazetteer = Gazetteer(rows, MAN_LIST)
+    assert gazetteer.is_member("奈良県明日香村", "岡寺駅")
+    assert gazetteer.excludes("奈良県高取町", "岡寺駅")
+    assert not gazetteer.excludes("奈良県明日香村", "岡寺駅")
+    assert not gazetteer.excludes("奈良県高取町", "北山駅")
+    assert not gazetteer.excludes("奈良県高取町", "存在しない駅")
+
+
+def test_is_member_checks_page_prefecture():
+    rows = [("北山", "26", "京都府京都市北区上賀茂")]
+    gazetteer = Gazetteer(rows, MAN_LIST)
+    assert gazetteer.is_member("京都府京都市", "北山駅", ["京都府京都市北区上賀茂"])
+    # 別の県の同名駅のページなら所在地データだけでは決めない.
+    assert not gazetteer.is_member("京都府京都市", "北山駅", ["岩手県盛岡市"])
+    assert not gazetteer.is_member("京都府京都市", "北山駅", [])
@@ -0,0 +1,86 @@
+"""駅ページの高速な抽出がBeautifulSoupによる抽出と同じ結果になることの確認"""
+
+import os
+import glob
+import gzip
+import pytest
+from crawl import Crawler, station_data_from_rows
+from infobox import StreamingHeaderRows, extract_header_rows
+from settings import STATION_CACHE_DIR
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "station_pages")
+# 記録した駅ページ. 駅ページキャッシュがあればその中身も使う.
+RECORDED_PAGES = sorted(glob.glob(os.path.join(DATA_DIR, "*.html")))
+CACHED_PAGES = sorted(
+    glob.glob(os.path.join(STATION_CACHE_DIR or "", "**", "*.html.gz"), recursive=True)
+)[:200]
+
+# 壊れたhtmlなど, 以前の実装で結果が変わっていたもの.
+EDGE_CASES = [
+    # thの次の兄弟要素が子を持たない要素
+    "<table><tr><th>所在地</th><img src=x><td>京都府京都市</td></tr></table>",
+    "<table><tr><th>開業年月日</th><br/><td>1900年</td></tr></table>",
+    # thの次の兄弟要素がscript
+    "<table><tr><th>所在地</th><script>京都府京都市</script></tr></table>",
+    # 兄弟要素の中のscriptのテキストは含めない
+    "<table><tr><th>所在地</th><td>京都府<script>x</script>京都市</td></tr></table>",
+    # 開いていない終了タグでテキストが区切られる
+    "<table><tr><th>所在地</th><td><a>\n</b> <a>京都府</a></td></tr></table>",
+    # thの中のth
+    "<th><th>開業年月日</th> \n</th>開業年月日<hr/><p>1914年</p>",
+    "",
+    " \n",
+]
+
+
+def read_page(path: str) -> bytes:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(scope="module")
+def crawlers():
+    return {
+        engine: Crawler(extractor_engine=engine, priority_data={})
+        for engine in ("soup", "fast", "tokenizer")
+    }
+
+
+def assert_same_as_soup(crawlers, html: bytes) -> None:
+    expected = crawlers["soup"].parse_station_page(html.decode("utf-8"))
+    assert crawlers["tokenizer"].parse_station_page(html) == expected
+    assert crawlers["fast"].parse_station_page(html) == expected
+    # 少しずつ渡しても同じ.
+    rows = StreamingHeaderRows()
+    for start in range(0, len(html), 7):
+        rows.feed(html[start : start + 7])  # noqa: E203
+    assert station_data_from_rows(rows.close()) == expected
+
+
+@pytest.mark.parametrize("path", RECORDED_PAGES + CACHED_PAGES)
+def test_recorded_pages_match_soup(crawlers, path):
+    assert_same_as_soup(crawlers, read_page(path))
+
+
+@pytest.mark.parametrize("html", EDGE_CASES)
+def test_edge_cases_match_soup(crawlers, html):
+    assert_same_as_soup(crawlers, html.encode("utf-8"))
+
+
+def test_recorded_page_values(crawlers):
+    html = read_page(os.path.join(DATA_DIR, "kyoto.html"))
+    assert crawlers["fast"].parse_station_page(html) == (
+        ["京都市下京区東塩小路町北緯34度59分6秒"],
+        1877,
+    )
+
+
+def test_void_sibling_is_empty():
+    html = "<table><tr><th>所在地</th><img src=x><td>京都府京都市</td></tr></table>"
+    assert extract_header_rows(html) == [("所在地", "")]
+
+
+def test_lxml_empty_document():
+    pytest.importorskip("lxml")
+    assert extract_header_rows(" \n", "lxml") == []
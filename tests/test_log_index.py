@@ -0,0 +1,31 @@
+"""ログの索引の確認"""
+
+import log_index
+from log_index import LogIndex
+
+
+def test_update_in_chunks(tmp_path, monkeypatch):
+    # 行が塊の境目で切れるように, 塊を小さくする.
+    monkeypatch.setattr(log_index, "READ_CHUNK_SIZE", 7)
+    path = tmp_path / "collector.log"
+    lines = [
+        "[I 211005 12:00:00 collector:1] 京都府京都市 : got",
+        "[E 211005 12:00:01 collector:2] 京都府宇治市 : failed",
+        "Traceback (most recent call last):",
+    ]
+    path.write_bytes(("\n".join(lines) + "\n[W 2110").encode("utf-8"))
+    index = LogIndex(str(path))
+    assert index.update() == 3
+    assert index.got_count == 1
+    page = index.lines()
+    assert [line["level"] for line in page["lines"]] == ["I", "E", "E"]
+    assert page["lines"][1]["text"] == "京都府宇治市 : failed"
+    # 書きかけだった行は書き終わってから索引に入る.
+    with open(path, "ab") as f:
+        f.write("05 12:00:02 collector:3] 京都府城陽市 : retry\n".encode("utf-8"))
+    assert index.update() == 1
+    assert index.lines(start=-1)["lines"][0] == {
+        "n": 3,
+        "level": "W",
+        "text": "京都府城陽市 : retry",
+    }
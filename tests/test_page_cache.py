@@ -0,0 +1,21 @@
+"""駅ページキャッシュの確認"""
+
+from page_cache import StationPageCache
+
+URL = "https://ja.wikipedia.org/wiki/京都駅"
+
+
+def test_partial_html_is_a_miss_for_full_readers(tmp_path):
+    cache = StationPageCache(str(tmp_path), 3600, 1024 ** 2)
+    cache.put(URL, b"<html><h2>", etag='"1"', partial=True)
+    # 最後まで読む取得にはないものとして扱う.
+    assert cache.get(URL) is None
+    entry = cache.get(URL, with_html=False, partial_ok=True)
+    assert entry.partial and entry.etag == '"1"'
+    assert cache.read_html(URL, lambda chunk: False) == b"<html><h2>"
+    # 期限切れにしても途中までの印は残る.
+    cache.expire(URL)
+    assert cache.get(URL) is None
+    cache.put(URL, b"<html><h2></html>")
+    entry = cache.get(URL)
+    assert not entry.partial and entry.html == b"<html><h2></html>"
@@ -0,0 +1,54 @@
+"""パイプラインの確認"""
+
+import threading
+from pipeline import Pipeline, Stage
+
+
+def run_with_timeout(pipeline: Pipeline, items, timeout: float = 10.0) -> None:
+    # 止まったままにならないことを確かめるので, 別スレッドで実行して待つ時間を決める.
+    thread = threading.Thread(target=pipeline.run, args=(items,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+
+
+def test_pipeline_passes_items_through_stages():
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    stages = [
+        Stage("double", lambda item: item * 2, workers=3),
+        Stage("skip_odd", lambda item: item if item % 4 == 0 else None, workers=2),
+        Stage("collect", collect),
+    ]
+    run_with_timeout(Pipeline(stages, queue_size=2), range(100))
+    assert sorted(results) == [item * 2 for item in range(0, 100, 2)]
+    assert [stage.processed for stage in stages] == [100, 100, 50]
+
+
+def test_pipeline_finishes_when_on_error_raises():
+    errors = []
+
+    def fail_on_odd(item):
+        if item % 2:
+            raise ValueError(item)
+        return item
+
+    def on_error(item, error, trace):
+        errors.append(item)
+        raise RuntimeError("on_error failed")
+
+    results = []
+    stages = [
+        Stage("fail_on_odd", fail_on_odd, workers=2),
+        Stage("collect", results.append),
+    ]
+    # 段階のスレッドより多く失敗しても, 全てのスレッドが終わる.
+    run_with_timeout(Pipeline(stages, queue_size=1, on_error=on_error), range(20))
+    assert sorted(errors) == list(range(1, 20, 2))
+    assert sorted(results) == list(range(0, 20, 2))
+    assert stages[0].failed == 10
@@ -0,0 +1,52 @@
+"""駅レコードのメモの確認"""
+
+from station_record import StationRecord, StationRecordStore
+
+URL = "https://ja.wikipedia.org/wiki/京都駅"
+OTHER_URL = "https://ja.wikipedia.org/wiki/北山駅_(京都府)"
+
+
+def count_lines(path) -> int:
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def test_reload_and_invalidate(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    store = StationRecordStore(path)
+    store.put(StationRecord("京都駅", URL, ["京都府京都市下京区"], 1877))
+    store.put(StationRecord("北山駅", OTHER_URL, ["京都府京都市北区"], 1997))
+    store.invalidate(OTHER_URL)
+    reloaded = StationRecordStore(path)
+    assert reloaded.get(URL).opening_year == 1877
+    # 無効にした駅は次回の実行でも無効のまま.
+    assert reloaded.get(OTHER_URL) is None
+    assert len(reloaded) == 1
+
+
+def test_unchanged_records_are_not_appended(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    store = StationRecordStore(path)
+    for _ in range(3):
+        store.put(StationRecord("京都駅", URL, ["京都府京都市下京区"], 1877))
+    assert count_lines(path) == 1
+    store.put(StationRecord("京都駅", URL, ["京都府京都市下京区"], 1876))
+    assert count_lines(path) == 2
+    assert StationRecordStore(path).get(URL).opening_year == 1876
+
+
+def test_compact_on_load(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    store = StationRecordStore(path)
+    for year in range(1870, 1880):
+        store.put(StationRecord("京都駅", URL, ["京都府京都市下京区"], year))
+    store.put(StationRecord("北山駅", OTHER_URL, ["京都府京都市北区"], 1997))
+    store.invalidate(OTHER_URL)
+    assert count_lines(path) == 12
+    reloaded = StationRecordStore(path)
+    assert reloaded.get(URL).opening_year == 1879
+    # 読み込んだときに今の駅レコードだけのファイルに作り直す.
+    assert count_lines(path) == 1
+    again = StationRecordStore(path)
+    assert again.get(URL).opening_year == 1879
+    assert again.get(OTHER_URL) is None
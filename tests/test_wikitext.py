@@ -0,0 +1,124 @@
+"""ウィキテキストからの駅情報の取得の確認"""
+
+import os
+import json
+import urllib.request
+import pytest
+import crawl
+from crawl import Crawler
+from page_cache import normalize_wiki_url
+from replay import ReplayCorpus, ReplayServer
+from station_record import StationRecord
+from wikitext import WikitextClient, parse_station_wikitext, strip_markup
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data", "api_responses")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("{{和暦|1914}}[[12月20日]]", "1914年12月20日"),
+        ("{{Start date|1914|12|20}}", "1914年12月20日"),
+        ("{{Start date|df=yes|1997|6|3}}", "1997年6月3日"),
+        ("{{start date and age|1914|12}}", "1914年12月"),
+        ("{{和暦|[[1914年|1914]]}}", "1914年"),
+        ("[[1914年]]（[[大正]]3年）[[12月20日]]", "1914年（大正3年）12月20日"),
+        # 年月日でないテンプレートと脚注, コメントは除く.
+        ("{{lang|en|x}}1900年<ref>{{Cite web|title=y}}</ref><!-- z -->", "1900年"),
+        ("[[京都市]][[北区 (京都市)|北区]]", "京都市北区"),
+        ("{{和暦|明治}}", ""),
+    ],
+)
+def test_strip_markup(value, expected):
+    assert strip_markup(value) == expected
+
+
+def test_parse_station_wikitext():
+    wikitext = (
+        "{{駅情報\n|駅名 = 東京駅\n|所在地 = [[東京都]][[千代田区]]丸の内一丁目\n"
+        "|開業年月日 = {{和暦|1914}}[[12月20日]]\n"
+        "|備考 = {{Start date|2000|1|1}}\n}}"
+    )
+    assert parse_station_wikitext(wikitext) == (
+        ["東京都千代田区丸の内一丁目"],
+        ["1914年12月20日"],
+    )
+    assert parse_station_wikitext("{{駅情報\n|駅名 = 東京駅\n}}") is None
+
+
+@pytest.fixture
+def replay(tmp_path):
+    corpus = ReplayCorpus(str(tmp_path))
+    with open(os.path.join(DATA_DIR, "stations.json"), encoding="utf-8") as f:
+        assert corpus.add_api_response(json.load(f)) == 3
+    corpus.save()
+    # 保存したものを読み込み直しても同じく答える.
+    with ReplayServer(ReplayCorpus(str(tmp_path))) as server:
+        yield server
+
+
+def fetch(url: str) -> bytes:
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def test_replay_wikitext(replay):
+    client = WikitextClient(fetch, replay.base_url + "/w/api.php")
+    pages = client.query_wikitext(["京都駅", "北山駅 (京都府)", "存在しない駅"])
+    assert pages["京都駅"][0] == 101
+    assert "{{和暦|1877}}" in pages["京都駅"][1]
+    assert pages["北山駅 (京都府)"][0] == 202
+    assert pages["存在しない駅"] is None
+    assert client.requests == 1
+
+
+class MemoryRecordStore:
+    def __init__(self):
+        self.records = {}
+
+    def get(self, sta_link):
+        return self.records.get(normalize_wiki_url(sta_link))
+
+    def put(self, record):
+        self.records[record.url] = record
+
+
+class MemoryRevisionStore:
+    def __init__(self):
+        self.revisions = {}
+
+    def record(self, url, revision_id):
+        self.revisions[url] = revision_id
+
+
+def test_wikitext_backend_falls_back_to_html(replay, monkeypatch):
+    record_store = MemoryRecordStore()
+    revision_store = MemoryRevisionStore()
+    monkeypatch.setattr(crawl, "station_record_store", record_store)
+    monkeypatch.setattr(crawl, "revision_store", revision_store)
+    crawler = Crawler(fetch_workers=1, station_backend="wikitext", priority_data={})
+    crawler.wikitext_client = WikitextClient(fetch, replay.base_url + "/w/api.php")
+    fetched = []
+
+    def fetch_station_record(sta_name, sta_link):
+        fetched.append(sta_name)
+        return StationRecord(sta_name, sta_link, ["京都府宇治市"], 1900)
+
+    monkeypatch.setattr(crawler, "fetch_station_record", fetch_station_record)
+    links = {
+        "京都駅": "https://ja.wikipedia.org/wiki/京都駅",
+        "北山駅": "https://ja.wikipedia.org/wiki/北山駅_(京都府)",
+        # 開業年が読み取れないのでhtmlで取得し直す.
+        "仮駅": "https://ja.wikipedia.org/wiki/仮駅",
+    }
+    records = crawler.get_station_record_dict(links)
+    assert records["京都駅"].address_list == ["京都市下京区東塩小路町"]
+    assert records["京都駅"].opening_year == 1877
+    assert records["北山駅"].address_list == ["京都市北区上賀茂岩ヶ垣内町"]
+    assert records["北山駅"].opening_year == 1997
+    assert records["仮駅"].opening_year == 1900
+    assert fetched == ["仮駅"]
+    # 読み取れなかった駅はメモにも版番号にも残さない.
+    assert record_store.get(links["仮駅"]) is None
+    assert record_store.get(links["京都駅"]) is records["京都駅"]
+    assert len(revision_store.revisions) == 2
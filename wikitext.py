@@ -0,0 +1,224 @@
+"""ウィキテキストからの駅情報の取得
+
+駅ページのhtml（数百KB）を一件ずつ取得する代わりに, MediaWiki APIで最大50件分のウィキテキストをまとめて取得し,
+基礎情報テンプレートの「所在地」と「開業年月日」の引数から駅レコードと同じ所在地リストと開業年を作る.
+
+"""
+
+import re
+import json
+import threading
+from html import unescape
+from typing import Callable, Dict, Final, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlencode
+from logzero import logger
+
+# APIの一回の問い合わせで渡せる記事名の数.
+QUERY_TITLES_LIMIT: Final = 50
+# テンプレートとリンクの区切りを見つける.
+TOKEN_PATTERN: Final = re.compile(r"\{\{|\}\}|\[\[|\]\]|\|")
+COMMENT_PATTERN: Final = re.compile(r"<!--.*?-->", re.DOTALL)
+REF_PATTERN: Final = re.compile(
+    r"<ref[^>/]*/>|<ref[^>]*>.*?</ref>", re.DOTALL | re.IGNORECASE
+)
+INNER_TEMPLATE_PATTERN: Final = re.compile(r"\{\{[^{}]*\}\}")
+# 年月日の引数を表示するテンプレート（{{和暦|1914}}, {{Start date|1914|12|20}}など）の名前.
+DATE_TEMPLATE_PATTERN: Final = re.compile(r"和暦|start[ _]date.*|.*年月日.*", re.IGNORECASE)
+LINK_PATTERN: Final = re.compile(r"\[\[(?:[^\[\]|]*\|)?([^\[\]]*)\]\]")
+TAG_PATTERN: Final = re.compile(r"<[^>]+>")
+
+
+def iter_template_params(wikitext: str) -> Iterator[Tuple[str, str]]:
+    """ウィキテキストの全てのテンプレートの名前付き引数を(引数名, 値)で順に返す.
+
+    入れ子のテンプレートやリンクの中の"|"では区切らない. 値は整形しないままのウィキテキスト.
+
+    Args:
+        wikitext (str): ウィキテキスト.
+    """
+    # (種類, 引数の開始位置)のスタック. 種類は"{{"か"[[".
+    stack: List[List] = []
+
+    def param(start: int, end: int) -> Optional[Tuple[str, str]]:
+        name, sep, value = wikitext[start:end].partition("=")
+        return (name.strip(), value) if sep else None
+
+    for match in TOKEN_PATTERN.finditer(wikitext):
+        token = match.group()
+        if token == "{{" or token == "[[":
+            stack.append([token, None])
+        elif token == "|":
+            if stack and stack[-1][0] == "{{":
+                start = stack[-1][1]
+                if start is not None and (item := param(start, match.start())):
+                    yield item
+                stack[-1][1] = match.end()
+        elif token == "]]":
+            if stack and stack[-1][0] == "[[":
+                stack.pop()
+        else:
+            # 閉じていないリンクは捨ててテンプレートの終わりまで戻る.
+            while stack and stack[-1][0] == "[[":
+                stack.pop()
+            if stack:
+                _, start = stack.pop()
+                if start is not None and (item := param(start, match.start())):
+                    yield item
+
+
+def expand_date_template(template: str) -> str:
+    """入れ子のテンプレートを展開する.
+
+    年月日のテンプレートは先頭の数字の引数から"1914年12月20日"の形の文字列にし, それ以外は除く.
+
+    Args:
+        template (str): "{{"と"}}"で囲まれたテンプレート. 中にテンプレートを含まない.
+    """
+    name, *args = LINK_PATTERN.sub(r"\1", template[2:-2]).split("|")
+    if not DATE_TEMPLATE_PATTERN.fullmatch(name.strip()):
+        return ""
+    numbers: List[str] = []
+    # df=yなどの名前付き引数は飛ばし, 順番の引数を先頭から見る.
+    for arg in (arg.strip() for arg in args if "=" not in arg):
+        if not arg.isdecimal() or len(numbers) == 3:
+            break
+        numbers.append(arg)
+    if not numbers or len(numbers[0]) != 4:
+        return ""
+    return "".join(
+        f"{int(number)}{unit}" for number, unit in zip(numbers, ("年", "月", "日"))
+    )
+
+
+def strip_markup(value: str) -> str:
+    """引数の値のウィキテキストを表示されるテキストに近づける.
+
+    コメント・脚注・タグを除き, 入れ子のテンプレートは年月日のものだけを展開して他は除き,
+    リンクは表示される文字列にする.
+    """
+    value = COMMENT_PATTERN.sub("", value)
+    value = REF_PATTERN.sub("", value)
+    while (
+        replaced := INNER_TEMPLATE_PATTERN.sub(
+            lambda match: expand_date_template(match.group()), value
+        )
+    ) != value:
+        value = replaced
+    value = LINK_PATTERN.sub(r"\1", value)
+    value = TAG_PATTERN.sub("", value).replace("'''", "").replace("''", "")
+    return unescape(value).strip()
+
+
+def parse_station_wikitext(
+    wikitext: str,
+) -> Optional[Tuple[List[str], List[str]]]:
+    """駅ページのウィキテキストから所在地と開業年月日の引数の値を取り出す.
+
+    htmlの表見出しと同じく, 名前に"所在地"または"開業年月日"を含む引数を全て対象にする.
+
+    Args:
+        wikitext (str): 駅ページのウィキテキスト.
+
+    Returns:
+        Tuple[List[str], List[str]] | None: 所在地の値のリストと開業年月日の値のリスト（整形済み）.
+            どちらの引数も見つからなければNone（htmlで取得し直す）.
+    """
+    address_values: List[str] = []
+    date_values: List[str] = []
+    for name, value in iter_template_params(wikitext):
+        if "所在地" in name and (text := strip_markup(value)):
+            address_values.append(text)
+        if "開業年月日" in name and (text := strip_markup(value)):
+            date_values.append(text)
+    if not address_values and not date_values:
+        return None
+    return address_values, date_values
+
+
+class WikitextClient:
+    """ウィキテキストをまとめて取得するクライアント
+
+    Attributes:
+        api_url (str): MediaWiki APIのURL. ローカルのスタブサーバーに向けることもできる.
+        fetch (Callable[[str], bytes]): URLを受け取りレスポンスの中身を返す関数.
+        requests (int): 送ったリクエストの数.
+        bytes_received (int): 受け取ったレスポンスの合計バイト数.
+
+    Args:
+        fetch (Callable[[str], bytes]): URLを受け取りレスポンスの中身を返す関数. 取得に失敗したら例外を送る.
+        api_url (str): MediaWiki APIのURL.
+    """
+
+    def __init__(self, fetch: Callable[[str], bytes], api_url: str) -> None:
+        self.fetch = fetch
+        self.api_url = api_url
+        self.requests = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def _query(self, params: Dict[str, str]) -> dict:
+        body = self.fetch(f"{self.api_url}?{urlencode(params)}")
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += len(body)
+        return json.loads(body)
+
+    def query_wikitext(
+        self, titles: List[str]
+    ) -> Dict[str, Union[Tuple[int, str], None]]:
+        """記事の最新版のウィキテキストをQUERY_TITLES_LIMIT件ずつまとめて取得する.
+
+        レスポンスが大きすぎて途中で切られた分は続きを問い合わせる. 失敗した分は結果に含めない.
+
+        Args:
+            titles (List[str]): 記事名のリスト.
+
+        Returns:
+            Dict[str, Tuple[int, str] | None]: 記事名がキー, リダイレクトをたどった記事の(版番号, ウィキテキスト)
+                （存在しなければNone）が値.
+        """
+        result: Dict[str, Union[Tuple[int, str], None]] = {}
+        titles = list(dict.fromkeys(titles))
+        for start in range(0, len(titles), QUERY_TITLES_LIMIT):
+            chunk = titles[start : start + QUERY_TITLES_LIMIT]  # noqa: E203
+            params = {
+                "action": "query",
+                "format": "json",
+                "formatversion": "2",
+                "redirects": "1",
+                "prop": "revisions",
+                "rvprop": "ids|content",
+                "rvslots": "main",
+                "titles": "|".join(chunk),
+            }
+            renamed: Dict[str, str] = {}
+            pages: Dict[str, Union[Tuple[int, str], None]] = {}
+            try:
+                while True:
+                    response = self._query(params)
+                    query = response.get("query", {})
+                    for item in query.get("normalized", []) + query.get(
+                        "redirects", []
+                    ):
+                        renamed[item["from"]] = item["to"]
+                    for page in query.get("pages", []):
+                        if revisions := page.get("revisions"):
+                            revision = revisions[0]
+                            content = revision["slots"]["main"]["content"]
+                            pages[page["title"]] = (revision["revid"], content)
+                        elif page.get("missing") or page.get("invalid"):
+                            pages[page["title"]] = None
+                    if "continue" not in response:
+                        break
+                    params.update(response["continue"])
+            except Exception as e:
+                logger.warning(f"wikitext query failed ({e})")
+                continue
+            for title in chunk:
+                resolved = title
+                # 正規化→リダイレクトの順に変換されることがあるので, 変わらなくなるまでたどる.
+                for _ in range(3):
+                    resolved = renamed.get(resolved, resolved)
+                if resolved in pages:
+                    result[title] = pages[resolved]
+        return result